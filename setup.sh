@@ -9,6 +9,7 @@ add2crontab() {
 
 echo "Update python installation..."
 sudo pip3 install matplotlib --break-system-packages
+sudo pip3 install pillow --break-system-packages
 sudo pip3 install numpy --break-system-packages
 sudo pip3 install astropy --break-system-packages
 sudo pip3 install bottle --break-system-packages
@@ -18,6 +19,9 @@ sudo pip3 install pytz --break-system-packages
 sudo pip3 install astroquery --break-system-packages
 sudo pip3 install spaceweather --break-system-packages
 
+echo "Download the JPL ephemeris DE421..."
+python3 -c "from skyfield.api import Loader; Loader('/home/pi/sky/dso').download('de421.bsp')"
+
 echo "Install DSO service."
 sudo cp /home/pi/sky/dso/dsoserver.service /etc/systemd/system
 sudo systemctl daemon-reload
@@ -26,7 +30,9 @@ sudo systemctl start dsoserver.service
 
 echo "Update crontab..."
 add2crontab "# check DSO visibility for the actual day"
-add2crontab "2 3 * * * python3 /home/pi/sky/dso/DSO_observation_planning.py --catalogue --plot"
+add2crontab "2 3 * * * python3 /home/pi/sky/dso/DSO_observation_planning.py --catalogue"
+add2crontab "# pack past nights into the monthly archive"
+add2crontab "30 4 * * * python3 /home/pi/sky/dso/archive.py"
 
 
 echo "DSO observation tool installation succeeded."
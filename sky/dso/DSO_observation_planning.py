@@ -34,11 +34,18 @@ import ephem
 
 from astropy.visualization import astropy_mpl_style, quantity_support
 import astropy.units as u
-from astropy.coordinates import AltAz, EarthLocation, SkyCoord
+from astropy.coordinates import AltAz, EarthLocation, SkyCoord, get_sun, get_body
 from astropy.time import Time
 from astroquery.simbad import Simbad # https://github.com/astropy/astroquery
 
 import config
+import horizon
+import pipeline
+import scoring
+import sidereal
+import sites
+import thumbnails
+import tracks
 
 debug = False #True
 
@@ -68,6 +75,9 @@ parser.add_option('-c', '--catalogue',
 parser.add_option('-p', '--plot',
     action="store_true", dest="plot",
     help="Create visibility plots", default=False)
+parser.add_option('-s', '--sites',
+    action="store", dest="sites",
+    help="Catalogues of these sites (config.sites) in one run: home,field,... or all", default=None)
 
 parser.add_option('-r', '--direction',
     action="store", dest="direction",
@@ -76,6 +86,9 @@ parser.add_option('-i', '--min_altitude',
     action="store", dest="min_altitude",
     help="Consider minimal altitude for today's suggestion", default="10.0")
 
+parser.add_option('-g', '--progress',
+    action="store_true", dest="progress",
+    help="Report catalogue progress on stdout", default=False)
 parser.add_option('-f', '--debug',
     action="store_true", dest="debug",
     help="Debug mode", default=False)
@@ -112,7 +125,7 @@ if options.dso:
 if options.date:
   the_date = options.date
   today = datetime.date.today()
-  today = today.replace(day=int(the_date.split(".")[0]), month=int(the_date.split(".")[1]), year=int(the_date.split(".")[3]))
+  today = today.replace(day=int(the_date.split(".")[0]), month=int(the_date.split(".")[1]), year=int(the_date.split(".")[2]))
   theDate = today.strftime("%d.%m.%Y")
   theDate_american = today.strftime("%Y-%m-%d")
 else:
@@ -206,6 +219,95 @@ if astronomical_night_start == None and astronomical_night_end == None:
     print("Astronomical night start: " + str(astronomical_night_start))
     print("Astronomical night end: " + str(astronomical_night_end))
 
+def lookup_object_type(the_object_name):
+  # (Simbad object type, description) of a DSO
+  # http://vizier.u-strasbg.fr/cgi-bin/OType?$1
+  result_table = ""
+  object_type = "NONE"
+  try:
+    result_table = Simbad.query_tap("SELECT main_id, otype FROM basic WHERE main_id IN ('" + str(the_object_name) + "')")
+  except Exception as e:
+    print("Simbad lookup error for " + str(the_object_name) + ": " + str(e))
+    result_table = Simbad.query_tap("SELECT main_id, otype FROM basic WHERE main_id IN ('" + str(the_object_name) + "')")
+  if debug:
+    print(result_table)
+    print("Main id: " + str(result_table["main_id"]) + "; " + str(len(result_table["main_id"].pformat())))
+  if len(result_table["main_id"].pformat()) == 2:
+    if debug:
+      print("DSO " + str(the_object_name) + " not found.")
+    #sys.exit(0)
+    object_type = "NONE"
+  else:
+    if len(result_table["main_id"].pformat()) == 3:
+      object_type = result_table["otype"].pformat()[2].strip()
+    if debug:
+      print("Main ID: " + str(result_table["main_id"].pformat()[0].strip())) #Main ID: main_id
+      print("Main ID: " + str(result_table["main_id"].pformat()[1].strip())) #Main ID: -------
+      print("Main ID: " + str(result_table["main_id"].pformat()[2].strip())) #Main ID: M   1
+      print("Object type: " + str(object_type))
+
+  if object_type == "AGN":
+    object_type_string = "Active galaxy nucleus"
+  elif object_type == "SNR":
+    object_type_string = "SuperNova remnant"
+  elif object_type == "SFR":
+    object_type_string = "Star forming region"
+  elif object_type == "SFR":
+    object_type_string = "Star forming region"
+  elif object_type == "GNe":
+    object_type_string = "Nebula"
+  elif object_type == "RNe":
+    object_type_string = "Reflection nebula"
+  elif object_type == "GDNe":
+    object_type_string = "Dark cloud (nebula)"
+  elif object_type == "MoC":
+    object_type_string = "Molecular cloud"
+  elif object_type == "IG":
+    object_type_string = "Interacting galaxies"
+  elif object_type == "PaG":
+    object_type_string = "Pair of galaxies"
+  elif object_type == "GiP":
+    object_type_string = "Galaxy in pair of galaxies"
+  elif object_type == "CGG":
+    object_type_string = "Compact group of galaxies"
+  elif object_type == "CIG":
+    object_type_string = "Cluster of galaxies"
+  elif object_type == "BH":
+    object_type_string = "Black hole"
+  elif object_type == "LSB":
+    object_type_string = "Low surface brightness galaxy"
+  elif object_type == "SBG":
+    object_type_string = "Starburst galaxy"
+  elif object_type == "H2G":
+    object_type_string = "HII galaxy"
+  elif object_type == "GGG":
+    object_type_string = "Galaxy"
+  elif object_type == "Cl":
+    object_type_string = "Cluster of stars"
+  elif object_type == "GlC":
+    object_type_string = "Globular cluster"
+  elif object_type == "OpC":
+    object_type_string = "Open cluster"
+  elif object_type == "Cl*":
+    object_type_string = "Open cluster"
+  elif object_type == "LIN":
+    object_type_string = "LINER-type active galaxy nucleus"
+  elif object_type == "SyG":
+    object_type_string = "Seyfert galaxy"
+  elif object_type == "Sy1":
+    object_type_string = "Seyfert 1 galaxy"
+  elif object_type == "Sy2":
+    object_type_string = "Seyfert 2 galaxy"
+  elif object_type == "GiG":
+    object_type_string = "Galaxy towards a group of galaxies"
+  elif object_type == "As*":
+    object_type_string = "Association of stars"
+  elif object_type == "PN":
+    object_type_string = "Planetary nebula"
+  else:
+    object_type_string = ""
+  return object_type, object_type_string
+
 class DSO:
 
   def __init__(self, the_object_name, today, tomorrow):
@@ -227,90 +329,7 @@ class DSO:
     if debug:
       print("SkyCoord: " + str(self.the_object))
 
-    # http://vizier.u-strasbg.fr/cgi-bin/OType?$1
-    result_table = ""
-    try:
-      result_table = Simbad.query_tap("SELECT main_id, otype FROM basic WHERE main_id IN ('" + str(self.the_object_name) + "')")
-    except Exception as e:
-      print("Simbad lookup error for " + str(self.the_object_name) + ": " + str(e))
-      result_table = Simbad.query_tap("SELECT main_id, otype FROM basic WHERE main_id IN ('" + str(self.the_object_name) + "')")
-    if debug:
-      print(result_table)
-      print("Main id: " + str(result_table["main_id"]) + "; " + str(len(result_table["main_id"].pformat())))
-    if len(result_table["main_id"].pformat()) == 2:
-      if debug:
-        print("DSO " + str(the_object_name) + " not found.")
-      #sys.exit(0)
-      self.object_type = "NONE"
-    else:
-      if len(result_table["main_id"].pformat()) == 3:
-        self.object_type = result_table["otype"].pformat()[2].strip()
-      if debug:
-        print("Main ID: " + str(result_table["main_id"].pformat()[0].strip())) #Main ID: main_id
-        print("Main ID: " + str(result_table["main_id"].pformat()[1].strip())) #Main ID: -------
-        print("Main ID: " + str(result_table["main_id"].pformat()[2].strip())) #Main ID: M   1
-        print("Object type: " + str(self.object_type))
-
-    if self.object_type == "AGN":
-      self.object_type_string = "Active galaxy nucleus"
-    elif self.object_type == "SNR":
-      self.object_type_string = "SuperNova remnant"
-    elif self.object_type == "SFR":
-      self.object_type_string = "Star forming region"
-    elif self.object_type == "SFR":
-      self.object_type_string = "Star forming region"
-    elif self.object_type == "GNe":
-      self.object_type_string = "Nebula"
-    elif self.object_type == "RNe":
-      self.object_type_string = "Reflection nebula"
-    elif self.object_type == "GDNe":
-      self.object_type_string = "Dark cloud (nebula)"
-    elif self.object_type == "MoC":
-      self.object_type_string = "Molecular cloud"
-    elif self.object_type == "IG":
-      self.object_type_string = "Interacting galaxies"
-    elif self.object_type == "PaG":
-      self.object_type_string = "Pair of galaxies"
-    elif self.object_type == "GiP":
-      self.object_type_string = "Galaxy in pair of galaxies"
-    elif self.object_type == "CGG":
-      self.object_type_string = "Compact group of galaxies"
-    elif self.object_type == "CIG":
-      self.object_type_string = "Cluster of galaxies"
-    elif self.object_type == "BH":
-      self.object_type_string = "Black hole"
-    elif self.object_type == "LSB":
-      self.object_type_string = "Low surface brightness galaxy"
-    elif self.object_type == "SBG":
-      self.object_type_string = "Starburst galaxy"
-    elif self.object_type == "H2G":
-      self.object_type_string = "HII galaxy"
-    elif self.object_type == "GGG":
-      self.object_type_string = "Galaxy"
-    elif self.object_type == "Cl":
-      self.object_type_string = "Cluster of stars"
-    elif self.object_type == "GlC":
-      self.object_type_string = "Globular cluster"
-    elif self.object_type == "OpC":
-      self.object_type_string = "Open cluster"
-    elif self.object_type == "Cl*":
-      self.object_type_string = "Open cluster"
-    elif self.object_type == "LIN":
-      self.object_type_string = "LINER-type active galaxy nucleus"
-    elif self.object_type == "SyG":
-      self.object_type_string = "Seyfert galaxy"
-    elif self.object_type == "Sy1":
-      self.object_type_string = "Seyfert 1 galaxy"
-    elif self.object_type == "Sy2":
-      self.object_type_string = "Seyfert 2 galaxy"
-    elif self.object_type == "GiG":
-      self.object_type_string = "Galaxy towards a group of galaxies"
-    elif self.object_type == "As*":
-      self.object_type_string = "Association of stars"
-    elif self.object_type == "PN":
-      self.object_type_string = "Planetary nebula"
-    else:
-      self.object_type_string = ""
+    self.object_type, self.object_type_string = lookup_object_type(self.the_object_name)
 
     time = Time(str(theDate_american) + " 23:59:00") - utcoffset
     if debug:
@@ -607,6 +626,16 @@ class DSO:
           self.sunaltazs_over_night.alt < -19 * u.deg,
           color="k",
           zorder=0,)
+      if horizon.get() is not None:
+        # sky hidden by the local horizon along the object's azimuth track
+        plt.fill_between(
+            self.delta_midnight,
+            0 * u.deg,
+            horizon.altitude(self.the_objectaltazs_over_night.az.value) * u.deg,
+            color="saddlebrown",
+            alpha=0.6,
+            zorder=0.5,
+            label="Horizon")
       plt.colorbar().set_label("Azimuth [deg]")
       plt.legend(loc="upper left")
 
@@ -640,152 +669,84 @@ class DSO:
 
       theDate_format = self.today.strftime("%d.%m.%Y")
 
-      imageName = "/home/pi/sky/dso/DSO_" + str(self.the_object_name) + "_" + str(theDate_format) + ".png"
+      imageName = os.path.join(config.paths['data'], "DSO_" + str(self.the_object_name) + "_" + str(theDate_format) + ".png")
       plt.savefig(imageName)
       if debug:
         print("Saved: " + str(imageName))
+      if config.thumbnails['pregenerate']:
+        thumbnails.make_variants(imageName)
 
     except Exception as e:
       print("DSO observation night plotting error " + str(self.the_object_name) + ": " + str(e))
 
   def get_compass_direction(self, azimuth):
-    direction = ""
-    '''
-    N: 0
-    NE: 45
-    E: 90
-    ES: 135
-    S: 180
-    SW: 225
-    W: 270
-    WN: 315
-    '''
-    if azimuth >= 0 and azimuth < 15:
-      direction = "N"
-    if azimuth >= 15 and azimuth < 30:
-      direction = "NNE"
-    if azimuth >= 30 and azimuth < 60:
-      direction = "NE"
-    if azimuth >= 60 and azimuth < 75:
-      direction = "ENE"
-    if azimuth >= 75 and azimuth < 105:
-      direction = "E"
-    if azimuth >= 105 and azimuth < 135:
-      direction = "ESE"
-    if azimuth >= 135 and azimuth < 150:
-      direction = "SE"
-    if azimuth >= 150 and azimuth < 165:
-      direction = "SSE"
-    if azimuth >= 165 and azimuth < 195:
-      direction = "S"
-    if azimuth >= 195 and azimuth < 225:
-      direction = "SSW"
-    if azimuth >= 225 and azimuth < 240:
-      direction = "SW"
-    if azimuth >= 240 and azimuth < 255:
-      direction = "WSW"
-    if azimuth >= 255 and azimuth < 285:
-      direction = "W"
-    if azimuth >= 285 and azimuth < 300:
-      direction = "WNW"
-    if azimuth >= 300 and azimuth < 330:
-      direction = "NW"
-    if azimuth >= 330 and azimuth < 345:
-      direction = "NWN"
-    if azimuth >= 345 and azimuth <= 360:
-      direction = "N"
+    # N 0, NNE 15, NE 30, ENE 60, E 75 ... NWN 330, N 345 deg (pipeline.COMPASS_EDGES)
+    direction = pipeline.directions(azimuth)[0]
     if debug:
       print("Direction: " + str(direction))
     return direction
 
-  def score_altitude(self, alt):
-    score_total = 0
-    if self.max_alt == self.max_alt_during_night:
-      # bingo
-      score_total += 7
-    elif self.max_alt <= 0:
-      score_total = 0
-    elif self.max_alt < 10.0:
-      score_total += 0.5
-    elif self.max_alt <= 10.0:
-      score_total += 1
-    elif self.max_alt <= 20.0:
-      score_total += 2
-    elif self.max_alt <= 30.0:
-      score_total += 3
-    elif self.max_alt <= 40.0:
-      score_total += 4
-    elif self.max_alt <= 50.0:
-      score_total += 5
-    else:
-      score_total += 6
-    return score_total
-
-  def score(self):
-    # check visibility over horizon and direction during night time, search max altitude
-    # evaluate whether its worth to look at the object
-
-    score_total = 0
-    msg = str(self.the_object_name) + " is barely visible."
-    
-    if self.visible == False:
-      msg = str(self.the_object_name) + " is invisible."
-      return score_total, msg
-
-    if debug:
-      print("Max. alt during astronimical night: " + str(self.max_alt) + " at " + str(self.max_alt_time))
-      print("Max. alt: " + str(self.max_alt_during_night) + " at " + str(self.max_alt_during_night_obstime))
-    if self.max_alt >= self.max_alt_during_night:
-      score_total += 2
-      # altitude maximum during astronomical night
-      msg = str(self.the_object_name) + " max. altitude " + str(round(self.max_alt,0)) + " deg reached during night time at " + str(self.max_alt_time) + " in " + str(self.max_alt_direction)
-      if debug:
-        print(msg)
-      score_total += self.score_altitude(self.max_alt)
-      if score_total == 0:
-        msg += "\n"
-        msg += str(self.the_object_name) + " is invisible."
-        return 0, msg
-      msg += "\n"
-      msg += str(self.the_object_name) + " is best observed at " + str(self.max_alt_time) + " in " + str(self.max_alt_direction)
-
-    else:
-      score_total += 1
-      msg = str(self.the_object_name) + " max. altitude " + str(round(self.max_alt_during_night,0)) + " deg reached at " + str(self.max_alt_during_night_obstime) + " in " + str(self.max_alt_during_night_direction) + "\n"
-      msg += str(self.the_object_name) + " max. altitude " + str(round(self.max_alt,0)) + " deg reached during night time at " + str(self.max_alt_time) + " in " + str(self.max_alt_direction)
-      score_total += self.score_altitude(self.max_alt)
-      if score_total == 0:
-        msg += "\n"
-        msg += str(self.the_object_name) + " is invisible."
-        return 0, msg
-      msg += "\n"
-      msg += str(self.the_object_name) + " is best observed before " + str(self.max_alt_time) + " in " + str(self.max_alt_direction)
-
-    # score = 0 : object is invisible
-    # score > 1 : object is visible at all close to the horizon
-    # score > 2 : object is visible
-    # score > 3 : very good visibility
-    return score_total, msg
-
-def store_DSO_data_in_file(DSOs, dso_data_file):
-  try:
-    if debug:
-      #print(DSOs)
-      print("Store dso data in file " + str(dso_data_file))
-    if not os.path.isfile(dso_data_file):
-      with open(dso_data_file, 'w', encoding='utf-8') as f:
-        json.dump(DSOs, f, ensure_ascii=False, default=serialize_datetime)
-        if debug:
-          print("DSO file written: " + str(dso_data_file))
-  except Exception as e:
-    print("DSO write json file error: " + str(e))
+def bodies_over_night(midnight):
+  # the 1000 sample grid around midnight with the Sun and the Moon on it (GCRS),
+  # the same for all sites with this midnight
+  delta_midnight = np.linspace(-12, 12, 1000) * u.hour
+  times_overnight = midnight + delta_midnight
+  return delta_midnight, times_overnight, get_sun(times_overnight), get_body("moon", times_overnight)
+
+def night_grid(theDate, today, tomorrow):
+  # time grid, Sun and Moon of the night, computed once for all objects (pipeline.Night)
+  midnight = Time(today.strftime("%Y-%m-%d") + " 23:59:00") - utcoffset
+  delta_midnight, times_overnight, sun, moon = bodies_over_night(midnight)
+  frame_over_night = AltAz(obstime=times_overnight, location=the_location)
+  sunaltazs_over_night = sun.transform_to(frame_over_night)
+  moonaltazs_over_night = moon.transform_to(frame_over_night)
+  obstimes = times_overnight.tt.datetime
+  in_the_dark = np.array([nautical_night_start is not None and nautical_night_start < dt < nautical_night_end for dt in obstimes])
+  # times of the directions 20 pm .. 6 am as in DSO.observation_night_directions()
+  direction_times = [Time(str(day) + " " + hhmm) + utcoffset for day, hhmm in
+                     ((today, "18:59:00"), (today, "20:59:00"), (today, "21:59:00"), (tomorrow, "00:00:00"), (tomorrow, "01:59:00"), (tomorrow, "03:59:00"))]
+  return pipeline.Night(theDate, delta_midnight.value, times_overnight.utc.jd, obstimes, in_the_dark,
+                        sunaltazs_over_night.alt.value, moonaltazs_over_night.alt.value, moonaltazs_over_night.az.value,
+                        [t.utc.jd for t in direction_times], float(latitude), float(longitude))
+
+def site_night(theDate, today, tomorrow, site, bodies):
+  # pipeline.Night of a site profile (sites.py); the grid, Sun and Moon are taken
+  # from bodies (midnight -> bodies_over_night()) when another site shares them,
+  # only their transforms to the site's horizon are computed
+  offset = pytz.timezone(site['timezone']).utcoffset(datetime.datetime.combine(today, datetime.time(23, 59))).total_seconds() / 3600.0 * u.hour
+  midnight = Time(today.strftime("%Y-%m-%d") + " 23:59:00") - offset
+  key = round(float(midnight.jd), 6)
+  if key not in bodies:
+    bodies[key] = bodies_over_night(midnight)
+  delta_midnight, times_overnight, sun, moon = bodies[key]
+  location = EarthLocation(lat=float(site['latitude']) * u.deg, lon=float(site['longitude']) * u.deg, height=float(site['elevation']) * u.m)
+  frame_over_night = AltAz(obstime=times_overnight, location=location)
+  sunaltazs_over_night = sun.transform_to(frame_over_night)
+  moonaltazs_over_night = moon.transform_to(frame_over_night)
+  # the nautical night of the site from the Sun on the grid (ephem's night times are local to the Pi)
+  in_the_dark = sunaltazs_over_night.alt.value < -12
+  direction_times = [Time(str(day) + " " + hhmm) + offset for day, hhmm in
+                     ((today, "18:59:00"), (today, "20:59:00"), (today, "21:59:00"), (tomorrow, "00:00:00"), (tomorrow, "01:59:00"), (tomorrow, "03:59:00"))]
+  return pipeline.Night(theDate, delta_midnight.value, times_overnight.utc.jd, times_overnight.tt.datetime, in_the_dark,
+                        sunaltazs_over_night.alt.value, moonaltazs_over_night.alt.value, moonaltazs_over_night.az.value,
+                        [t.utc.jd for t in direction_times], float(site['latitude']), float(site['longitude']))
+
+def resolve_DSO(the_object_name, today, tomorrow, plot):
+  # (ra, dec, object type, description) of a DSO, with plot its visibility plot is created on the way
+  if plot:
+    dsoo = DSO(the_object_name, today, tomorrow)
+    dsoo.plot()
+    return float(dsoo.the_object.ra.deg), float(dsoo.the_object.dec.deg), dsoo.object_type, dsoo.object_type_string
+  the_object = SkyCoord.from_name(the_object_name)
+  object_type, object_type_string = lookup_object_type(the_object_name)
+  return float(the_object.ra.deg), float(the_object.dec.deg), object_type, object_type_string
 
 def DSOs_tonight(today, tomorrow, plot):
   # check DSO list for good visible objects in the desired directions
 
   theDate = today.strftime("%d.%m.%Y")
   if platform.system() == "Linux":
-    dso_data_file = "/home/pi/sky/dso/dsos_" + str(theDate) + ".json"
+    dso_data_file = os.path.join(config.paths['data'], "dsos_" + str(theDate) + ".json")
 
   DSOs = {}
   # load DSO data from file if available
@@ -804,87 +765,14 @@ def DSOs_tonight(today, tomorrow, plot):
   if len(DSOs) == 0:
     if debug:
       print("Check the DSO list...this will take a while...")
-    for dso in ( my_DSO_list ):
-      if debug:
-        print("")
-        print("DSO: " + str(dso))
-      dsoo = DSO(dso, today, tomorrow)
-      if plot:
-        dsoo.plot()
-      visible = dsoo.visible
-      direction_20, direction_22, direction_0, direction_2, direction_4, direction_6 = dsoo.observation_night_directions()
-      main_directions = direction_20 + direction_22 + direction_0 + direction_2 + direction_4 + direction_6
-
-      # investigate main directions
-      num_N = main_directions.count('N')
-      num_E = main_directions.count('E')
-      num_S = main_directions.count('S')
-      num_W = main_directions.count('W')
-      mdl = []
-      mdl.append(num_N)
-      mdl.append(num_E)
-      mdl.append(num_S)
-      mdl.append(num_W)
-      if debug:
-        print(main_directions)
-        print("N: " + str(num_N))
-        print("E: " + str(num_E))
-        print("S: " + str(num_S))
-        print("W: " + str(num_W))
-      main_direction_idx1 = np.argmax(mdl) # top max
-      main_dirs = ''
-      if main_direction_idx1 == 0:
-        main_dirs += 'N'
-      elif main_direction_idx1 == 1:
-        main_dirs += 'E'
-      elif main_direction_idx1 == 2:
-        main_dirs += 'S'
-      elif main_direction_idx1 == 3:
-        main_dirs += 'W'
-
-      mdl[main_direction_idx1] = 0 # remove top max from list to keep indices
-      main_direction_idx2 = np.argmax(mdl) # second max
-      if main_direction_idx2 == 0:
-        main_dirs += 'N'
-      elif main_direction_idx2 == 1:
-        main_dirs += 'E'
-      elif main_direction_idx2 == 2:
-        main_dirs += 'S'
-      elif main_direction_idx2 == 3:
-        main_dirs += 'W'
-
-      if debug:
-        print(str(dso) + " main directions: " + str(main_dirs))
-
-      # try to evaluate DSO visibility by its altitude during night time
-      score, msg = dsoo.score()
-      if debug:
-        print("Max. alt: " + str(dsoo.max_alt) + " at " + str(dsoo.max_alt_time))
-
-      dsodata = {
-        'date' : theDate,
-        'max_alt' : dsoo.max_alt,
-        'max_alt_direction' : dsoo.max_alt_direction,
-        'max_alt_time' : dsoo.max_alt_time,
-        'max_alt_during_night' : dsoo.max_alt_during_whole_night,
-        'max_alt_during_night_direction' : dsoo.max_alt_during_whole_night_direction,
-        'max_alt_during_night_obstime' : dsoo.max_alt_during_whole_night_obstime,
-        'direction_20' : direction_20,
-        'direction_22' : direction_22,
-        'direction_0' : direction_0,
-        'direction_2' : direction_2,
-        'direction_4' : direction_4,
-        'direction_6' : direction_6,
-        'main_directions' : main_dirs,
-        'object_type' : dsoo.object_type,
-        'object_type_string' : dsoo.object_type_string,
-        'visible' : dsoo.visible,
-        'score' : score
-        }
-      DSOs[dso] = dsodata
-
-    # serialize DSO data into json file for quick reference
-    store_DSO_data_in_file(DSOs, dso_data_file)
+    # the objects flow in chunks through resolve -> track -> stats -> score -> write
+    # (pipeline.py), the tracks go to the tracks file for the plots drawn by the browser;
+    # without plots the known objects come from the sidereal reference (sidereal.py)
+    pipeline.run(night_grid(theDate, today, tomorrow), my_DSO_list, lambda name: resolve_DSO(name, today, tomorrow, plot), dso_data_file,
+                 tracks.tracks_file(os.path.dirname(dso_data_file), theDate), serialize_datetime, progress=options.progress,
+                 reference_file=None if plot else sidereal.reference_file(os.path.dirname(dso_data_file)))
+    with open(dso_data_file, 'r', encoding='utf-8') as f:
+      DSOs = json.load(f)
 
     '''
     if debug:
@@ -898,6 +786,39 @@ def DSOs_tonight(today, tomorrow, plot):
     '''
   return DSOs
 
+def DSOs_sites(today, tomorrow, site_names):
+  # catalogues of several sites in one run: each object is resolved once for all
+  # sites, the Sun and Moon are computed once per time grid (sites in one
+  # timezone share it); per site only the horizontal transforms, scores and files
+  theDate = today.strftime("%d.%m.%Y")
+  profiles = [(name, sites.get(name)) for name in site_names]
+  resolved = {} # name -> resolve_DSO() or its error, shared by the sites
+
+  def resolve(name):
+    if name not in resolved:
+      try:
+        resolved[name] = resolve_DSO(name, today, tomorrow, False)
+      except Exception as e:
+        resolved[name] = e
+    if isinstance(resolved[name], Exception):
+      raise resolved[name]
+    return resolved[name]
+
+  bodies = {}
+  for name, site in profiles:
+    root = sites.data_root(name)
+    os.makedirs(root, exist_ok=True)
+    dso_data_file = os.path.join(root, "dsos_" + str(theDate) + ".json")
+    if os.path.isfile(dso_data_file):
+      print("Site " + str(name) + ": " + str(dso_data_file) + " exists")
+      continue
+    print("Site " + str(name) + " (" + str(site['location']) + ")")
+    horizon.use(site['horizon'])
+    pipeline.run(site_night(theDate, today, tomorrow, site, bodies), my_DSO_list, resolve, dso_data_file,
+                 tracks.tracks_file(root, theDate), serialize_datetime, progress=options.progress, reference_file=sidereal.reference_file(root))
+  horizon.use(config.horizon['file'])
+  print(str(len(profiles)) + " sites, " + str(len(bodies)) + " Sun/Moon grids, " + str(len(resolved)) + " objects resolved")
+
 # Define a custom function to serialize datetime objects 
 def serialize_datetime(obj): 
   if isinstance(obj, datetime.datetime): 
@@ -913,9 +834,12 @@ def filter_DSOs_direction(DSOs, min_altitude_limit, direction):
       #print(dsodata)
       #print(dsodata["date"])
       print("Max. altitude during AN: " + str(dsodata["max_alt"]))
-      print("Main direction: " + str(dsodata["main_directions"][0]))
+      print("Main direction: " + str(dsodata["main_directions"])[:1])
+    if dsodata["max_alt_time"] == -1:
+      # no nautical night
+      continue
     if float(dsodata["max_alt"]) >= float(min_altitude_limit):
-      if str(dsodata["main_directions"][0]) == str(direction):
+      if str(dsodata["main_directions"])[:1] == str(direction):
         DSOs_in_direction[dsoname] = dsodata
 
   if debug:
@@ -925,6 +849,12 @@ def filter_DSOs_direction(DSOs, min_altitude_limit, direction):
       print(dsoname)
   return DSOs_in_direction
 
+def stored_time(value):
+  # datetime of a time field of the catalogue file (serialize_datetime())
+  if isinstance(value, datetime.datetime):
+    return value
+  return datetime.datetime.strptime(str(value), "%Y-%m-%d %H:%M:%S")
+
 def is_summertime(dt, timeZone):
    aware_dt = timeZone.localize(dt)
    return aware_dt.dst() != datetime.timedelta(0,0)
@@ -967,7 +897,10 @@ if __name__ == '__main__':
       print("The day: " + str(today))
       print("The day after: " + str(tomorrow))
 
-    if options.catalogue:
+    if options.catalogue and options.sites:
+      # no plots, the sites' charts are drawn by the browser from their tracks
+      DSOs_sites(today, tomorrow, sites.names() if options.sites == "all" else [n.strip() for n in options.sites.split(",") if n.strip()])
+    elif options.catalogue:
       DSOs = DSOs_tonight(today, tomorrow, options.plot)
 
       if options.direction and options.min_altitude:
@@ -980,14 +913,14 @@ if __name__ == '__main__':
           msg = ""
 
           # sort by max altitude time
-          DSOs_in_direction_sorted = {k: v for k, v in sorted(DSOs_in_direction.items(), key=lambda item: item[1]['max_alt_time'])}
+          DSOs_in_direction_sorted = {k: v for k, v in sorted(DSOs_in_direction.items(), key=lambda item: stored_time(item[1]['max_alt_time']))}
           if debug:
             print(DSOs_in_direction_sorted)
 
           for dsoname, dsodata in DSOs_in_direction_sorted.items():
             if debug:
               print(dsoname)
-            msg += "**" + dsoname + "** (" + str(round(dsodata['max_alt'],0)) + " at " + str(dsodata['max_alt_time'].strftime("%H:%M")) + " in " + str(dsodata['max_alt_direction']) + ")\n"
+            msg += "**" + dsoname + "** (" + str(round(dsodata['max_alt'],0)) + " at " + str(stored_time(dsodata['max_alt_time']).strftime("%H:%M")) + " in " + str(dsodata['max_alt_direction']) + ")\n"
 
           # send plots optionally
           if options.sendplots:
@@ -995,7 +928,7 @@ if __name__ == '__main__':
               if debug:
                 print(dsoname)
               if platform.system() == "Linux":
-                plotname = "/home/pi/sky/dso/DSO_" + str(dsoname) + "_" + str(theDate) + ".png"
+                plotname = os.path.join(config.paths['data'], "DSO_" + str(dsoname) + "_" + str(theDate) + ".png")
         else:
           msg = "No DSOs matching direction " + str(options.direction) + " and min altitude " + str(options.min_altitude) + " found."
           if debug:
@@ -1005,9 +938,21 @@ if __name__ == '__main__':
       if options.plot:
         dso.plot()
 
-      score, msg = dso.score()
-      print("Score: " + str(score))
-      print(msg)
+      step = slice(None, None, tracks.STEP)
+      night = scoring.features(dso.delta_midnight.value[step], dso.sunaltazs_over_night.alt.value[step],
+                               dso.the_objectaltazs_over_night.alt.value[step], dso.the_objectaltazs_over_night.az.value[step],
+                               dso.moonaltazs_over_night.alt.value[step], dso.moonaltazs_over_night.az.value[step])
+      record = {'max_alt' : dso.max_alt, 'max_alt_time' : dso.max_alt_time, 'max_alt_direction' : dso.max_alt_direction,
+                'max_alt_during_night' : dso.max_alt_during_night, 'max_alt_during_night_obstime' : dso.max_alt_during_night_obstime,
+                'max_alt_during_night_direction' : dso.max_alt_during_night_direction, 'score' : float(scoring.scores(night)[0])}
+      record.update(scoring.fields(night, 0))
+      if night['hours_above'][0] > 0:
+        # best time above the local horizon
+        best = night['best'][0]
+        record.update({'max_alt' : float(night['max_dark_alt'][0]), 'max_alt_time' : dso.times_overnight[step][best].tt.datetime,
+                       'max_alt_direction' : dso.get_compass_direction(dso.the_objectaltazs_over_night.az.value[step][best])})
+      print("Score: " + str(record['score']))
+      print(scoring.describe(the_object_name, record))
 
   except Exception as e:
     print("DSO observation planning error " + str(the_object_name) + ": " + str(e))
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi accuracy of the fast paths against astropy
+#
+# The catalogue of a night (pipeline.py), the tracks looked up in the sidereal
+# reference (sidereal.py), the tracks file for the browser charts, /now and the live stream (skymath.py) and the year calendar
+# (yearcalendar.py) compute positions without astropy. This harness evaluates
+# every mode for a fixed reference set - sites from 34 deg south to 70 deg
+# north, nights around the DST changes and midsummer nights without (nautical)
+# darkness, a catalogue sample - and compares the results with the per-object
+# astropy path of DSO: SkyCoord.transform_to() on the 1000 sample grid of the
+# night, the same statistics on top. It prints the error distribution of each
+# field and exits with 1 if a tolerance is exceeded. Differences that are
+# explained by the reference itself are counted, not failed: a direction next
+# to a compass bin edge, a max. altitude time on a flat maximum, visibility
+# right at the threshold.
+#
+# Runs offline: astropy's bundled IERS tables and built-in ephemeris, catalogue
+# coordinates from the table below instead of Simbad, a flat horizon.
+#
+#   python3 accuracy.py [--modes pipeline,sidereal,tracks,now,hours,calendar] [--sites Darmstadt,Tromso] [--verbose]
+#
+
+import optparse
+import os
+import sys
+import datetime
+import tempfile
+import time
+
+import numpy as np
+import pytz
+
+from astropy.utils import iers
+iers.conf.auto_download = False
+iers.conf.auto_max_age = None
+import astropy.units as u
+from astropy.coordinates import AltAz, EarthLocation, SkyCoord, get_sun, get_body
+from astropy.time import Time
+
+import config
+import horizon
+import pipeline
+import scoring
+import sidereal
+import skymath
+import tracks
+import yearcalendar
+
+# name, latitude, longitude, height [m], timezone, nights
+SITES = (
+  ("Darmstadt", 49.878708, 8.646927, 144, "Europe/Berlin", ("2024-03-30", "2024-03-31", "2024-06-21", "2024-10-26", "2024-12-21")),
+  ("Tromso", 69.6496, 18.9560, 10, "Europe/Oslo", ("2024-05-20", "2024-06-21", "2024-08-10", "2024-12-21")),
+  ("Sydney", -33.8688, 151.2093, 40, "Australia/Sydney", ("2024-04-06", "2024-06-21", "2024-10-05", "2024-12-21"))
+)
+# name, ra, dec (J2000, deg): all seasons, circumpolar in the north, never rising in the north
+CATALOGUE = (
+  ("M1", 83.633, 22.0145), ("M8", 270.904, -24.387), ("M13", 250.423, 36.461), ("M27", 299.901, 22.721),
+  ("M31", 10.685, 41.269), ("M33", 23.462, 30.660), ("M42", 83.822, -5.391), ("M45", 56.750, 24.117),
+  ("M51", 202.470, 47.195), ("M57", 283.396, 33.029), ("M7", 268.463, -34.793), ("M81", 148.888, 69.065),
+  ("M97", 168.699, 55.019), ("M104", 189.998, -11.623), ("NGC7822", 0.800, 67.500), ("IC1805", 38.200, 61.450),
+  ("NGC1499", 60.200, 36.400), ("IC4592", 242.600, -19.400), ("NGC104", 6.024, -72.081), ("NGC5139", 201.697, -47.480),
+  ("NGC2070", 84.676, -69.101), ("M83", 204.254, -29.866), ("Polaris", 37.955, 89.264), ("NGC6822", 296.235, -14.803)
+)
+MODES = ("pipeline", "sidereal", "tracks", "now", "hours", "calendar")
+
+STEP_HOURS = 24.0 / 999 * tracks.STEP # samples of the scoring grid
+# largest accepted absolute difference per field
+TOLERANCES = {
+  'alt' : 0.02,                   # deg, tracks on the 1000 sample grid
+  'az' : 0.02,                    # deg on the sky (times cos(alt))
+  'max_alt' : 0.02,
+  'max_alt_during_night' : 0.02,
+  'max_alt_time' : 1.5,           # minutes, one sample of the grid
+  'max_alt_during_night_obstime' : 1.5,
+  'hours_above' : STEP_HOURS,     # one scoring sample
+  'score' : 0.2,
+  'sectors' : 2 * round(STEP_HOURS * 60) + 1, # minutes, one sample changing the sector
+  'tracks_alt' : 0.025,           # tracks file: track error plus 0.005 rounding
+  'tracks_az' : 0.025,
+  'now_alt' : 0.03,               # refraction models above 5 deg
+  'now_az' : 0.02,
+  'hours_to_set' : 2.0 / 60,      # hours, against a 2 minute astropy track
+  'calendar_hours' : 0.5          # the Moon series is ~0.3 deg off
+}
+EDGE = 0.05 # deg from a compass bin edge a direction may differ
+
+parser = optparse.OptionParser()
+parser.add_option('-m', '--modes',
+    action="store", dest="modes",
+    help="Modes to check", default=",".join(MODES))
+parser.add_option('-s', '--sites',
+    action="store", dest="sites",
+    help="Sites to check", default=",".join(s[0] for s in SITES))
+parser.add_option('-v', '--verbose',
+    action="store_true", dest="verbose",
+    help="Show every failure", default=False)
+
+class Results:
+
+  def __init__(self, verbose=False):
+    self.fields = {} # (mode, field) -> [errors, explained, failures]
+    self.verbose = verbose
+
+  def number(self, mode, field, error, where, tolerance=None, explained=False):
+    # an absolute error, failed above the tolerance unless explained
+    entry = self.fields.setdefault((mode, field), [[], 0, []])
+    tolerance = TOLERANCES[field] if tolerance is None else tolerance
+    entry[0].append(abs(float(error)))
+    if abs(error) > tolerance:
+      if explained:
+        entry[1] += 1
+      else:
+        entry[2].append(where + ": " + str(round(float(error), 4)))
+
+  def same(self, mode, field, fast, reference, where, explained=False):
+    # categorical values, a difference fails unless explained
+    entry = self.fields.setdefault((mode, field), [[], 0, []])
+    entry[0].append(0.0 if fast == reference else 1.0)
+    if fast != reference:
+      if explained:
+        entry[1] += 1
+      else:
+        entry[2].append(where + ": " + str(fast) + " instead of " + str(reference))
+
+  def failed(self):
+    return sum(len(entry[2]) for entry in self.fields.values())
+
+  def report(self):
+    print("%-9s %-30s %6s %9s %9s %9s %9s %8s %5s %5s" % ("mode", "field", "n", "mean", "p50", "p95", "max", "tol", "expl", "fail"))
+    for (mode, field), (errors, explained, failures) in self.fields.items():
+      e = np.array(errors)
+      tol = TOLERANCES.get(field)
+      print("%-9s %-30s %6d %9.4f %9.4f %9.4f %9.4f %8s %5d %5d" % (mode, field, len(e), e.mean(), np.percentile(e, 50), np.percentile(e, 95), e.max(),
+            ("%.3f" % tol) if tol is not None else "equal", explained, len(failures)))
+      if self.verbose:
+        for failure in failures:
+          print("    " + failure)
+
+def sky_angle(az1, az2, alt):
+  # azimuth difference as an angle on the sky in degrees
+  return ((np.asarray(az1) - np.asarray(az2) + 180.0) % 360.0 - 180.0) * np.cos(np.radians(alt))
+
+def near_edge(name, azimuths, alts):
+  # name is the direction of one of the azimuths moved by up to EDGE on the sky
+  # (azimuths are ill-defined close to the zenith and the nadir)
+  return any(name in pipeline.directions(az + np.array([-1.0, 0.0, 1.0]) * EDGE / max(np.cos(np.radians(alt)), 1e-3))
+             for az, alt in zip(azimuths, alts))
+
+def utc(tz, day, hhmm):
+  # local day and "HH:MM" as naive UTC datetime
+  local = tz.localize(datetime.datetime.combine(day, datetime.datetime.strptime(hhmm, "%H:%M").time()))
+  return local.astimezone(pytz.utc).replace(tzinfo=None)
+
+def reference_night(site, theDate):
+  # pipeline.Night of the site from astropy, the frames of the grid and the direction times
+  name, latitude, longitude, height, timezone, nights = site
+  tz = pytz.timezone(timezone)
+  day = datetime.date.fromisoformat(theDate)
+  tomorrow = day + datetime.timedelta(days=1)
+  location = EarthLocation(lat=latitude * u.deg, lon=longitude * u.deg, height=height * u.m)
+  delta_midnight = np.linspace(-12, 12, 1000)
+  times = Time(utc(tz, day, "23:59")) + delta_midnight * u.hour
+  frame = AltAz(obstime=times, location=location)
+  sun = get_sun(times).transform_to(frame)
+  moon = get_body("moon", times).transform_to(frame)
+  direction_times = Time([utc(tz, d, hhmm) for d, hhmm in ((day, "20:00"), (day, "22:00"), (tomorrow, "00:00"), (tomorrow, "02:00"), (tomorrow, "04:00"), (tomorrow, "06:00"))])
+  night = pipeline.Night(day.strftime("%d.%m.%Y"), delta_midnight, times.utc.jd, times.tt.datetime, sun.alt.deg < config.scoring['dark_sun_alt'],
+                         sun.alt.deg, moon.alt.deg, moon.az.deg, direction_times.utc.jd, latitude, longitude)
+  return night, frame, AltAz(obstime=direction_times, location=location), location
+
+def reference_tracks(frame, direction_frame):
+  # alt, az [objects][samples] and alt, az at the direction times of the DSO
+  # path: one SkyCoord per object transformed to the frames of the night
+  alts, azs, dir_alt, dir_az = [], [], [], []
+  for name, ra, dec in CATALOGUE:
+    the_object = SkyCoord(ra=ra * u.deg, dec=dec * u.deg)
+    altaz = the_object.transform_to(frame)
+    alts.append(altaz.alt.deg)
+    azs.append(altaz.az.deg)
+    direction = the_object.transform_to(direction_frame)
+    dir_alt.append(direction.alt.deg)
+    dir_az.append(direction.az.deg)
+  return np.array(alts), np.array(azs), np.array(dir_alt), np.array(dir_az)
+
+def check_pipeline(results, where, night, ref_alts, ref_azs, ref_dir_alt, ref_dir_az):
+  rows = [(name, ra, dec, "", "") for name, ra, dec in CATALOGUE]
+  ra, dec = np.array([r[1] for r in rows]), np.array([r[2] for r in rows])
+  alts, azs = pipeline.track(night, ra, dec, night.lst)
+  for i, (name, _, _) in enumerate(CATALOGUE):
+    results.number("pipeline", "alt", np.abs(alts[i] - ref_alts[i]).max(), where + " " + name)
+    up = ref_alts[i] < 89.0
+    results.number("pipeline", "az", np.abs(sky_angle(azs[i][up], ref_azs[i][up], ref_alts[i][up])).max() if up.any() else 0.0, where + " " + name)
+
+  fast, _ = pipeline.chunk_records(night, rows)
+  reference = pipeline.records_of(night, rows, ref_alts, ref_azs, ref_dir_az)
+  index = {t : k for k, t in enumerate(night.times)}
+  for i, (f, r) in enumerate(zip(fast, reference)):
+    w = where + " " + f.name
+    if r.max_alt_time == -1 or f.max_alt_time == -1:
+      results.same("pipeline", "no_night", f.max_alt_time, r.max_alt_time, w)
+    else:
+      for field, time_field, direction_field in (('max_alt', 'max_alt_time', 'max_alt_direction'),
+                                                 ('max_alt_during_night', 'max_alt_during_night_obstime', 'max_alt_during_night_direction')):
+        results.number("pipeline", field, getattr(f, field) - getattr(r, field), w)
+        k_fast, k_ref = index[getattr(f, time_field)], index[getattr(r, time_field)]
+        minutes = (getattr(f, time_field) - getattr(r, time_field)).total_seconds() / 60.0
+        # another sample of a flat maximum
+        flat = abs(ref_alts[i, k_fast] - ref_alts[i, k_ref]) <= TOLERANCES['max_alt']
+        results.number("pipeline", time_field, minutes, w, explained=flat)
+        results.same("pipeline", direction_field, getattr(f, direction_field), getattr(r, direction_field), w,
+                     explained=near_edge(getattr(f, direction_field), [ref_azs[i, k_fast], ref_azs[i, k_ref]], [ref_alts[i, k_fast], ref_alts[i, k_ref]]))
+    for k, field in enumerate(pipeline.DIRECTION_FIELDS):
+      results.same("pipeline", "direction_hh", getattr(f, field), getattr(r, field), w + " " + field, explained=near_edge(getattr(f, field), [ref_dir_az[i, k]], [ref_dir_alt[i, k]]))
+    results.number("pipeline", "hours_above", f.hours_above - r.hours_above, w)
+    results.same("pipeline", "visible", f.visible, r.visible, w, explained=abs(r.hours_above - scoring.VISIBLE_HOURS) <= STEP_HOURS + 0.01)
+    results.number("pipeline", "score", f.score - r.score, w)
+    results.number("pipeline", "sectors", np.abs(np.array(f.sectors) - np.array(r.sectors)).sum(), w)
+    minutes = np.sort(scoring.quadrants(r.sectors))[::-1]
+    results.same("pipeline", "main_directions", f.main_directions, r.main_directions, w,
+                 explained=bool((np.abs(np.diff(minutes[:3])) <= TOLERANCES['sectors']).any()))
+
+def check_sidereal(results, where, night, ref_alts, ref_azs):
+  # tracks looked up in a reference built config.sidereal['max_age_days'] before the night
+  rows = [(name, ra, dec, "", "") for name, ra, dec in CATALOGUE]
+  reference = sidereal.compute(rows, night.latitude, night.jd[len(night.jd) // 2] - config.sidereal['max_age_days'])
+  alts, azs, _ = pipeline.tracks_of(night, rows, reference)
+  for i, (name, _, _) in enumerate(CATALOGUE):
+    results.number("sidereal", "alt", np.abs(alts[i] - ref_alts[i]).max(), where + " " + name)
+    up = ref_alts[i] < 89.0
+    results.number("sidereal", "az", np.abs(sky_angle(azs[i][up], ref_azs[i][up], ref_alts[i][up])).max() if up.any() else 0.0, where + " " + name)
+
+def check_tracks(results, where, night, ref_alts, ref_azs):
+  # the int16 tracks file the browser charts are drawn from
+  rows = [(name, ra, dec, "", "") for name, ra, dec in CATALOGUE]
+  _, (alts, azs) = pipeline.chunk_records(night, rows)
+  step = slice(None, None, tracks.STEP)
+  filename = os.path.join(tempfile.mkdtemp(), "tracks.bin")
+  try:
+    tracks.write(filename, night.hours[step], night.sun_alt[step], night.moon_alt[step], [r[0] for r in rows], alts / 100.0, azs / 100.0)
+    data = tracks.read(filename)
+  finally:
+    if os.path.exists(filename):
+      os.remove(filename)
+      os.rmdir(os.path.dirname(filename))
+  for i, (name, _, _) in enumerate(CATALOGUE):
+    results.number("tracks", "tracks_alt", np.abs(data['alt'][i] - ref_alts[i, step]).max(), where + " " + name)
+    up = ref_alts[i, step] < 89.0
+    results.number("tracks", "tracks_az", np.abs(sky_angle(data['az'][i][up], ref_azs[i, step][up], ref_alts[i, step][up])).max(), where + " " + name)
+  results.number("tracks", "tracks_alt", np.abs(data['sun_alt'] - night.sun_alt[step]).max(), where + " Sun")
+
+def instants(night):
+  # a few times of the night as Time
+  return [Time(night.jd[k], format='jd', scale='utc') for k in (375, 458, 541, 625)] # 21:00, 23:00, 01:00, 03:00
+
+def check_now(results, where, night, location):
+  # /now and the live stream: refraction for 10 degC and 1010 hPa
+  positions = skymath.Positions([{'name' : name, 'ra' : ra, 'dec' : dec} for name, ra, dec in CATALOGUE])
+  objects = SkyCoord(ra=[c[1] for c in CATALOGUE] * u.deg, dec=[c[2] for c in CATALOGUE] * u.deg)
+  for t in instants(night):
+    frame = AltAz(obstime=t, location=location, pressure=1010 * u.hPa, temperature=10 * u.deg_C, relative_humidity=0, obswl=0.55 * u.micron)
+    ref = objects.transform_to(frame)
+    alt, az = positions.altaz(night.latitude, night.longitude, t.utc.datetime)
+    for i, (name, _, _) in enumerate(CATALOGUE):
+      if 5.0 < ref.alt.deg[i] < 89.0:
+        w = where + " " + t.utc.iso[:16] + " " + name
+        results.number("now", "now_alt", alt[i] - ref.alt.deg[i], w)
+        results.number("now", "now_az", sky_angle(az[i], ref.az.deg[i], ref.alt.deg[i]), w)
+
+def check_hours(results, where, night, location):
+  # hours until an object sets below 0 deg (the live stream) against a 2 minute astropy track
+  positions = skymath.Positions([{'name' : name, 'ra' : ra, 'dec' : dec} for name, ra, dec in CATALOGUE])
+  objects = SkyCoord(ra=[c[1] for c in CATALOGUE] * u.deg, dec=[c[2] for c in CATALOGUE] * u.deg)
+  t = instants(night)[1]
+  minutes = np.arange(0, 24 * 60 + 1, 2)
+  altaz = objects[:, None].transform_to(AltAz(obstime=t + minutes * u.min, location=location))
+  alts = altaz.alt.deg
+  hours = positions.hours_above(night.latitude, night.longitude, 0.0, t.utc.datetime)
+  for i, (name, _, _) in enumerate(CATALOGUE):
+    w = where + " " + name
+    if alts[i, 0] < 0.5:
+      continue
+    below = np.nonzero(alts[i] < 0.0)[0]
+    if len(below) == 0:
+      # never sets; allowed to differ for objects grazing the horizon
+      results.same("hours", "never_sets", bool(np.isinf(hours[i])), True, w, explained=alts[i].min() < 0.1)
+      continue
+    k = below[0]
+    # linear between the samples around the crossing
+    reference = (minutes[k - 1] + 2.0 * alts[i, k - 1] / (alts[i, k - 1] - alts[i, k])) / 60.0
+    if np.isinf(hours[i]):
+      results.same("hours", "never_sets", True, False, w, explained=alts[i].min() > -0.1)
+    else:
+      results.number("hours", "hours_to_set", hours[i] - reference, w)
+
+def check_calendar(results, where, site, theDate):
+  # one night of the calendar against astropy Sun, Moon and objects on its grid
+  name, latitude, longitude, height, timezone, nights = site
+  day = datetime.date.fromisoformat(theDate)
+  step = config.calendar['step']
+  min_alt = config.calendar['min_alt']
+  dark_sun_alt = config.scoring['dark_sun_alt']
+  records = [{'name' : n, 'ra' : ra, 'dec' : dec} for n, ra, dec in CATALOGUE]
+  cal = yearcalendar.compute(records, day, 1, latitude, longitude, min_alt, dark_sun_alt, step, timezone)
+  times = Time(yearcalendar.night_grid(day, 1, step, pytz.timezone(timezone))[0], format='jd', scale='utc')
+  frame = AltAz(obstime=times, location=EarthLocation(lat=latitude * u.deg, lon=longitude * u.deg, height=height * u.m))
+  usable = (get_sun(times).transform_to(frame).alt.deg < dark_sun_alt) & (get_body("moon", times).transform_to(frame).alt.deg < 0.0)
+  objects = SkyCoord(ra=[c[1] for c in CATALOGUE] * u.deg, dec=[c[2] for c in CATALOGUE] * u.deg)
+  alts = objects[:, None].transform_to(frame).alt.deg
+  reference = ((alts > min_alt) & usable).sum(axis=1) * step / 60.0
+  for i, (n, _, _) in enumerate(CATALOGUE):
+    results.number("calendar", "calendar_hours", cal.hours()[i, 0] - reference[i], where + " " + n)
+
+if __name__ == '__main__':
+  options, args = parser.parse_args()
+  modes = [m.strip() for m in options.modes.split(",") if m.strip()]
+  sites = [s for s in SITES if s[0] in options.sites.split(",")]
+  # a flat horizon, the reference set does not depend on horizon.txt
+  horizon.profile, horizon.loaded = None, True
+  results = Results(options.verbose)
+  t0 = time.time()
+  for site in sites:
+    for theDate in site[5]:
+      where = site[0] + " " + theDate
+      night, frame, direction_frame, location = reference_night(site, theDate)
+      if "pipeline" in modes or "sidereal" in modes or "tracks" in modes:
+        ref_alts, ref_azs, ref_dir_alt, ref_dir_az = reference_tracks(frame, direction_frame)
+        if "pipeline" in modes:
+          check_pipeline(results, where, night, ref_alts, ref_azs, ref_dir_alt, ref_dir_az)
+        if "sidereal" in modes:
+          check_sidereal(results, where, night, ref_alts, ref_azs)
+        if "tracks" in modes:
+          check_tracks(results, where, night, ref_alts, ref_azs)
+      if "now" in modes:
+        check_now(results, where, night, location)
+      if "hours" in modes:
+        check_hours(results, where, night, location)
+      if "calendar" in modes:
+        check_calendar(results, where, site, theDate)
+  results.report()
+  failed = results.failed()
+  print(str(len(sites)) + " sites, " + str(sum(len(s[5]) for s in sites)) + " nights, " + str(len(CATALOGUE)) + " objects in " + str(round(time.time() - t0, 1)) + " s: " +
+        ("OK" if failed == 0 else str(failed) + " failures"))
+  sys.exit(1 if failed > 0 else 0)
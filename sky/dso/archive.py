@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi archive of past nights
+#
+# Every night adds a dsos_<date>.json, ~280 plots with their thumbs/ and full/
+# variants and a tracks file to the data directory. Nights older than
+# config.archive['keep_days'] are packed into per-month bundles in archive/:
+#
+#   dsos_<mm.yyyy>.json.gz   {date: catalogue} of the nights of the month
+#   files_<mm.yyyy>.pack     the night files one after the other
+#   files_<mm.yyyy>.idx      JSON index {path: [offset, size, mtime_ns]},
+#                            path relative to the data directory
+#
+# and removed from the data directory. The server reads from the bundles
+# without unpacking them (catalogue.load(), httpcache.serve_static()). Files
+# are appended to a pack and the new index replaces the old one only after
+# the data is on disk, so readers always see a consistent bundle and an
+# interrupted run is completed by the next one. The command line compacts the
+# data directories of all sites (sites.py), each with its own archive/.
+#
+#   python3 archive.py [--keep 14] [--dry-run]
+#
+
+import optparse
+import os
+import re
+import gzip
+import json
+import time
+import datetime
+import threading
+from collections import OrderedDict
+
+import config
+import sites
+import thumbnails
+
+debug = False # True
+
+ARCHIVE_DIR = "archive"
+# files of a night: dsos_<date>.json, DSO_<name>_<date>.png (also in thumbs/ and full/), tracks_<date>.bin
+DATED_FILE = re.compile(r"^(dsos_|DSO_.+_|tracks_)(\d\d)\.(\d\d)\.(\d{4})\.(json|png|bin)$")
+VARIANT_DIRS = ("thumbs", "full")
+CACHED_MONTHS = 2 # parsed month catalogues kept in memory
+
+indexes = {} # index file -> (mtime_ns, index)
+months = OrderedDict() # catalogue bundle -> (mtime_ns, {date: DSOs})
+cache_lock = threading.Lock()
+stats = {'catalogues' : 0, 'files' : 0}
+
+def month_of(theDate):
+  # "dd.mm.yyyy" -> "mm.yyyy"
+  return str(theDate)[3:]
+
+def catalogue_bundle(root, month):
+  return os.path.join(root, ARCHIVE_DIR, "dsos_" + month + ".json.gz")
+
+def pack_file(root, month):
+  return os.path.join(root, ARCHIVE_DIR, "files_" + month + ".pack")
+
+def index_file(root, month):
+  return os.path.join(root, ARCHIVE_DIR, "files_" + month + ".idx")
+
+def date_of(filename):
+  # date "dd.mm.yyyy" of a night file, None for other files
+  m = DATED_FILE.match(os.path.basename(filename))
+  if m is None:
+    return None
+  return m.group(2) + "." + m.group(3) + "." + m.group(4)
+
+###reading###
+
+def index(root, month):
+  # {path: [offset, size, mtime_ns]} of the month's pack, {} if there is none
+  filename = index_file(root, month)
+  try:
+    st = os.stat(filename)
+  except OSError:
+    return {}
+  cached = indexes.get(filename)
+  if cached is not None and cached[0] == st.st_mtime_ns:
+    return cached[1]
+  with open(filename, 'r', encoding='utf-8') as f:
+    idx = json.load(f)
+  with cache_lock:
+    indexes[filename] = (st.st_mtime_ns, idx)
+  return idx
+
+def lookup(root, path):
+  # (pack file, offset, size, mtime_ns) of an archived file, None if not archived
+  theDate = date_of(path)
+  if theDate is None:
+    return None
+  month = month_of(theDate)
+  entry = index(root, month).get(path.replace(os.sep, "/").strip("/"))
+  if entry is None:
+    return None
+  return (pack_file(root, month), entry[0], entry[1], entry[2])
+
+def read(entry):
+  pack, offset, size, mtime_ns = entry
+  stats['files'] += 1
+  with open(pack, 'rb') as f:
+    f.seek(offset)
+    data = f.read(size)
+  if len(data) != size:
+    raise IOError("Truncated archive " + str(pack))
+  return data
+
+def names(root, theDate):
+  # names of the archived files of the night in the data directory (no variants)
+  return set(path for path in index(root, month_of(theDate)) if "/" not in path and date_of(path) == theDate)
+
+def catalogue(root, theDate):
+  # (DSOs, version) of an archived night, None if not archived
+  bundle = catalogue_bundle(root, month_of(theDate))
+  try:
+    st = os.stat(bundle)
+  except OSError:
+    return None
+  with cache_lock:
+    cached = months.get(bundle)
+    if cached is not None and cached[0] == st.st_mtime_ns:
+      months.move_to_end(bundle)
+      nights = cached[1]
+    else:
+      nights = None
+  if nights is None:
+    stats['catalogues'] += 1
+    with gzip.open(bundle, 'rt', encoding='utf-8') as f:
+      nights = json.load(f)
+    with cache_lock:
+      months[bundle] = (st.st_mtime_ns, nights)
+      while len(months) > CACHED_MONTHS:
+        months.popitem(last=False)
+  if theDate not in nights:
+    return None
+  return nights[theDate], "archive-" + format(st.st_mtime_ns, 'x')
+
+###writing###
+
+def night_files(root):
+  # {date: [paths relative to root]} of the nights in the data directory
+  nights = {}
+  for directory in ("",) + VARIANT_DIRS:
+    try:
+      files = os.listdir(os.path.join(root, directory))
+    except OSError:
+      continue
+    for name in files:
+      theDate = date_of(name)
+      if theDate is not None:
+        nights.setdefault(theDate, []).append(directory + "/" + name if directory else name)
+  return nights
+
+def write_atomic(filename, data):
+  tmp = filename + ".tmp"
+  with open(tmp, 'wb') as f:
+    f.write(data)
+    f.flush()
+    os.fsync(f.fileno())
+  os.replace(tmp, filename)
+
+def pack_month(root, month, nights, dry_run=False):
+  # appends the files of nights {date: [paths]} to the month's bundle, then removes them
+  if not dry_run:
+    # the gallery of an archived night shows the thumbnails, create missing ones now
+    for theDate in nights:
+      for path in list(nights[theDate]):
+        if path.startswith("DSO_"):
+          for v in VARIANT_DIRS:
+            variant = v + "/" + path
+            try:
+              if thumbnails.variant(root, path, v) is not None and variant not in nights[theDate]:
+                nights[theDate].append(variant)
+            except Exception as e:
+              print("Archive variant error " + str(path) + ": " + str(e))
+  idx = dict(index(root, month))
+  # catalogues go to the JSON bundle, everything else into the pack; a file
+  # archived before is packed again if it was recreated meanwhile
+  new = []
+  size = 0
+  for theDate in sorted(nights):
+    for path in sorted(nights[theDate]):
+      st = os.stat(os.path.join(root, path))
+      if not path.startswith("dsos_") and (path not in idx or idx[path][2] != st.st_mtime_ns):
+        new.append(path)
+        size += st.st_size
+  print("Archive " + month + ": " + str(len(nights)) + " nights, " + str(len(new)) + " files, " + str(round(size / 1e6, 1)) + " MB")
+  if dry_run:
+    return
+
+  os.makedirs(os.path.join(root, ARCHIVE_DIR), exist_ok=True)
+  with open(pack_file(root, month), 'ab') as pack:
+    for path in new:
+      filename = os.path.join(root, path)
+      st = os.stat(filename)
+      with open(filename, 'rb') as f:
+        data = f.read()
+      idx[path] = [pack.tell(), len(data), st.st_mtime_ns]
+      pack.write(data)
+    pack.flush()
+    os.fsync(pack.fileno())
+
+  bundle = catalogue_bundle(root, month)
+  catalogues = {}
+  if os.path.isfile(bundle):
+    with gzip.open(bundle, 'rt', encoding='utf-8') as f:
+      catalogues = json.load(f)
+  for theDate in nights:
+    filename = os.path.join(root, "dsos_" + theDate + ".json")
+    if os.path.isfile(filename):
+      with open(filename, 'r', encoding='utf-8') as f:
+        catalogues[theDate] = json.load(f)
+  write_atomic(bundle, gzip.compress(json.dumps(catalogues, separators=(',', ':')).encode('utf-8')))
+  write_atomic(index_file(root, month), json.dumps(idx, separators=(',', ':')).encode('utf-8'))
+
+  # everything is in the bundle now
+  for theDate in nights:
+    for path in nights[theDate]:
+      if path in idx or path == "dsos_" + theDate + ".json":
+        os.remove(os.path.join(root, path))
+
+def compact(root, keep_days, dry_run=False):
+  # packs the nights older than keep_days into their month bundles
+  oldest = datetime.date.today() - datetime.timedelta(days=keep_days)
+  by_month = {}
+  for theDate, paths in night_files(root).items():
+    if datetime.datetime.strptime(theDate, "%d.%m.%Y").date() < oldest:
+      by_month.setdefault(month_of(theDate), {})[theDate] = paths
+  if len(by_month) == 0:
+    print("Nothing to archive")
+  for month in sorted(by_month, key=lambda m: m[3:] + m[:2]):
+    pack_month(root, month, by_month[month], dry_run)
+
+parser = optparse.OptionParser()
+parser.add_option('-k', '--keep',
+    action="store", dest="keep", type="int",
+    help="Days kept in the data directory", default=config.archive['keep_days'])
+parser.add_option('-n', '--dry-run',
+    action="store_true", dest="dry_run",
+    help="Only show what would be archived", default=False)
+
+if __name__ == '__main__':
+  options, args = parser.parse_args()
+  t0 = time.time()
+  for name in sites.names():
+    root = sites.data_root(name)
+    if os.path.isdir(root):
+      if name != sites.HOME:
+        print("Site " + str(name) + ":")
+      compact(root, options.keep, options.dry_run)
+  if debug:
+    print("Archived in " + str(round(time.time() - t0, 1)) + " s")
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi gallery rendering benchmark
+#
+# Renders the gallery and list pages for synthetic nights with the precompiled
+# templates (views.py) and, for comparison, the former way: concatenating an
+# HTML string with {{ get_url(...) }} expressions and passing it to template().
+#
+#   python3 bench_render.py --sizes 280,3000
+#
+
+import optparse
+import random
+import datetime
+import time
+
+import bottle
+from bottle import template, BaseTemplate
+
+import catalogue
+import scoring
+import views
+
+parser = optparse.OptionParser()
+parser.add_option('-s', '--sizes',
+    action="store", dest="sizes",
+    help="Catalogue sizes", default="280,3000")
+parser.add_option('-r', '--repeat',
+    action="store", dest="repeat", type="int",
+    help="Renderings per size", default=20)
+
+TYPES = ["Galaxy", "Globular cluster", "Open cluster", "Nebula", "Planetary nebula", "Reflection nebula", "SuperNova remnant"]
+
+def make_DSOs(n, theDate):
+  # synthetic night with the fields of dsos_<date>.json
+  rnd = random.Random(n)
+  night = datetime.datetime.strptime(theDate, "%d.%m.%Y")
+  DSOs = {}
+  for i in range(n):
+    hour = rnd.choice([20, 21, 22, 23, 0, 1, 2, 3, 4])
+    max_alt_time = (night + datetime.timedelta(days=1 if hour < 12 else 0)).strftime("%Y-%m-%d ") + "%02d:%02d:00" % (hour, rnd.randint(0, 59))
+    max_alt = rnd.uniform(-20, 85)
+    DSOs["NGC" + str(i + 1)] = {
+      'date' : theDate,
+      'max_alt' : max_alt,
+      'max_alt_direction' : rnd.choice(["N", "E", "S", "W", "SSW", "ENE"]),
+      'max_alt_time' : max_alt_time,
+      'max_alt_during_night' : max(0, round(max_alt)),
+      'max_alt_during_night_direction' : rnd.choice(["N", "E", "S", "W"]),
+      'max_alt_during_night_obstime' : max_alt_time,
+      'direction_20' : rnd.choice(["E", "SE", "S"]),
+      'direction_22' : rnd.choice(["SE", "S", "SW"]),
+      'direction_0' : rnd.choice(["S", "SW", "W"]),
+      'direction_2' : rnd.choice(["SW", "W", "NW"]),
+      'direction_4' : rnd.choice(["W", "NW", "N"]),
+      'direction_6' : rnd.choice(["NW", "N", "NE"]),
+      'main_directions' : rnd.choice(["SW", "SE", "NE", "NW", "EN", "WS"]),
+      'object_type' : "G",
+      'object_type_string' : rnd.choice(TYPES),
+      'visible' : max_alt > 0,
+      'score' : rnd.randint(0, 9),
+      'ra' : rnd.uniform(0, 360),
+      'dec' : rnd.uniform(-30, 90)
+      }
+    if max_alt > 5:
+      # minutes in the dark around the azimuth of the max. altitude
+      sectors = [0] * scoring.SECTORS
+      center = rnd.randrange(scoring.SECTORS)
+      for k in range(-2, 3):
+        sectors[(center + k) % scoring.SECTORS] = rnd.randint(0, 90)
+      DSOs["NGC" + str(i + 1)]['sectors'] = sectors
+      DSOs["NGC" + str(i + 1)]['main_directions'] = scoring.main_directions(sectors) or DSOs["NGC" + str(i + 1)]['main_directions']
+  return DSOs
+
+def make_catalogue(n, theDate):
+  return catalogue.Catalogue(theDate, make_DSOs(n, theDate), "bench")
+
+def legacy_gallery(cat, theDate):
+  html = '<!DOCTYPE html><html><head><title>' + str(theDate) + '</title>' + views.GALLERY_STYLE + '</head><body style="background-color:black;">'
+  for dso_data in cat.records:
+    if dso_data["max_alt"] > 0:
+      dso_name = dso_data['name']
+      image_name = "DSO_" + str(dso_name) + "_" + str(theDate) + ".png"
+      html += '<div class="responsive"><div class="gallery"><figure><a href="https://simbad.cds.unistra.fr/simbad/sim-basic?Ident=' + str(dso_name) + '"  target="_blank"><img src="{{ get_url(\'static\', filename=\'' + str(image_name) + '\') }}" alt="' + str(image_name) + '" title="' + str(dso_data["object_type_string"]) + '"/></a><figcaption>' + str(dso_name) + ': ' + str(dso_data["object_type_string"]) + '</figcaption></figure></div></div>'
+  html += '</body></html>'
+  return template(html)
+
+def views_gallery(cat, theDate):
+  records = [r for r in cat.records if r["max_alt"] > 0]
+  # the server streams these parts, the entries in chunks
+  return (views.GALLERY_HEAD.render(title=theDate)
+          + views.GALLERY_ENTRIES.render(records=records, charts=(), thumbs="/img/thumbs/", full="/img/full/", theDate=theDate, chart="/chart/" + theDate + "/", tracks="/tracks/" + theDate)
+          + views.GALLERY_TAIL.render(message=None, script=None))
+
+def views_list(cat, theDate):
+  return views.LIST.render(title=theDate, records=cat.filter(direction="S", min_alt=10.0), show_type=True, message=None)
+
+def timed(fn, repeat):
+  t0 = time.perf_counter()
+  for i in range(repeat):
+    fn()
+  return (time.perf_counter() - t0) / repeat
+
+if __name__ == '__main__':
+  options, args = parser.parse_args()
+
+  app = bottle.Bottle()
+  app.route('/static/<filename:path>', name='static', callback=lambda filename: None)
+  BaseTemplate.defaults['get_url'] = app.get_url
+
+  theDate = "19.10.2026"
+  print("%8s %12s %12s %12s" % ("objects", "legacy ms", "gallery ms", "list ms"))
+  for n in [int(x) for x in options.sizes.split(",")]:
+    cat = make_catalogue(n, theDate)
+    # the legacy template() needs a request context for get_url()
+    bottle.request.bind({'SCRIPT_NAME' : '', 'PATH_INFO' : '/'})
+    # every night/catalogue change produced a new template string, so the template cache did not help
+    legacy = timed(lambda: (bottle.TEMPLATES.clear(), legacy_gallery(cat, theDate)), options.repeat)
+    gallery = timed(lambda: views_gallery(cat, theDate), options.repeat)
+    listing = timed(lambda: views_list(cat, theDate), options.repeat)
+    print("%8d %12.2f %12.2f %12.2f" % (n, 1000 * legacy, 1000 * gallery, 1000 * listing))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi DSO server load benchmark
+#
+# Simulates phones browsing the gallery: every client loads a page and then
+# the plot images referenced by it, over one keep-alive connection.
+#
+#   python3 bench_server.py --url http://192.168.178.31:44444 --clients 10
+#
+
+import optparse
+import re
+import threading
+import time
+import http.client
+from urllib.parse import urlparse
+
+parser = optparse.OptionParser()
+parser.add_option('-u', '--url',
+    action="store", dest="url",
+    help="DSO server base url", default="http://127.0.0.1:44444")
+parser.add_option('-c', '--clients',
+    action="store", dest="clients", type="int",
+    help="Simultaneous clients", default=10)
+parser.add_option('-r', '--rounds',
+    action="store", dest="rounds", type="int",
+    help="Page loads per client", default=5)
+parser.add_option('-p', '--page',
+    action="store", dest="page",
+    help="Page to load", default="/alldsos")
+parser.add_option('-i', '--images',
+    action="store", dest="images", type="int",
+    help="Images to load per page", default=20)
+
+def percentile(values, p):
+  if len(values) == 0:
+    return 0.0
+  values = sorted(values)
+  k = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+  return values[k]
+
+def client(url, page, rounds, num_images, latencies, errors, lock):
+  u = urlparse(url)
+  conn = http.client.HTTPConnection(u.hostname, u.port or 80, timeout=120)
+
+  def fetch(p):
+    nonlocal conn
+    t0 = time.perf_counter()
+    for attempt in range(2):
+      try:
+        conn.request("GET", p)
+        resp = conn.getresponse()
+        body = resp.read()
+        if resp.status != 200:
+          raise Exception(str(resp.status) + " " + p)
+        return time.perf_counter() - t0, body
+      except (http.client.RemoteDisconnected, ConnectionError) as e:
+        # the server closed an idle keep-alive connection, retry once like a browser does
+        conn.close()
+        conn = http.client.HTTPConnection(u.hostname, u.port or 80, timeout=120)
+        error = e
+      except Exception as e:
+        conn.close()
+        conn = http.client.HTTPConnection(u.hostname, u.port or 80, timeout=120)
+        error = e
+        break
+    with lock:
+      errors.append(str(error))
+    return None
+
+  for r in range(rounds):
+    result = fetch(page)
+    if result is None:
+      continue
+    t, body = result
+    with lock:
+      latencies["page"].append(t)
+    images = re.findall(r'src="([^"]+\.png)"', body.decode("utf-8", "replace"))
+    for image in images[:num_images]:
+      result = fetch(image if image.startswith("/") else "/" + image)
+      if result is not None:
+        with lock:
+          latencies["image"].append(result[0])
+  conn.close()
+
+def run_benchmark(url, page, clients, rounds, num_images):
+  latencies = {"page": [], "image": []}
+  errors = []
+  lock = threading.Lock()
+  threads = [threading.Thread(target=client, args=(url, page, rounds, num_images, latencies, errors, lock)) for i in range(clients)]
+  t0 = time.perf_counter()
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  elapsed = time.perf_counter() - t0
+  return latencies, errors, elapsed
+
+if __name__ == '__main__':
+  options, args = parser.parse_args()
+  latencies, errors, elapsed = run_benchmark(options.url, options.page, options.clients, options.rounds, options.images)
+
+  print(str(options.clients) + " clients, " + str(options.rounds) + " x " + str(options.page) + " + up to " + str(options.images) + " images each, " + str(round(elapsed, 2)) + " s")
+  print("%-6s %6s %9s %9s %9s %9s" % ("kind", "n", "p50 ms", "p95 ms", "max ms", "req/s"))
+  for kind, values in latencies.items():
+    print("%-6s %6d %9.1f %9.1f %9.1f %9.1f" % (kind, len(values), 1000 * percentile(values, 50), 1000 * percentile(values, 95), 1000 * max(values or [0]), len(values) / elapsed))
+  if len(errors) > 0:
+    print(str(len(errors)) + " errors, e.g. " + errors[0])
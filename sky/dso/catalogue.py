@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi nightly DSO catalogue cache
+#
+# The dsos_<date>.json files written by DSO_observation_planning.py are parsed
+# once and kept in memory. A catalogue is reloaded only when its file changed
+# (mtime/size), the version string derived from that is used for ETags.
+# Nights no longer in the data directory are read from the archive (archive.py).
+#
+# Each catalogue is indexed once when it is loaded: by main direction, object
+# type class, quadrant, max. altitude (a list per ALT_STEP degrees) and time of
+# max. altitude. Every index is a list of positions in time order, with a set
+# or a per-position value for the membership test. filter() walks the smallest
+# list of the conditions asked for and checks the other conditions on those
+# with one lookup each, nothing is built or sorted per request. The main
+# direction is the quadrant in which an object spends most of the dark time
+# ('sectors', scoring.py); with min_minutes a direction matches every object
+# that spends at least that long in the quadrant.
+#
+
+import os
+import bisect
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import archive
+import scoring
+import skymath
+
+debug = False # True
+
+ALT_STEP = 10 # degrees between the altitude lists of a catalogue
+
+# type classes of object_type_string, /best/... pages and ?type= of the API
+TYPE_CLASSES = {
+  'galaxy' : ("galax",),
+  'cluster' : ("cluster", "association"),
+  'nebula' : ("nebula", "cloud", "remnant", "star forming")
+  }
+
+def type_classes(object_type_string):
+  text = str(object_type_string).lower()
+  return frozenset(c for c, words in TYPE_CLASSES.items() if any(w in text for w in words))
+
+class Catalogue:
+
+  def __init__(self, theDate, DSOs, version):
+    self.theDate = theDate
+    self.version = version
+    # records sorted by the time of max. altitude during the night, each with its name
+    self.records = []
+    for name, data in sorted(DSOs.items(), key=lambda item: str(item[1]['max_alt_time'])):
+      record = dict(data)
+      record['name'] = name
+      self.records.append(record)
+    self.by_name = {record['name'] : record for record in self.records}
+    # secondary indexes of positions in self.records, each in time order
+    by_direction = {}
+    by_type = {}
+    self.types = []
+    for i, record in enumerate(self.records):
+      by_direction.setdefault(str(record['main_directions'])[:1], []).append(i)
+      self.types.append(type_classes(record['object_type_string']))
+      for c in self.types[i]:
+        by_type.setdefault(c, []).append(i)
+    self.by_direction = {d : (positions, frozenset(positions)) for d, positions in by_direction.items()}
+    self.by_type = by_type
+    self.times = [str(record['max_alt_time']) for record in self.records]
+    # max. altitudes sorted and the rank of each position among them, for min_alt
+    by_alt = sorted(range(len(self.records)), key=lambda i: float(self.records[i]['max_alt']))
+    self.alts = [float(self.records[i]['max_alt']) for i in by_alt]
+    self.alt_rank = [0] * len(self.records)
+    for rank, i in enumerate(by_alt):
+      self.alt_rank[i] = rank
+    # positions at least 0, ALT_STEP, 2 * ALT_STEP, ... degrees high
+    self.above = [[i for i in range(len(self.records)) if float(self.records[i]['max_alt']) >= alt] for alt in range(0, 90 + 1, ALT_STEP)]
+    # minutes per quadrant N, E, S, W (zero for catalogues without 'sectors'),
+    # per position and the positions with any time in the quadrant
+    quadrants = scoring.quadrants(np.array([record.get('sectors') or [0] * scoring.SECTORS for record in self.records], dtype=np.int64).reshape(-1, scoring.SECTORS))
+    self.quadrants = quadrants.tolist()
+    self.in_quadrants = [np.nonzero(quadrants[:, q] > 0)[0].tolist() for q in range(len(scoring.QUADRANTS))]
+    # J2000 coordinates of the records for the current alt/az (/now)
+    self.positions = skymath.Positions(self.records)
+
+  def __len__(self):
+    return len(self.records)
+
+  def candidates(self, direction, min_minutes, min_alt, type_class, time_from, time_to):
+    # the shortest list of positions (in time order) matching one of the indexed
+    # conditions, a superset of the result
+    lo = 0 if time_from is None else bisect.bisect_left(self.times, time_from)
+    hi = len(self.records) if time_to is None else bisect.bisect_right(self.times, time_to)
+    result = range(lo, max(lo, hi))
+    lists = []
+    if direction is not None:
+      if min_minutes is None:
+        lists.append(self.by_direction.get(str(direction), ((), None))[0])
+      elif float(min_minutes) > 0:
+        lists.append(self.in_quadrants[scoring.QUADRANTS.index(str(direction))])
+    if type_class is not None:
+      lists.append(self.by_type.get(type_class, ()))
+    if min_alt is not None and float(min_alt) >= 0:
+      lists.append(self.above[min(int(float(min_alt) // ALT_STEP), len(self.above) - 1)])
+    for positions in lists:
+      if len(positions) < len(result):
+        result = positions
+    return result
+
+  def filter(self, direction=None, min_alt=None, object_type=None, visible=None, min_score=None, max_score=None, time_from=None, time_to=None, min_minutes=None):
+    # time_from/time_to: "%Y-%m-%d %H:%M:%S" strings as stored in max_alt_time;
+    # object_type: a type class (galaxy, cluster, nebula) or part of object_type_string;
+    # direction: the main direction, or with min_minutes a quadrant the object is observed in
+    type_class = None
+    if object_type is not None:
+      object_type = str(object_type).lower()
+      if object_type in TYPE_CLASSES:
+        type_class = object_type
+    matches = None # positions of the main direction
+    quadrant = None
+    if direction is not None:
+      if min_minutes is None:
+        matches = self.by_direction.get(str(direction), ((), frozenset()))[1]
+      elif str(direction) not in scoring.QUADRANTS or len(str(direction)) != 1:
+        return []
+      else:
+        quadrant = scoring.QUADRANTS.index(str(direction))
+        min_minutes = float(min_minutes)
+    min_rank = None
+    if min_alt is not None:
+      min_rank = bisect.bisect_left(self.alts, float(min_alt))
+    result = []
+    for i in self.candidates(direction, min_minutes, min_alt, type_class, time_from, time_to):
+      if matches is not None and i not in matches:
+        continue
+      if quadrant is not None and self.quadrants[i][quadrant] < min_minutes:
+        continue
+      if min_rank is not None and self.alt_rank[i] < min_rank:
+        continue
+      if type_class is not None:
+        if type_class not in self.types[i]:
+          continue
+      record = self.records[i]
+      if type_class is None and object_type is not None and object_type not in str(record['object_type_string']).lower():
+        continue
+      if visible is not None and bool(record['visible']) != visible:
+        continue
+      if min_score is not None and float(record['score']) < float(min_score):
+        continue
+      if max_score is not None and float(record['score']) > float(max_score):
+        continue
+      if time_from is not None and not self.times[i] >= time_from:
+        continue
+      if time_to is not None and not self.times[i] <= time_to:
+        continue
+      result.append(record)
+    return result
+
+CACHED_CATALOGUES = 8 # parsed catalogues kept in memory (nights, sites, archived nights)
+
+catalogues = OrderedDict() # file name -> (mtime, size, Catalogue), least recently used first
+catalogues_lock = threading.Lock()
+stats = {'hits' : 0, 'misses' : 0}
+
+def cached_catalogue(key, st):
+  cached = catalogues.get(key)
+  if cached is None or cached[0] != st.st_mtime_ns or cached[1] != st.st_size:
+    return None
+  try:
+    catalogues.move_to_end(key)
+  except KeyError: # dropped by another thread meanwhile
+    pass
+  stats['hits'] += 1
+  return cached[2]
+
+def cache(key, st, cat):
+  # called with catalogues_lock held
+  catalogues[key] = (st.st_mtime_ns, st.st_size, cat)
+  catalogues.move_to_end(key)
+  while len(catalogues) > CACHED_CATALOGUES:
+    catalogues.popitem(last=False)
+
+def catalogue_file(root, theDate):
+  return os.path.join(root, "dsos_" + str(theDate) + ".json")
+
+def load(root, theDate):
+  # returns the cached Catalogue of the night or None if not available
+  dso_data_file = catalogue_file(root, theDate)
+  try:
+    st = os.stat(dso_data_file)
+  except OSError:
+    return archived(root, theDate)
+  cat = cached_catalogue(dso_data_file, st)
+  if cat is not None:
+    return cat
+
+  with catalogues_lock:
+    stats['misses'] += 1
+    if debug:
+      print("Load catalogue: " + str(dso_data_file))
+    with open(dso_data_file, 'r', encoding='utf-8') as f:
+      DSOs = json.load(f)
+    version = str(theDate) + "-" + format(st.st_mtime_ns, 'x') + "-" + format(st.st_size, 'x')
+    cat = Catalogue(theDate, DSOs, version)
+    cache(dso_data_file, st, cat)
+  return cat
+
+def archived(root, theDate):
+  # Catalogue of an archived night, None if not archived
+  key = ("archive", root, str(theDate)) # the sites have their own archives
+  bundle = archive.catalogue_bundle(root, archive.month_of(theDate))
+  try:
+    st = os.stat(bundle)
+  except OSError:
+    return None
+  cat = cached_catalogue(key, st)
+  if cat is not None:
+    return cat
+  with catalogues_lock:
+    stats['misses'] += 1
+    night = archive.catalogue(root, theDate)
+    if night is None:
+      return None
+    DSOs, version = night
+    cat = Catalogue(theDate, DSOs, str(theDate) + "-" + version)
+    cache(key, st, cat)
+  return cat
@@ -11,3 +11,101 @@ coordinates = dict(
   location = 'Darmstadt',
   timezone = 'Europe/Berlin'
 )
+
+# further observing sites (sites.py), the keys of coordinates plus their horizon
+# file; computed together with the home site by --sites, served under /site/<name>/
+sites = dict(
+  #field = dict(latitude = 49.727, longitude = 9.043, elevation = 420, location = 'Odenwald', timezone = 'Europe/Berlin', horizon = 'horizon_field.txt'),
+  #club = dict(latitude = 49.817, longitude = 8.784, elevation = 230, location = 'Club observatory', timezone = 'Europe/Berlin', horizon = None),
+)
+
+# data directory of catalogues, plots and tracks; local JPL ephemeris
+paths = dict(
+  data = '/home/pi/sky/dso',
+  ephemeris = '/home/pi/sky/dso/de421.bsp'
+)
+
+# DSO server
+server = dict(
+  host = '0.0.0.0',   # address to listen on, 0.0.0.0 = all interfaces
+  port = 44444,
+  mode = 'threaded',  # threaded | prefork (threaded in several processes) | wsgiref (bottle's single-threaded default server)
+  workers = 4,        # processes in prefork mode, e.g. one per core
+  threads = 8,        # worker threads serving requests (per process)
+  backlog = 64,       # connections waiting in the kernel to be accepted
+  queue = 32,         # accepted connections waiting for a free worker thread
+  keepalive = 5       # seconds an idle keep-alive connection is held open
+)
+
+# background catalogue jobs started via /c and /p
+jobs = dict(
+  workers = 1,  # catalogue runs at the same time
+  nice = 10     # CPU priority increment of the catalogue runs
+)
+
+# nights precalculated by the server while nobody uses it
+scheduler = dict(
+  nights = 7,   # today and the following nights, 0 = off
+  idle = 60,    # seconds without requests before a night is calculated
+  plot = False  # also create the PNG plots
+)
+
+# live positions pushed to the browsers (/now/stream, livestream.py)
+live = dict(
+  interval = 10,  # seconds between updates
+  min_alt = 0,    # altitude threshold in degrees for "time above" and the objects sent
+  clients = 16,   # streams at a time, written by one thread (not in wsgiref mode)
+  buffer = 2      # updates queued per client, older ones are dropped
+)
+
+# nights packed into monthly bundles in <data>/archive (archive.py)
+archive = dict(
+  keep_days = 14  # nights kept in the data directory
+)
+
+# catalogue of a night in chunks of objects (pipeline.py)
+pipeline = dict(
+  chunk = 32,       # objects tracked and scored at a time
+  max_rss_mb = 300  # soft limit: the chunks get smaller above this resident memory, 0 = no limit
+)
+
+# sidereal-day reference tracks of the catalogue reused from night to night (sidereal.py)
+sidereal = dict(
+  samples = 1440,   # sidereal times per day, linear in between
+  max_age_days = 30 # rebuilt after this, precession moves the objects ~0.001 deg a month
+)
+
+# ranking of the objects of a night (scoring.py), scores 0..10
+scoring = dict(
+  dark_sun_alt = -12, # the sky counts as dark below this Sun altitude (nautical night)
+  min_alt = 5,        # objects lower than this are not observable
+  full_hours = 6,     # hours above min_alt in the dark for the full 'hours' weight
+  weights = dict(
+    altitude = 4,     # max. altitude in the dark
+    hours = 3,        # time above min_alt in the dark
+    transit = 1.5,    # culmination in the dark
+    moon = 1,         # distance to the Moon while it is up
+    airmass = 0.5     # airmass at the best time
+  )
+)
+
+# visibility calendar of the next nights (yearcalendar.py, /api/calendar)
+calendar = dict(
+  nights = 365,  # nights from today
+  step = 15,     # minutes between the samples of a night
+  min_alt = 30,  # hours above this altitude in degrees with the Moon down count
+  min_hours = 2  # a night is good for an object with at least these hours
+)
+
+# local horizon (horizon.py): lines "azimuth altitude" in degrees, the lowest
+# observable altitude, linear in between; a flat horizon without the file
+horizon = dict(
+  file = 'horizon.txt'  # relative to the directory of config.py
+)
+
+# gallery image variants of the plots
+thumbnails = dict(
+  width = 320,        # thumbnail width in pixels
+  colors = 128,       # palette size of thumbnails and compressed plots
+  pregenerate = True  # create the variants right after plotting
+)
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi JSON API over the nightly DSO catalogue
+#
+# /api/<dd.mm.yyyy>/dsos?direction=S&min_minutes=60&min_alt=20&type=galaxy&visible=true
+#     &min_score=5&max_score=9&from=22:00&to=02:30
+#     &fields=name,max_alt,max_alt_time&sort=-score&limit=20&offset=0
+#
+# Responses are built from the cached in-memory catalogue, encoded once per
+# catalogue version and query, gzip compressed on request and validated by an
+# ETag derived from the catalogue version.
+#
+# /now?min_alt=0&direction=S&type=galaxy&sort=-alt&limit=20&at=2024-07-25 23:30
+#
+# Current altitude/azimuth of all objects of the night's catalogue (skymath.py),
+# computed on every request.
+#
+# /api/calendar?name=M31,M42&min_hours=2&hours=true
+#
+# Nights of the year ahead (yearcalendar.py) in which the objects are high in
+# a dark sky without the Moon: per object the good nights as a string of 0/1
+# from the first night on, their number, the best night and on request the
+# hours of every night. Sorted by the number of good nights.
+#
+
+import json
+import hashlib
+import datetime
+import threading
+from collections import OrderedDict
+
+import pytz
+import numpy as np
+
+from bottle import HTTPError
+
+import config
+import catalogue
+import httpcache
+import scoring
+import skymath
+import yearcalendar
+
+debug = False # True
+
+FILTERS = ('direction', 'min_minutes', 'min_alt', 'type', 'visible', 'min_score', 'max_score', 'from', 'to')
+NOW_FIELDS = ('object_type_string', 'visible', 'score', 'max_alt', 'max_alt_time')
+PAGING = ('fields', 'sort', 'limit', 'offset')
+CACHE_SIZE = 64 # encoded responses kept
+
+responses = OrderedDict() # (version, query) -> [etag, body, gzipped body]
+responses_lock = threading.Lock()
+stats = {'hits' : 0, 'misses' : 0}
+
+def parse_bool(value):
+  if value.lower() in ("1", "true", "yes"):
+    return True
+  if value.lower() in ("0", "false", "no"):
+    return False
+  raise ValueError("not a boolean: " + str(value))
+
+def parse_count(value, name):
+  # offset and limit: integers >= 0
+  count = int(value)
+  if count < 0:
+    raise ValueError(name + " below 0: " + str(value))
+  return count
+
+def time_bound(theDate, value):
+  # "HH:MM" is a time of the observation night starting at theDate, times before
+  # noon belong to the next morning; full "YYYY-MM-DD HH:MM" timestamps are kept
+  if len(value) <= 5:
+    t = datetime.datetime.strptime(value, "%H:%M").time()
+    day = datetime.datetime.strptime(theDate, "%d.%m.%Y").date()
+    if t.hour < 12:
+      day += datetime.timedelta(days=1)
+    value = datetime.datetime.combine(day, t).strftime("%Y-%m-%d %H:%M:%S")
+  else:
+    value = datetime.datetime.strptime(value[:16], "%Y-%m-%d %H:%M").strftime("%Y-%m-%d %H:%M:%S")
+  return value
+
+def sort_key(field):
+  def key(record):
+    value = record.get(field)
+    # numbers before strings, missing values last
+    if value is None:
+      return (2, 0, "")
+    if isinstance(value, (int, float)):
+      return (0, value, "")
+    return (1, 0, str(value))
+  return key
+
+def select(cat, query):
+  # query: dict of the request parameters, returns the JSON payload
+  try:
+    filters = dict(
+      direction = query.get('direction'),
+      min_minutes = float(query['min_minutes']) if 'min_minutes' in query else None,
+      min_alt = float(query['min_alt']) if 'min_alt' in query else None,
+      object_type = query.get('type'),
+      visible = parse_bool(query['visible']) if 'visible' in query else None,
+      min_score = float(query['min_score']) if 'min_score' in query else None,
+      max_score = float(query['max_score']) if 'max_score' in query else None,
+      time_from = time_bound(cat.theDate, query['from']) if 'from' in query else None,
+      time_to = time_bound(cat.theDate, query['to']) if 'to' in query else None)
+    offset = parse_count(query.get('offset', 0), "offset")
+    limit = parse_count(query['limit'], "limit") if 'limit' in query else None
+  except ValueError as e:
+    raise HTTPError(400, "Invalid query: " + str(e))
+
+  records = cat.filter(**filters)
+
+  sort = query.get('sort')
+  if sort:
+    reverse = sort.startswith("-")
+    records = sorted(records, key=sort_key(sort.lstrip("-")), reverse=reverse)
+
+  total = len(records)
+  records = records[offset:] if limit is None else records[offset:offset + limit]
+
+  fields = query.get('fields')
+  if fields:
+    fields = [f.strip() for f in fields.split(",") if len(f.strip()) > 0]
+    records = [{f : r[f] for f in fields if f in r} for r in records]
+
+  return {
+    'date' : cat.theDate,
+    'version' : cat.version,
+    'total' : total,
+    'offset' : offset,
+    'limit' : limit,
+    'dsos' : records
+    }
+
+def encoded(cat, query, select=select):
+  # cat: catalogue or calendar (version), select builds the payload of a query
+  key = (cat.version, tuple(sorted(query.items())))
+  with responses_lock:
+    entry = responses.get(key)
+    if entry is not None:
+      responses.move_to_end(key)
+      stats['hits'] += 1
+      return entry
+  stats['misses'] += 1
+  body = json.dumps(select(cat, query), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+  etag = '"' + cat.version + "-" + hashlib.md5(repr(key[1]).encode('utf-8')).hexdigest()[:12] + '"'
+  entry = [etag, body, None]
+  with responses_lock:
+    responses[key] = entry
+    while len(responses) > CACHE_SIZE:
+      responses.popitem(last=False)
+  return entry
+
+def respond(cat, query, request, response, select=select):
+  entry = encoded(cat, query, select)
+  headers = {'ETag' : entry[0], 'Cache-Control' : "no-cache", 'Vary' : "Accept-Encoding"}
+  if httpcache.etag_matches(request, entry[0]):
+    return httpcache.not_modified(headers)
+  for k, v in headers.items():
+    response.set_header(k, v)
+  response.content_type = "application/json; charset=UTF-8"
+  if entry[2] is None and len(entry[1]) >= httpcache.GZIP_MIN_SIZE and httpcache.accepts_gzip(request):
+    entry[2] = httpcache.compress(entry[1])
+  return httpcache.encode(request, response, entry[1], entry[2])
+
+def dsos(root, theDate, request, response):
+  cat = catalogue.load(root, theDate)
+  if cat is None:
+    raise HTTPError(404, "DSO catalogue for " + str(theDate) + " not available.")
+  query = {k : request.query.getunicode(k) for k in request.query.keys() if k in FILTERS or k in PAGING}
+  return respond(cat, query, request, response)
+
+def dso(root, theDate, name, request, response):
+  cat = catalogue.load(root, theDate)
+  if cat is None or name not in cat.by_name:
+    raise HTTPError(404, str(name) + " not available for " + str(theDate) + ".")
+  record = dict(cat.by_name[name], assessment=scoring.describe(name, cat.by_name[name]))
+  body = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+  etag = '"' + cat.version + '"'
+  headers = {'ETag' : etag, 'Cache-Control' : "no-cache"}
+  if httpcache.etag_matches(request, etag):
+    return httpcache.not_modified(headers)
+  for k, v in headers.items():
+    response.set_header(k, v)
+  response.content_type = "application/json; charset=UTF-8"
+  return httpcache.encode(request, response, body)
+
+def current(root, when):
+  # catalogue of the observation night at when (local time), after midnight
+  # the night started the day before
+  for day in (when.date(), when.date() - datetime.timedelta(days=1)):
+    cat = catalogue.load(root, day.strftime("%d.%m.%Y"))
+    if cat is not None and len(cat.positions) > 0:
+      return cat
+  return None
+
+def now(root, request, response, site=None):
+  # site: profile of another site (sites.py), default the home site
+  site = config.coordinates if site is None else site
+  query = request.query
+  tz = pytz.timezone(site['timezone'])
+  try:
+    if 'at' in query:
+      when = tz.localize(datetime.datetime.strptime(query['at'][:16], "%Y-%m-%d %H:%M"))
+    else:
+      when = datetime.datetime.now(tz)
+    min_alt = float(query.get('min_alt', 0.0))
+    limit = parse_count(query['limit'], "limit") if 'limit' in query else None
+    direction = query.get('direction')
+    if direction is not None and direction.upper() not in skymath.COMPASS:
+      raise ValueError("unknown direction: " + str(direction))
+  except ValueError as e:
+    raise HTTPError(400, "Invalid query: " + str(e))
+  cat = current(root, when)
+  if cat is None:
+    raise HTTPError(404, "No DSO catalogue with coordinates for " + when.strftime("%d.%m.%Y") + ".")
+
+  positions = cat.positions
+  alt, az = positions.altaz(site['latitude'], site['longitude'], when)
+  mask = alt >= min_alt
+  if direction is not None:
+    mask &= skymath.in_direction(az, direction)
+  object_type = query.get('type')
+  if object_type is not None:
+    object_type = object_type.lower()
+    mask &= np.array([object_type in str(r['object_type_string']).lower() for r in positions.records], dtype=bool)
+
+  sort = query.get('sort', "-alt")
+  field = sort.lstrip("-")
+  values = {'alt' : alt, 'az' : az}.get(field)
+  if values is not None:
+    key = lambda i: values[i]
+  else:
+    key = lambda i: sort_key(field)(positions.records[i])
+  indices = sorted(mask.nonzero()[0].tolist(), key=key, reverse=sort.startswith("-"))
+  total = len(indices)
+  if limit is not None:
+    indices = indices[:limit]
+
+  directions = skymath.compass(az[indices])
+  dsos = []
+  for i, d in zip(indices, directions):
+    record = positions.records[i]
+    entry = {'name' : record['name'], 'alt' : round(float(alt[i]), 2), 'az' : round(float(az[i]), 2), 'direction' : d}
+    for f in NOW_FIELDS:
+      if f in record:
+        entry[f] = record[f]
+    dsos.append(entry)
+  body = json.dumps({
+    'time' : when.isoformat(timespec='seconds'),
+    'date' : cat.theDate,
+    'location' : site['location'],
+    'total' : total,
+    'dsos' : dsos
+    }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+  response.set_header('Cache-Control', "no-store")
+  response.content_type = "application/json; charset=UTF-8"
+  return httpcache.encode(request, response, body)
+
+def calendar_select(cal, query):
+  try:
+    min_hours = float(query.get('min_hours', config.calendar['min_hours']))
+    hours = parse_bool(query['hours']) if 'hours' in query else False
+  except ValueError as e:
+    raise HTTPError(400, "Invalid query: " + str(e))
+  names = [n.strip() for n in query['name'].split(",")] if query.get('name') else cal.names
+  indices = [cal.index[n] for n in names if n in cal.index]
+  good = cal.good(min_hours)[indices]
+  count = good.sum(axis=1)
+  best = np.argmax(cal.quarters[indices], axis=1)
+  dates = [d.strftime("%d.%m.%Y") for d in cal.dates()]
+  dsos = []
+  for k in sorted(range(len(indices)), key=lambda k: -count[k]):
+    i = indices[k]
+    entry = {
+      'name' : cal.names[i],
+      'good_nights' : int(count[k]),
+      'best' : dates[best[k]] if cal.quarters[i, best[k]] > 0 else None,
+      'best_hours' : float(cal.quarters[i, best[k]]) / 4.0,
+      'good' : "".join("1" if g else "0" for g in good[k].tolist())
+      }
+    if hours:
+      entry['hours'] = (cal.quarters[i] / 4.0).tolist()
+    dsos.append(entry)
+  return {
+    'first' : dates[0] if dates else None,
+    'nights' : cal.nights(),
+    'min_alt' : cal.min_alt,
+    'dark_sun_alt' : cal.dark_sun_alt,
+    'min_hours' : min_hours,
+    'total' : len(dsos),
+    'dsos' : dsos
+    }
+
+def calendar(root, request, response, site=None):
+  # the calendar starting with the current night, calculated on the first request of a day
+  cat = current(root, datetime.datetime.now(pytz.timezone((site or config.coordinates)['timezone'])))
+  if cat is None:
+    raise HTTPError(404, "No DSO catalogue with coordinates.")
+  first = datetime.datetime.strptime(cat.theDate, "%d.%m.%Y").date()
+  cal = yearcalendar.get(root, first, cat.records, site)
+  query = {k : request.query.getunicode(k) for k in ('name', 'min_hours', 'hours') if k in request.query}
+  return respond(cal, query, request, response, calendar_select)
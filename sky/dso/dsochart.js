@@ -0,0 +1,266 @@
+// ObsPi DSO visibility charts drawn in the browser
+//
+// Reads the binary tracks of a night (tracks_<dd.mm.yyyy>.bin, see tracks.py)
+// once per page and draws the same chart as DSO.plot() into every
+//   <canvas class="dsochart" data-tracks="/tracks/<date>" data-name="M31" data-date="<date>">
+// when it scrolls into view: twilight bands, Sun, Moon and the object's
+// altitude colored by azimuth. data-horizon="az:alt az:alt ..." is the local
+// horizon profile (horizon.py), the sky it hides is shaded along the object's
+// azimuth track.
+
+(function () {
+  "use strict";
+
+  var HEADER = {1: 20, 2: 24}; // header size per version of the file
+  var VIRIDIS = [[68, 1, 84], [59, 82, 139], [33, 145, 140], [94, 201, 98], [253, 231, 37]];
+  var loaded = {};
+
+  function load(url) {
+    if (!loaded[url]) {
+      loaded[url] = fetch(url).then(function (response) {
+        if (!response.ok) {
+          throw new Error(url + ": " + response.status);
+        }
+        return response.arrayBuffer();
+      }).then(parse);
+    }
+    return loaded[url];
+  }
+
+  function parse(buffer) {
+    var view = new DataView(buffer);
+    var magic = String.fromCharCode(view.getUint8(0), view.getUint8(1), view.getUint8(2), view.getUint8(3));
+    var version = view.getUint16(4, true);
+    if (magic !== "DSOT" || !(version in HEADER)) {
+      throw new Error("not a DSO tracks file");
+    }
+    var samples = view.getUint16(6, true);
+    // version 1: uint16 objects and name block length, version 2: uint32
+    var objects = version === 1 ? view.getUint16(8, true) : view.getUint32(8, true);
+    var length = version === 1 ? view.getUint16(10, true) : view.getUint32(12, true);
+    var start = view.getFloat32(HEADER[version] - 8, true);
+    var step = view.getFloat32(HEADER[version] - 4, true);
+    var names = new TextDecoder("utf-8").decode(new Uint8Array(buffer, HEADER[version], length)).replace(/\n$/, "").split("\n");
+    var offset = HEADER[version] + length;
+
+    function take(Type, count) {
+      var a = new Type(buffer, offset, count);
+      offset += count * Type.BYTES_PER_ELEMENT;
+      return a;
+    }
+
+    var tracks = {
+      hours: [],
+      sun: take(Int16Array, samples),
+      moon: take(Int16Array, samples),
+      index: {},
+      samples: samples
+    };
+    var alt = take(Int16Array, samples * objects);
+    var az = take(Uint16Array, samples * objects);
+    for (var i = 0; i < samples; i++) {
+      tracks.hours.push(start + step * i);
+    }
+    names.forEach(function (name, k) {
+      tracks.index[name] = {
+        alt: alt.subarray(k * samples, (k + 1) * samples),
+        az: az.subarray(k * samples, (k + 1) * samples)
+      };
+    });
+    return tracks;
+  }
+
+  function parseHorizon(text) {
+    // [[az, alt], ...] sorted by azimuth, null for a flat horizon
+    var points = (text || "").trim().split(/\s+/).filter(Boolean).map(function (p) {
+      return p.split(":").map(Number);
+    });
+    return points.length > 0 ? points.sort(function (a, b) { return a[0] - b[0]; }) : null;
+  }
+
+  function horizonAt(profile, az) {
+    // linear between the points, wrapping around at 360 like numpy.interp(period=360)
+    var n = profile.length, k = 0;
+    while (k < n && profile[k][0] <= az) {
+      k++;
+    }
+    var lo = k > 0 ? profile[k - 1] : [profile[n - 1][0] - 360, profile[n - 1][1]];
+    var hi = k < n ? profile[k] : [profile[0][0] + 360, profile[0][1]];
+    return hi[0] === lo[0] ? lo[1] : lo[1] + (hi[1] - lo[1]) * (az - lo[0]) / (hi[0] - lo[0]);
+  }
+
+  function viridis(f) {
+    f = Math.min(1, Math.max(0, f)) * (VIRIDIS.length - 1);
+    var i = Math.min(VIRIDIS.length - 2, Math.floor(f));
+    var t = f - i;
+    var c = VIRIDIS[i].map(function (v, k) { return Math.round(v + (VIRIDIS[i + 1][k] - v) * t); });
+    return "rgb(" + c.join(",") + ")";
+  }
+
+  function draw(canvas, tracks) {
+    var name = canvas.getAttribute("data-name");
+    var track = tracks.index[name];
+    var ratio = window.devicePixelRatio || 1;
+    var width = canvas.width, height = canvas.height;
+    if (!canvas.getAttribute("data-scaled")) {
+      canvas.style.width = "100%";
+      canvas.width = width * ratio;
+      canvas.height = height * ratio;
+      canvas.setAttribute("data-scaled", "1");
+    } else {
+      width = canvas.width / ratio;
+      height = canvas.height / ratio;
+    }
+    var ctx = canvas.getContext("2d");
+    ctx.setTransform(ratio, 0, 0, ratio, 0, 0);
+
+    var left = 48, right = 70, top = 30, bottom = 40;
+    var w = width - left - right, h = height - top - bottom;
+    function x(hour) { return left + (hour + 12) / 24 * w; }
+    function y(alt) { return top + h - Math.max(0, Math.min(90, alt)) / 90 * h; }
+
+    ctx.fillStyle = "lightgrey";
+    ctx.fillRect(0, 0, width, height);
+    ctx.fillStyle = "white";
+    ctx.fillRect(left, top, w, h);
+
+    // twilight time, night time, astronomical night
+    [[7, "#8c8c8c"], [-13, "#595959"], [-19, "#000000"]].forEach(function (band) {
+      ctx.fillStyle = band[1];
+      for (var i = 0; i < tracks.samples - 1; i++) {
+        if (tracks.sun[i] / 100 < band[0]) {
+          ctx.fillRect(x(tracks.hours[i]), top, x(tracks.hours[i + 1]) - x(tracks.hours[i]) + 0.5, h);
+        }
+      }
+    });
+
+    // sky hidden by the local horizon
+    var profile = parseHorizon(canvas.getAttribute("data-horizon"));
+    if (track && profile) {
+      ctx.fillStyle = "rgba(139,69,19,0.6)";
+      for (var j = 0; j < tracks.samples - 1; j++) {
+        var limit = horizonAt(profile, track.az[j] / 100);
+        if (limit > 0) {
+          ctx.fillRect(x(tracks.hours[j]), y(limit), x(tracks.hours[j + 1]) - x(tracks.hours[j]) + 0.5, y(0) - y(limit));
+        }
+      }
+    }
+
+    // grid and axes
+    ctx.strokeStyle = "rgba(160,160,160,0.6)";
+    ctx.lineWidth = 1;
+    ctx.fillStyle = "black";
+    ctx.font = "12px sans-serif";
+    ctx.textAlign = "right";
+    ctx.textBaseline = "middle";
+    for (var a = 0; a <= 90; a += 10) {
+      ctx.beginPath(); ctx.moveTo(left, y(a)); ctx.lineTo(left + w, y(a)); ctx.stroke();
+      ctx.fillText(a + "°", left - 4, y(a));
+    }
+    ctx.textAlign = "center";
+    ctx.textBaseline = "top";
+    for (var hr = -12; hr <= 12; hr += 2) {
+      ctx.beginPath(); ctx.moveTo(x(hr), top); ctx.lineTo(x(hr), top + h); ctx.stroke();
+      ctx.fillText(String(hr < 0 ? hr + 24 : hr), x(hr), top + h + 4);
+    }
+    ctx.fillText("Hours from Midnight", left + w / 2, top + h + 20);
+    ctx.textBaseline = "alphabetic";
+    ctx.font = "16px sans-serif";
+    ctx.fillText(name + " " + (canvas.getAttribute("data-date") || ""), left + w / 2, top - 10);
+
+    ctx.save();
+    ctx.beginPath(); ctx.rect(left, top, w, h); ctx.clip();
+
+    function line(values, color, dash) {
+      ctx.strokeStyle = color;
+      ctx.lineWidth = 1.5;
+      ctx.setLineDash(dash);
+      ctx.beginPath();
+      for (var i = 0; i < tracks.samples; i++) {
+        var px = x(tracks.hours[i]), py = top + h - values[i] / 100 / 90 * h;
+        if (i === 0) { ctx.moveTo(px, py); } else { ctx.lineTo(px, py); }
+      }
+      ctx.stroke();
+      ctx.setLineDash([]);
+    }
+    line(tracks.sun, "orange", []);
+    line(tracks.moon, "#bfbfbf", [6, 4]);
+
+    if (track) {
+      for (var i = 0; i < tracks.samples; i++) {
+        if (track.alt[i] >= 0) {
+          ctx.fillStyle = viridis(track.az[i] / 36000);
+          ctx.beginPath();
+          ctx.arc(x(tracks.hours[i]), y(track.alt[i] / 100), 2, 0, 2 * Math.PI);
+          ctx.fill();
+        }
+      }
+    }
+    ctx.restore();
+
+    // azimuth color bar
+    var bx = left + w + 14, bw = 12;
+    for (var k = 0; k < h; k++) {
+      ctx.fillStyle = viridis(1 - k / h);
+      ctx.fillRect(bx, top + k, bw, 1.5);
+    }
+    ctx.fillStyle = "black";
+    ctx.font = "11px sans-serif";
+    ctx.textAlign = "left";
+    ctx.textBaseline = "middle";
+    [0, 90, 180, 270, 360].forEach(function (v) {
+      ctx.fillText(String(v), bx + bw + 3, top + h - v / 360 * h);
+    });
+
+    // legend
+    ctx.textBaseline = "middle";
+    ctx.font = "12px sans-serif";
+    [["Sun", "orange"], ["Moon", "#bfbfbf"], [name, viridis(0.5)]].forEach(function (entry, n) {
+      ctx.fillStyle = "rgba(255,255,255,0.8)";
+      ctx.fillRect(left + 4, top + 4 + n * 16, 90, 16);
+      ctx.fillStyle = entry[1];
+      ctx.fillRect(left + 8, top + 11 + n * 16, 14, 3);
+      ctx.fillStyle = "black";
+      ctx.fillText(entry[0], left + 28, top + 12 + n * 16);
+    });
+
+    if (!track) {
+      ctx.fillStyle = "red";
+      ctx.textAlign = "center";
+      ctx.fillText(name + " not available", left + w / 2, top + h / 2);
+    }
+  }
+
+  function render(canvas) {
+    load(canvas.getAttribute("data-tracks")).then(function (tracks) {
+      draw(canvas, tracks);
+    }).catch(function (e) {
+      var ctx = canvas.getContext("2d");
+      ctx.fillStyle = "red";
+      ctx.fillText(String(e), 10, 20);
+    });
+  }
+
+  function init() {
+    var canvases = Array.prototype.slice.call(document.querySelectorAll("canvas.dsochart"));
+    if (!("IntersectionObserver" in window)) {
+      canvases.forEach(render);
+      return;
+    }
+    var observer = new IntersectionObserver(function (entries) {
+      entries.forEach(function (entry) {
+        if (entry.isIntersecting) {
+          observer.unobserve(entry.target);
+          render(entry.target);
+        }
+      });
+    }, { rootMargin: "200px" });
+    canvases.forEach(function (canvas) { observer.observe(canvas); });
+  }
+
+  if (document.readyState === "loading") {
+    document.addEventListener("DOMContentLoaded", init);
+  } else {
+    init();
+  }
+})();
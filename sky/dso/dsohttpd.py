@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi multi-threaded HTTP server for the DSO server
+#
+# bottle's default server (wsgiref) handles one request at a time, so a slow
+# /tonight page blocks every gallery image. This server only uses the standard
+# library: accepted connections are handed to a fixed pool of worker threads,
+# connections are kept alive between requests (HTTP/1.1) and the number of
+# connections waiting for a worker is bounded. An application can take over
+# its connection (environ['dsohttpd.detach'], the live stream): the server
+# writes nothing more to it, doesn't close it and the worker thread is free.
+#
+# The pre-fork mode runs this server in several processes to use all cores of
+# the Pi: the parent opens the listening socket, loads the shared read-only
+# data (preload callback), freezes it for the garbage collector and forks the
+# workers, which accept from the same socket, so the workers don't load it
+# again. Only pages the workers don't write to stay shared: the memory-mapped
+# ephemeris and large bytes buffers do, Python objects like the catalogue dicts
+# are copied into a worker as soon as it reads them (reference counts), which
+# gc.freeze() does not prevent. The parent restarts workers that die.
+#
+
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from select import select
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, ServerHandler
+import bottle
+
+debug = False # True
+
+class KeepAliveServerHandler(ServerHandler):
+  http_version = "1.1"
+  chunked = False   # body sent with chunked transfer encoding
+  completed = False # last chunk sent
+
+  def cleanup_headers(self):
+    ServerHandler.cleanup_headers(self)
+    # streamed responses (generators) have no Content-Length: HTTP/1.1 clients
+    # get them chunked, so the body reaches them piece by piece and the
+    # connection can be kept alive
+    if 'Content-Length' not in self.headers and self.environ.get('SERVER_PROTOCOL') == "HTTP/1.1" \
+        and self.environ.get('REQUEST_METHOD') != "HEAD" and self.status[:3] not in ("204", "304") and 'Transfer-Encoding' not in self.headers:
+      self.headers['Transfer-Encoding'] = "chunked"
+      self.chunked = True
+
+  def write(self, data):
+    if not self.status:
+      raise AssertionError("write() before start_response()")
+    if not self.headers_sent:
+      self.bytes_sent = len(data) # Content-Length of single block responses, see set_content_length()
+      self.send_headers()
+      if not self.chunked:
+        self._write(data)
+        self._flush()
+        return
+      self.bytes_sent = 0
+    if not self.chunked:
+      return ServerHandler.write(self, data)
+    if len(data) > 0: # an empty chunk would end the body
+      self.bytes_sent += len(data)
+      self._write(format(len(data), 'x').encode('ascii') + b"\r\n" + data + b"\r\n")
+      self._flush()
+
+  def finish_content(self):
+    ServerHandler.finish_content(self)
+    if self.chunked:
+      self._write(b"0\r\n\r\n")
+      self._flush()
+      self.completed = True
+
+  def _write(self, data):
+    if not self.request_handler.detached:
+      ServerHandler._write(self, data)
+
+  def _flush(self):
+    if not self.request_handler.detached:
+      ServerHandler._flush(self)
+
+  def handle_error(self):
+    if self.headers_sent: # broken off response, the client can't tell where it ends
+      self.request_handler.close_connection = True
+    ServerHandler.handle_error(self)
+
+  def close(self):
+    # without a Content-Length or chunked encoding the end of the body is marked by
+    # closing the connection, as is a stream broken off by an error
+    if not self.headers_sent or ('Content-Length' not in self.headers and not self.chunked) or (self.chunked and not self.completed) \
+        or self.headers.get('Connection', '').lower() == 'close':
+      self.request_handler.close_connection = True
+    ServerHandler.close(self)
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+  protocol_version = "HTTP/1.1"
+  quiet = False
+
+  def address_string(self): # no reverse DNS lookups
+    return self.client_address[0]
+
+  def log_request(self, *args, **kw):
+    if not self.quiet:
+      return WSGIRequestHandler.log_request(self, *args, **kw)
+
+  def setup(self):
+    # idle keep-alive connections are dropped after this many seconds
+    self.timeout = self.server.keepalive
+    self.detached = False
+    WSGIRequestHandler.setup(self)
+
+  def detach(self):
+    # the connection now belongs to the application, which writes the whole
+    # response itself; the response returned by it is dropped
+    self.detached = True
+    self.close_connection = True
+    self.server.detach(self.request)
+    return self.request
+
+  def handle(self):
+    self.close_connection = True
+    self.handle_one_request()
+    while not self.close_connection and self.wait_for_request():
+      self.handle_one_request()
+
+  def wait_for_request(self):
+    # an idle keep-alive connection holds on to its worker thread, so give it
+    # up as soon as other connections are waiting for a worker
+    self.request.settimeout(0)
+    try:
+      if len(self.rfile.peek(1)) > 0: # next request already buffered
+        return True
+    except (OSError, ValueError):
+      return False
+    finally:
+      self.request.settimeout(self.timeout)
+    deadline = time.monotonic() + self.server.keepalive
+    while time.monotonic() < deadline:
+      readable, _, _ = select([self.request], [], [], 0.1)
+      if len(readable) > 0:
+        return True
+      if self.server.waiting > 0:
+        return False
+    return False
+
+  def handle_one_request(self):
+    try:
+      self.raw_requestline = self.rfile.readline(65537)
+    except (socket.timeout, ConnectionError):
+      self.close_connection = True
+      return
+    if len(self.raw_requestline) > 65536:
+      self.requestline = ''
+      self.request_version = ''
+      self.command = ''
+      self.send_error(414)
+      self.close_connection = True
+      return
+    if not self.raw_requestline:
+      self.close_connection = True
+      return
+    if not self.parse_request(): # an error code has been sent
+      return
+    if self.request_version != "HTTP/1.1":
+      self.close_connection = True
+
+    environ = self.get_environ()
+    environ['dsohttpd.detach'] = self.detach
+    handler = KeepAliveServerHandler(self.rfile, self.wfile, self.get_stderr(), environ, multithread=True)
+    handler.request_handler = self # backpointer for logging
+    handler.run(self.server.get_app())
+    try:
+      self.wfile.flush()
+    except (socket.timeout, ConnectionError):
+      self.close_connection = True
+
+class PooledWSGIServer(WSGIServer):
+  allow_reuse_address = True
+
+  def __init__(self, server_address, RequestHandlerClass, threads=8, backlog=64, queue=32, keepalive=5):
+    self.request_queue_size = backlog # listen() backlog, used by server_activate()
+    self.keepalive = keepalive
+    self.threads = threads
+    # connections accepted but not yet served by a worker; when all slots are
+    # taken the accept loop waits and new clients queue up in the listen backlog
+    self.slots = threading.BoundedSemaphore(threads + queue)
+    self.waiting = 0
+    self.waiting_lock = threading.Lock()
+    self.detached = set() # connections taken over by the application
+    self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="dsohttpd")
+    WSGIServer.__init__(self, server_address, RequestHandlerClass)
+
+  def process_request(self, request, client_address):
+    self.slots.acquire()
+    # small responses are written as header + body, don't let Nagle delay them
+    request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    with self.waiting_lock:
+      self.waiting += 1
+    try:
+      self.pool.submit(self.process_request_thread, request, client_address)
+    except RuntimeError: # pool already shut down
+      with self.waiting_lock:
+        self.waiting -= 1
+      self.slots.release()
+      self.shutdown_request(request)
+
+  def process_request_thread(self, request, client_address):
+    with self.waiting_lock:
+      self.waiting -= 1
+    try:
+      self.finish_request(request, client_address)
+    except Exception:
+      self.handle_error(request, client_address)
+    finally:
+      with self.waiting_lock:
+        detached = request in self.detached
+        self.detached.discard(request)
+      if not detached:
+        self.shutdown_request(request)
+      self.slots.release()
+
+  def detach(self, request):
+    with self.waiting_lock:
+      self.detached.add(request)
+
+  def server_close(self):
+    WSGIServer.server_close(self)
+    self.pool.shutdown(wait=False)
+
+def make_server(host, port, app, threads=8, backlog=64, queue=32, keepalive=5, quiet=False):
+  handler_class = type("RequestHandler", (KeepAliveRequestHandler,), {"quiet": quiet})
+  server_class = PooledWSGIServer
+  if ':' in host: # IPv6 address
+    server_class = type("PooledWSGIServer6", (PooledWSGIServer,), {"address_family": socket.AF_INET6})
+  srv = server_class((host, port), handler_class, threads=threads, backlog=backlog, queue=queue, keepalive=keepalive)
+  srv.set_app(app)
+  if debug:
+    print("dsohttpd: " + str(threads) + " threads, backlog " + str(backlog) + ", queue " + str(queue) + ", keep-alive " + str(keepalive) + "s")
+  return srv
+
+# bottle adapter: run(server=PooledServer, threads=8, backlog=64, queue=32, keepalive=5)
+class PooledServer(bottle.ServerAdapter):
+  def run(self, app):
+    self.srv = make_server(self.host, self.port, app, quiet=self.quiet, **self.options)
+    self.port = self.srv.server_port
+    try:
+      self.srv.serve_forever()
+    except KeyboardInterrupt:
+      self.srv.server_close()
+      raise
+
+def prefork(srv, workers, preload=None, started=None, stopped=None):
+  # serves srv from workers forked processes until interrupted; started(number)
+  # and stopped(number) run in worker number 0..workers-1
+  srv.socket.setblocking(False) # the workers compete for connections, the losers must not block in accept()
+  if preload is not None:
+    preload()
+  # the preloaded objects are never collected, the collector of a worker must not
+  # touch (and copy) their pages
+  gc.collect()
+  gc.freeze()
+  children = {} # pid -> worker number
+
+  def spawn(number):
+    pid = os.fork()
+    if pid != 0:
+      children[pid] = number
+      return
+    # worker
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    code = 0
+    try:
+      if started is not None:
+        started(number)
+      srv.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    except Exception:
+      traceback.print_exc()
+      code = 1
+    finally:
+      try:
+        if stopped is not None:
+          stopped(number)
+      finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+  def terminate(signum, frame):
+    raise KeyboardInterrupt()
+  signal.signal(signal.SIGTERM, terminate)
+
+  for number in range(workers):
+    spawn(number)
+  if debug:
+    print("dsohttpd: " + str(workers) + " workers " + str(sorted(children)))
+  try:
+    while True:
+      pid, status = os.wait()
+      number = children.pop(pid, None)
+      if number is None:
+        continue
+      print("dsohttpd: worker " + str(number) + " (" + str(pid) + ") exited with " + str(os.waitstatus_to_exitcode(status)) + ", restarting")
+      time.sleep(1) # don't spin if workers die at once
+      spawn(number)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    for pid in children:
+      try:
+        os.kill(pid, signal.SIGTERM)
+      except OSError:
+        pass
+    for pid in list(children):
+      try:
+        os.waitpid(pid, 0)
+      except OSError:
+        pass
+    WSGIServer.server_close(srv)
+
+# bottle adapter: run(server=PreforkServer, workers=4, preload=..., started=..., stopped=...,
+# threads=8, backlog=64, queue=32, keepalive=5)
+class PreforkServer(bottle.ServerAdapter):
+  def run(self, app):
+    options = dict(self.options)
+    workers = options.pop('workers', os.cpu_count() or 1)
+    hooks = {k : options.pop(k, None) for k in ('preload', 'started', 'stopped')}
+    self.srv = make_server(self.host, self.port, app, quiet=self.quiet, **options)
+    self.port = self.srv.server_port
+    prefork(self.srv, workers, **hooks)
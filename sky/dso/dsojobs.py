@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi background catalogue jobs
+#
+# The /c and /p routes used to run DSO_observation_planning.py synchronously
+# inside the HTTP worker. Jobs are now queued and run by a background executor
+# at a lower CPU priority. Requests for a date which is already queued or being
+# calculated are coalesced into the existing job. The planner reports its
+# progress ("Progress: <n>/<total> <name>") on stdout, which is used for the
+# status and ETA. Background jobs (scheduler.py) can be paused and resumed.
+#
+# The prefork workers (dsohttpd.py) have a queue each. A running job holds an
+# flock on <data>/jobs/<date>.lock, so there is one planner per date in all
+# processes, and publishes its status in <date>.json. A request in another
+# worker joins it (RemoteJob) and /jobs lists the jobs of all workers. Only the
+# process running a job can pause it: a request joining a paused background job
+# leaves <date>.wanted, the scheduler of the owner resumes it (claimed()).
+#
+
+import os, sys
+import fcntl
+import json
+import re
+import signal
+import subprocess
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+import metrics
+
+debug = False # True
+
+DSO_DIR = os.path.dirname(os.path.abspath(__file__))
+PLANNER = os.path.join(DSO_DIR, "DSO_observation_planning.py")
+PROGRESS = re.compile(r"^Progress: (\d+)/(\d+)\s*(.*)$")
+KEEP_FINISHED = 20 # finished jobs kept for the status endpoint
+ACTIVE = ("queued", "running", "paused")
+JOBS_DIR = os.path.join(config.paths['data'], "jobs")
+
+def job_file(theDate, extension):
+  # lock, status (json) and wanted marker of the date's job
+  return os.path.join(JOBS_DIR, str(theDate) + "." + extension)
+
+def held(theDate):
+  # a process runs a job for the date
+  try:
+    with open(job_file(theDate, "lock"), 'r') as f:
+      fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+      return False
+  except BlockingIOError:
+    return True
+  except OSError:
+    return False
+
+def read_status(theDate):
+  try:
+    with open(job_file(theDate, "json"), 'r', encoding='utf-8') as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return None
+
+class Job:
+
+  def __init__(self, theDate, plot, background=False):
+    self.theDate = theDate
+    self.plot = plot
+    self.background = background # started by the scheduler, not requested
+    self.state = "queued" # queued | running | paused | done | failed
+    self.proc = None
+    self.lock = threading.Lock() # state changes of pause/resume vs. the end of the run
+    self.processed = 0
+    self.total = 0
+    self.current = ""
+    self.submitted = time.time()
+    self.started = None
+    self.finished = None
+    self.returncode = None
+    self.output = deque(maxlen=10) # last lines printed by the planner
+    self.locked = False # holds the lock of its date, publishes its status
+
+  def command(self):
+    cmd = [sys.executable, PLANNER, "--catalogue", "--progress", "--date", self.theDate]
+    if self.plot:
+      cmd.append("--plot")
+    return cmd
+
+  def catalogue_file(self):
+    return os.path.join(config.paths['data'], "dsos_" + str(self.theDate) + ".json")
+
+  def active(self):
+    return self.state in ACTIVE
+
+  def pause(self):
+    # stops the planner process (SIGSTOP), it keeps its memory
+    with self.lock:
+      if self.state == "running" and self.proc is not None:
+        self.proc.send_signal(signal.SIGSTOP)
+        self.state = "paused"
+    self.publish()
+
+  def resume(self):
+    with self.lock:
+      if self.state == "paused" and self.proc is not None:
+        self.state = "running"
+        self.proc.send_signal(signal.SIGCONT)
+    self.publish()
+
+  def publish(self):
+    # status for the other processes, written while the job holds the lock
+    if not self.locked:
+      return
+    status = self.status()
+    status.update(submitted=self.submitted, finished=self.finished)
+    tmp = job_file(self.theDate, "json." + str(os.getpid()) + ".tmp")
+    try:
+      with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(status, f)
+      os.replace(tmp, job_file(self.theDate, "json"))
+    except OSError as e:
+      print("DSO job status " + str(self.theDate) + " not written: " + str(e))
+
+  def covers(self, plot):
+    # a catalogue+plot job also creates the catalogue
+    return self.plot or not plot
+
+  def eta(self):
+    if self.state != "running" or self.processed == 0 or self.total == 0:
+      return None
+    elapsed = time.time() - self.started
+    return round(elapsed / self.processed * (self.total - self.processed), 1)
+
+  def status(self):
+    duration = None
+    if self.started is not None:
+      duration = round((self.finished or time.time()) - self.started, 1)
+    return {
+      'date' : self.theDate,
+      'mode' : "plot" if self.plot else "catalogue",
+      'state' : self.state,
+      'background' : self.background,
+      'processed' : self.processed,
+      'total' : self.total,
+      'current' : self.current,
+      'eta_seconds' : self.eta(),
+      'duration_seconds' : duration,
+      'returncode' : self.returncode,
+      'catalogue' : os.path.isfile(self.catalogue_file()),
+      'pid' : os.getpid(), # the worker in prefork mode
+      'output' : list(self.output)
+      }
+
+class RemoteJob:
+  # job of another process (prefork worker) seen through its status file;
+  # only its owner pauses and resumes it
+
+  def __init__(self, status):
+    self.theDate = status['date']
+    self.plot = status['mode'] == "plot"
+    self.background = status['background']
+    self.locked = False
+
+  @property
+  def state(self):
+    status = read_status(self.theDate)
+    if status is None or not held(self.theDate):
+      return "done" if os.path.isfile(os.path.join(config.paths['data'], "dsos_" + str(self.theDate) + ".json")) else "failed"
+    return status['state']
+
+  def active(self):
+    return self.state in ACTIVE
+
+  def pause(self):
+    pass
+
+  def resume(self):
+    pass
+
+  def claim(self):
+    # somebody waits for it now, see JobQueue.claimed()
+    try:
+      open(job_file(self.theDate, "wanted"), 'a').close()
+      self.background = False
+    except OSError as e:
+      print("DSO job " + str(self.theDate) + " not claimed: " + str(e))
+
+class JobQueue:
+
+  def __init__(self, workers=1, nice=10):
+    self.nice = nice
+    self.jobs = OrderedDict()
+    self.lock = threading.Lock()
+    self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dsojobs")
+
+  def submit(self, theDate, plot, background=False):
+    with self.lock:
+      for job in self.jobs.values():
+        if job.theDate == theDate and job.active() and job.covers(plot):
+          if debug:
+            print("Coalesce job " + str(theDate) + " into running/queued job")
+          if not background:
+            # somebody waits for it now
+            job.background = False
+            job.resume()
+          return job
+      status = read_status(theDate)
+      if status is not None and status['pid'] != os.getpid() and status['state'] in ACTIVE and (status['mode'] == "plot" or not plot) and held(theDate):
+        # running in another worker
+        job = RemoteJob(status)
+        if not background and job.background:
+          job.claim()
+        return job
+      job = Job(theDate, plot, background)
+      self.jobs[id(job)] = job
+      self.expire()
+    self.executor.submit(self.run, job)
+    return job
+
+  def expire(self):
+    finished = [k for k, job in self.jobs.items() if not job.active()]
+    for k in finished[:max(0, len(finished) - KEEP_FINISHED)]:
+      del self.jobs[k]
+
+  def claimed(self, job):
+    # a request of another worker joined the background job
+    if not job.locked or not os.path.exists(job_file(job.theDate, "wanted")):
+      return False
+    job.background = False
+    job.resume()
+    return True
+
+  def waiting(self):
+    # requested jobs queued behind others
+    with self.lock:
+      return any(job.state == "queued" and not job.background for job in self.jobs.values())
+
+  def resume_all(self):
+    # paused planners must not outlive the server stopped
+    with self.lock:
+      jobs = list(self.jobs.values())
+    for job in jobs:
+      job.resume()
+
+  def lower_priority(self):
+    os.nice(self.nice)
+
+  def run(self, job):
+    try:
+      os.makedirs(JOBS_DIR, exist_ok=True)
+      lockfile = open(job_file(job.theDate, "lock"), 'a')
+    except OSError as e:
+      print("DSO job error " + str(job.theDate) + ": " + str(e))
+      job.output.append(str(e))
+      job.state = "failed"
+      return
+    try:
+      # one planner per date in all processes, a job of another worker is waited for
+      fcntl.flock(lockfile, fcntl.LOCK_EX)
+      previous = read_status(job.theDate)
+      if previous is not None and previous['state'] == "done" and (previous['finished'] or 0) >= job.submitted and (previous['mode'] == "plot" or not job.plot):
+        # calculated by another worker meanwhile
+        job.output.append("Calculated by worker " + str(previous['pid']))
+        job.state = "done"
+        job.finished = time.time()
+        return
+      self.remove_wanted(job)
+      job.locked = True
+      self.execute(job)
+      job.publish()
+    finally:
+      job.locked = False
+      self.remove_wanted(job)
+      fcntl.flock(lockfile, fcntl.LOCK_UN)
+      lockfile.close()
+
+  def remove_wanted(self, job):
+    try:
+      os.remove(job_file(job.theDate, "wanted"))
+    except OSError:
+      pass
+
+  def execute(self, job):
+    job.state = "running"
+    job.started = time.time()
+    job.publish()
+    published = job.started
+    if debug:
+      print("Run job: " + " ".join(job.command()))
+    try:
+      proc = subprocess.Popen(job.command(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1, preexec_fn=self.lower_priority)
+      job.proc = proc
+      for line in proc.stdout:
+        line = line.rstrip()
+        m = PROGRESS.match(line)
+        if m:
+          job.processed = int(m.group(1))
+          job.total = int(m.group(2))
+          job.current = m.group(3)
+          if time.time() - published >= 1:
+            published = time.time()
+            job.publish()
+        elif len(line) > 0:
+          job.output.append(line)
+      returncode = proc.wait()
+      with job.lock:
+        job.returncode = returncode
+        job.proc = None
+        # the planner reports its errors on stdout, the result is the catalogue file
+        if job.returncode == 0 and os.path.isfile(job.catalogue_file()):
+          job.state = "done"
+        else:
+          job.state = "failed"
+    except Exception as e:
+      print("DSO job error " + str(job.theDate) + ": " + str(e))
+      job.output.append(str(e))
+      job.state = "failed"
+    job.finished = time.time()
+    metrics.JOB_SECONDS.observe((('mode', "plot" if job.plot else "catalogue"), ('state', job.state)), job.finished - job.started)
+
+  def remote(self):
+    # jobs of the other processes from their status files, a job whose lock is
+    # no longer held while its status is active ended with its worker
+    try:
+      names = os.listdir(JOBS_DIR)
+    except OSError:
+      return []
+    jobs = []
+    for name in names:
+      if not name.endswith(".json"):
+        continue
+      status = read_status(name[:-len(".json")])
+      if status is None or status['pid'] == os.getpid():
+        continue
+      if status['state'] in ACTIVE and not held(status['date']):
+        status['state'] = "failed"
+      jobs.append(status)
+    jobs.sort(key=lambda status: (status['state'] in ACTIVE, status['finished'] or 0))
+    return jobs[-KEEP_FINISHED:]
+
+  def status(self, theDate=None):
+    with self.lock:
+      jobs = [job.status() for job in self.jobs.values()]
+    jobs += self.remote()
+    return [job for job in jobs if theDate is None or job['date'] == theDate]
+
+jobs = JobQueue(config.jobs['workers'], config.jobs['nice'])
@@ -5,47 +5,55 @@
 #
 
 import os, sys
+import itertools
+import atexit
+import threading
 import time
-from datetime import date, datetime
+started = time.monotonic() # startup timing, see /health
+from datetime import date, datetime, timedelta
 import bottle
-from bottle import route, run, template, BaseTemplate, get, post, request, static_file # https://bottlepy.org/docs/dev/
-import json, socket
+from bottle import route, run, get, post, request # https://bottlepy.org/docs/dev/
+import json
 import pytz
 import ephem
 from math import degrees as deg
 import math, decimal
 dec = decimal.Decimal
-from skyfield.api import load
-from skyfield.framelib import ecliptic_frame
-import spaceweather as sw #https://pypi.org/project/spaceweather/
 import config
+import dsohttpd
+import dsojobs
+import catalogue
+import dsoapi
+import httpcache
+import views
+import thumbnails
+import tracks
+import horizon
+import ephemeris
+import metrics
+import scheduler
+import archive
+import sites
+import livestream
+import yearcalendar
 
 debug = False # True
 
-def get_IP_adress():
-  s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-  s.connect(("8.8.8.8", 80))
-  ip = s.getsockname()[0]
-  if debug:
-    print("IP: " + ip)
-  s.close()
-  return ip
-
 ########################CONFIG############################
-PORT = 44444
-HOST = get_IP_adress()
-path = '/home/pi'
-staticImageRoot = path + '/sky/dso/'
+PORT = config.server['port']
+HOST = config.server['host']
+staticImageRoot = os.path.join(config.paths['data'], '')
 ######################END#CONFIG##########################
 
 theDate = time.strftime("%d.%m.%Y")
-dso_data_file = staticImageRoot + "dsos_" + str(theDate) + ".json"
 
-eph = load('de421.bsp') # will be downloaded at first load
+# seconds after start until the routes are set up and the first response was sent
+startup = {'ready' : None, 'first_response' : None}
 
 # Target links: https://simbad.cds.unistra.fr/simbad/sim-basic?Ident=M1
 
 ###sun/moon/night###
+@metrics.timed(metrics.EPHEMERIS_SECONDS, "sun_data")
 def sun_data(theDate):
   for_date = theDate.split(".")
   for_date = date(int(for_date[2]), int(for_date[1]), int(for_date[0]))
@@ -65,6 +73,7 @@ def sun_data(theDate):
 
   return sun_rise, sun_set
 
+@metrics.timed(metrics.EPHEMERIS_SECONDS, "moon_data")
 def moon_data(theDate):
   for_date = theDate.split(".")
   for_date = date(int(for_date[2]), int(for_date[1]), int(for_date[0]))
@@ -81,18 +90,29 @@ def moon_data(theDate):
   moon_set  = ephem.localtime(home.next_setting(moon)).astimezone(tz_germany).strftime("%d.%m.%Y %H:%M")
   full_moon = ephem.localtime(ephem.next_full_moon(home.date)).strftime("%d.%m.%Y")
 
-  ts = load.timescale()
-  t = ts.utc(int(theDate.split(".")[2]), int(theDate.split(".")[1]), int(theDate.split(".")[0]), 21, 0)
-
-  sun, moon, earth = eph['sun'], eph['moon'], eph['earth']
-  e = earth.at(t)
-  s = e.observe(sun).apparent()
-  m = e.observe(moon).apparent()
-
-  _, slon, _ = s.frame_latlon(ecliptic_frame)
-  _, mlon, _ = m.frame_latlon(ecliptic_frame)
-  moon_phase = (mlon.degrees - slon.degrees) % 360.0
-  moon_phase_percent = 100.0 * m.fraction_illuminated(sun)
+  eph = ephemeris.loaded()
+  if eph is not None:
+    from skyfield.api import load
+    from skyfield.framelib import ecliptic_frame
+    ts = load.timescale()
+    t = ts.utc(int(theDate.split(".")[2]), int(theDate.split(".")[1]), int(theDate.split(".")[0]), 21, 0)
+
+    sun, moon, earth = eph['sun'], eph['moon'], eph['earth']
+    e = earth.at(t)
+    s = e.observe(sun).apparent()
+    m = e.observe(moon).apparent()
+
+    _, slon, _ = s.frame_latlon(ecliptic_frame)
+    _, mlon, _ = m.frame_latlon(ecliptic_frame)
+    moon_phase = (mlon.degrees - slon.degrees) % 360.0
+    moon_phase_percent = 100.0 * m.fraction_illuminated(sun)
+  else:
+    # ephemeris not (yet) available: pyephem, accurate to a fraction of a degree
+    t = ephem.Date(for_date.strftime("%Y/%m/%d") + " 21:00:00")
+    s = ephem.Sun(t)
+    m = ephem.Moon(t)
+    moon_phase = deg(ephem.Ecliptic(m).lon - ephem.Ecliptic(s).lon) % 360.0
+    moon_phase_percent = m.phase
 
   if debug:
     print("Moonrise: " + moon_rise)
@@ -125,6 +145,7 @@ def phase(pos):
     7: "Waning Crescent"  # abnehmender Mond
   }[int(index) & 7]
 
+@metrics.timed(metrics.EPHEMERIS_SECONDS, "astro_night_times")
 def astro_night_times(theDate):
   civil_night_start = None
   civil_night_end = None
@@ -172,419 +193,308 @@ def astro_night_times(theDate):
 
   return civil_night_start, civil_night_end, nautical_night_start, nautical_night_end, astronomical_night_start, astronomical_night_end
 
+APKP_MAX_AGE = 3 * 3600 # Kp indices are published every 3 hours
+APKP_RETRY = 600         # after a failed download (offline)
+apkp_cache = {'time' : None, 'day' : None, 'apkp' : None, 'max_age' : 0}
+
 def apkp():
+  # geomagnetic index of today, downloaded at most every APKP_MAX_AGE seconds
+  day = time.strftime("%Y-%m-%d")
+  cached = apkp_cache
+  if cached['day'] == day and time.monotonic() - cached['time'] < cached['max_age']:
+    return cached['apkp']
+  apkp = None
+  max_age = APKP_RETRY
   try:
-    # geomagnetic index
+    import spaceweather as sw #https://pypi.org/project/spaceweather/
     df_d = sw.sw_daily(update=True)
     df_3h = sw.ap_kp_3h(update=True)
-    apkp = df_3h.loc[time.strftime("%Y-%m-%d")] # for one day
+    apkp = df_3h.loc[day] # for one day
+    max_age = APKP_MAX_AGE
     if debug:
       print(apkp)
       print(type(apkp))
-    return apkp
   except Exception as e:
     print(str(e))
+  apkp_cache.update(time=time.monotonic(), day=day, apkp=apkp, max_age=max_age)
+  return apkp
 ###sun/moon/night###
 
-# build dynamically based on files in /sky/dso directory
-def createHTMLcode_DSO(theDate):
-
-  html = '''<!DOCTYPE html><html>
-         <head>
-         <meta http-equiv="Content-Type" content="text/html; charset=UTF-8">
-         <title>
-        '''
-  html += str(theDate) + ': Tonight\'s DSO\'s</title>'
-  html += '''<style>
-          figcaption {
-          background-color: black;
-          color: white;
-          font-style: italic;
-          padding: 2px;
-          text-align: left;
-        }
-        div.gallery {
-          border: 1px solid #ccc;
-        }
-        div.gallery:hover {
-          border: 1px solid #777;
-        }
-        div.gallery img {
-          width: 100%;
-          height: auto;
-        }
-        div.desc {
-          padding: 15px;
-          text-align: center;
-        }
-        * {
-          box-sizing: border-box;
-        }
-        .responsive {
-          padding: 0 6px;
-          float: left;
-          width: 49.99999%;
-        }
-        @media only screen and (max-width: 700px) {
-          .responsive {
-            width: 49.99999%;
-            margin: 6px 0;
-          }
-        }
-        @media only screen and (max-width: 500px) {
-          .responsive {
-            width: 100%;
-          }
-        }
-        .clearfix:after {
-          content: "";
-          display: table;
-          clear: both;
-        }
-        </style>
-        </head>
-        <body style="background-color:black;">'''
-
+def dated_images(theDate, root=staticImageRoot):
+  # DSO plots of the night found in the /sky/dso directory or its archive
+  files = set(os.listdir(root)) | archive.names(root, theDate)
+  images = [name for name in files if (name[-4:] in [".png"]) and (name[0] == "D") and (name[1] == "S") and (name[2] == "O") and (str(name.split("_")[2]) == (str(theDate) + ".png"))]
+  return [{'name' : i.split("_")[1], 'object_type_string' : ""} for i in images]
+
+def dated_url(routename, theDate, site=None, **kwargs):
+  # URL of a dated route, with site of its /site/<site>/ variant
+  dd, mm, yyyy = str(theDate).split(".")
+  if site is not None:
+    return app.router.build("site_" + routename, site=site, dd=dd, mm=mm, yyyy=yyyy, **kwargs)
+  return app.router.build(routename, dd=dd, mm=mm, yyyy=yyyy, **kwargs)
+
+def site_root(site):
+  # data directory of a site of config.sites (sites.py)
+  if site not in siteHorizons:
+    raise bottle.HTTPError(404, "Unknown site " + str(site) + ".")
+  return sites.data_root(site)
+
+def site_today(site):
+  # the date of tonight in the timezone of the site
+  site_root(site)
+  return datetime.now(pytz.timezone(sites.get(site)['timezone'])).strftime("%d.%m.%Y")
+
+GALLERY_CHUNK = 50 # gallery entries rendered and sent at a time
+
+def gallery(title, theDate, records, message, site=None):
+  # the gallery page as a stream: the head goes out at once, then the entries
+  # of the records iterator in chunks. Objects without a plot are drawn by
+  # the browser from the tracks of the night (of the site).
+  yield views.GALLERY_HEAD.render(title=title)
+  root = staticImageRoot if site is None else site_root(site)
+  files = None
+  tracks_file = tracks.tracks_file(root, theDate)
+  if os.path.isfile(tracks_file):
+    files = set(os.listdir(root))
+  elif archive.lookup(root, os.path.basename(tracks_file)) is not None:
+    files = archive.names(root, theDate)
+  chart = dated_url('chart', theDate, site, name='')
+  tracksURL = dated_url('tracks', theDate, site)
+  script = None
+  records = iter(records)
+  while True:
+    chunk = list(itertools.islice(records, GALLERY_CHUNK))
+    if len(chunk) == 0:
+      break
+    charts = set()
+    if files is not None:
+      charts = set(r['name'] for r in chunk if ("DSO_" + str(r['name']) + "_" + str(theDate) + ".png") not in files)
+      if len(charts) > 0:
+        script = chartScriptURL
+    yield views.GALLERY_ENTRIES.render(records=chunk, charts=charts, thumbs=thumbsURL, full=fullURL, theDate=theDate, chart=chart, tracks=tracksURL,
+                                       horizon=horizonProfile if site is None else siteHorizons[site])
+  yield views.GALLERY_TAIL.render(message=message, script=script)
+
+# build dynamically based on the catalogue or the files in /sky/dso directory
+def createHTMLcode_DSO(theDate, site=None):
+  title = str(theDate) + ': Tonight\'s DSO\'s'
+  root = staticImageRoot
+  if site is not None:
+    root = site_root(site)
+    title += " at " + str(sites.get(site)['location'])
+  records = []
+  message = None
   try:
-    DSOs = {}
-    # load DSO data from file if available
-    if os.path.isfile(dso_data_file):
-      if debug:
-        print("File exists: " + str(dso_data_file))
-      with open(dso_data_file, 'r', encoding='utf-8') as f:
-        DSOs = json.load(f)
-        #print("Loaded DSOs: " + str(DSOs))
-        #print(len(DSOs))
-
-    if len(DSOs)>0:
-      # sort by max altitude during night time
-      sorted_DSOs = dict(sorted(DSOs.items(), key=lambda item: item[1]['max_alt_time']))
-      #sorted_DSOs = OrderedDict(reversed(list(sorted_DSOs.items())))
-    
-      for dso_name, dso_data in sorted_DSOs.items():
-        if debug:
-          print(dso_name)
-          #print(dso_data)
-        if dso_data["max_alt"] > 0:
-          image_name = "DSO_" + str(dso_name) + "_" + str(theDate) + ".png"
-          if debug:
-            print(image_name)
-          htmlline = '<div class="responsive"><div class="gallery"><figure><a href="https://simbad.cds.unistra.fr/simbad/sim-basic?Ident=' + str(dso_name) + '"  target="_blank"><img src="{{ get_url(\'static\', filename=\'' + str(image_name) + '\') }}" alt="' + str(image_name) + '" title="' + str(dso_data["object_type_string"]) + '"/></a><figcaption>' + str(dso_name) + ': ' + str(dso_data["object_type_string"]) + '</figcaption></figure></div></div>'
-        else:
-          if debug:
-            print(dso_name + " is below the horizon.")
-        if debug:
-          print(htmlline)
-        html += htmlline
+    # cached catalogue, sorted by max altitude time during night time
+    cat = catalogue.load(root, theDate)
+    if cat is not None and len(cat) > 0:
+      # objects below the horizon are skipped
+      records = (r for r in cat.records if r["max_alt"] > 0)
     else:
-      files = os.listdir(staticImageRoot)
-      images = [name for name in files if (name[-4:] in [".png"]) and (name[0] == "D") and (name[1] == "S") and (name[2] == "O") and (str(name.split("_")[2]) == (str(theDate) + ".png"))]
-      for i in images:
-        if debug:
-          print(i)
-        name = i.split("_")[1]
-        if debug:
-          print(name)
-          print(DSOs[name])
-        htmlline = '<div class="responsive"><div class="gallery"><figure><a href="https://simbad.cds.unistra.fr/simbad/sim-basic?Ident=' + str(name) + '"  target="_blank"><img src="{{ get_url(\'static\', filename=\'' + str(i) + '\') }}" alt="' + str(i) + '" title="' + str(name) + '"/></a><figcaption>' + str(name) + '</figcaption></figure></div></div>'
-        if debug:
-          print(htmlline)
-        html += htmlline
+      records = dated_images(theDate, root)
   except Exception as e:
     print(str(e))
-    html += '<p style="color:red;"><bold>DSO list for ' + str(theDate) + ' not available.</bold></p>'
-
-  html += '''</body>
-          </html>'''
-  return html
-
-def createHTMLcode_DSO_list(theDate):
-
-  html = '''<!DOCTYPE html><html>
-              <head>
-              <meta http-equiv="Content-Type" content="text/html; charset=UTF-8">
-              <title>'''
-  html += str(theDate)
-  html += ": Tonight's DSO's</title>"
-  html += '''</head>
-            <body style="background-color:black;">
-            <table>'''
-
+    message = 'DSO list for ' + str(theDate) + ' not available.'
+  return gallery(title, theDate, records, message, site)
+
+def createHTMLcode_DSO_list(theDate, site=None):
+  title = str(theDate) + ": Tonight's DSO's"
+  root = staticImageRoot
+  if site is not None:
+    root = site_root(site)
+    title += " at " + str(sites.get(site)['location'])
+  records = []
   try:
-    files = os.listdir(staticImageRoot)
-    images = [name for name in files if (name[-4:] in [".png"]) and (name[0] == "D") and (name[1] == "S") and (name[2] == "O") and (str(name.split("_")[2]) == (str(theDate) + ".png"))]
-    for i in images:
-      if debug:
-        print(i)
-      name = i.split("_")[1]
-      if debug:
-        print(name)
-      html += '<tr><td>'
-      html += '<a href=\"https://simbad.cds.unistra.fr/simbad/sim-basic?Ident=' + str(name)
-      html += '\" target=\"_blank\">' + str(name) + '</a></td></tr>'
-
+    records = dated_images(theDate, root)
   except Exception as e:
     print(str(e))
-
-  html += '''</table>
-          </body>
-          </html>'''
-
-  if debug:
-    print(html)
-  return html
-
-def filter_DSOs_direction(DSOs, min_altitude_limit, direction):
-  # find objects in desired direction with altitude above xx deg during the night
-  #print(DSOs)
-  DSOs_in_direction = {}
-  for dsoname, dsodata in DSOs.items():
-    if debug:
-      print(dsoname)
-      #print(dsodata)
-      #print(dsodata["date"])
-      print("Max. altitude during AN: " + str(dsodata["max_alt"]))
-      print("Main direction: " + str(dsodata["main_directions"][0]))
-    if float(dsodata["max_alt"]) >= float(min_altitude_limit):
-      if str(dsodata["main_directions"][0]) == str(direction):
-        DSOs_in_direction[dsoname] = dsodata
-
+  return views.LIST.render(title=title, records=records, show_type=False, message=None)
+
+def filter_DSOs(theDate, direction, min_altitude_limit, object_type, site=None): #object_type: all | cluster | galaxy | nebula
+  # catalogue records in the desired direction above min_altitude_limit, sorted
+  # by max altitude time; None if there is no catalogue
+  cat = catalogue.load(staticImageRoot if site is None else site_root(site), theDate)
+  if cat is None:
+    return None
+  DSOs_in_direction_sorted = cat.filter(direction=direction, min_alt=min_altitude_limit, object_type=None if object_type == "all" else object_type)
   if debug:
     print("")
     print("DSOs in direction " + str(direction) + " above " + str(min_altitude_limit) + " deg")
-    for dsoname, dsodata in DSOs_in_direction.items():
-      print(dsoname + " (" + str(round(dsodata["max_alt"],0)) + " degrees)")
-  return DSOs_in_direction
+    for dsodata in DSOs_in_direction_sorted:
+      print(dsodata['name'] + " (" + str(round(dsodata["max_alt"],0)) + " degrees) type = " + str(dsodata["object_type_string"]))
+  return DSOs_in_direction_sorted
 
-def createHTMLcode_DSO_filtered(theDate, direction, min_altitude_limit, object_type): #object_type: all | cluster | galaxy | nebula
+def createHTMLcode_DSO_filtered(theDate, direction, min_altitude_limit, object_type, site=None): #object_type: all | cluster | galaxy | nebula
   # build dynamically filtered by direction and altitude
-  # read list if it exists
-  dso_data_file = path + "/sky/dso/dsos_" + str(theDate) + ".json"
-
-  html = '''<!DOCTYPE html><html>
-        <head><meta http-equiv="Content-Type" content="text/html; charset=UTF-8">
-        <title>'''
-  html += str(theDate) + ': Tonight\'s best DSO\'s in the ' + str(direction) + ' above ' + str(min_altitude_limit) + ' degrees'
-  html += '''</title>
-        <style>
-          figcaption {
-          background-color: black;
-          color: white;
-          font-style: italic;
-          padding: 2px;
-          text-align: left;
-        }
-        div.gallery {
-          border: 1px solid #ccc;
-        }
-        div.gallery:hover {
-          border: 1px solid #777;
-        }
-        div.gallery img {
-          width: 100%;
-          height: auto;
-        }
-        div.desc {
-          padding: 15px;
-          text-align: center;
-        }
-        * {
-          box-sizing: border-box;
-        }
-        .responsive {
-          padding: 0 6px;
-          float: left;
-          width: 49.99999%;
-        }
-        @media only screen and (max-width: 700px) {
-          .responsive {
-            width: 49.99999%;
-            margin: 6px 0;
-          }
-        }
-        @media only screen and (max-width: 500px) {
-          .responsive {
-            width: 100%;
-          }
-        }
-        .clearfix:after {
-          content: "";
-          display: table;
-          clear: both;
-        }
-        </style>
-        </head>
-        <body style="background-color:black;">'''
-
-  DSOs = {}
-  # load DSO data from file if available
-  if os.path.isfile(dso_data_file):
-    if debug:
-      print("File exists: " + str(dso_data_file))
-    with open(dso_data_file, 'r', encoding='utf-8') as f:
-      DSOs = json.load(f)
-      #print("Loaded DSOs: " + str(DSOs))
-
-    if len(DSOs)>0:
-      DSOs_filtered = filter_DSOs_direction(DSOs, min_altitude_limit, direction)
-      # sort by max altitude during night time
-      #sorted_DSOs = dict(sorted(DSOs_filtered.items(), key=lambda item: item[1]['max_alt_during_night']))
-      #sorted_DSOs = OrderedDict(reversed(list(sorted_DSOs.items())))
-      DSOs_in_direction_sorted = {k: v for k, v in sorted(DSOs_filtered.items(), key=lambda item: item[1]['max_alt_time'])}
-      
-      for dso_name, dso_data in DSOs_in_direction_sorted.items():
-        if debug:
-          print(dso_name)
-          #print(dso_data)
-        if dso_data["max_alt"]>0:
-          image_name = "DSO_" + str(dso_name) + "_" + str(theDate) + ".png"
-          if debug:
-            print(image_name)
-            print(dso_name + " (" + str(round(dso_data["max_alt"],0)) + " degrees)")
-          if object_type == "all":
-            htmlline = '<div class="responsive"><div class="gallery"><figure><a href="https://simbad.cds.unistra.fr/simbad/sim-basic?Ident=' + str(dso_name) + '"  target="_blank"><img src="{{ get_url(\'static\', filename=\'DSO_' + str(dso_name) + '_' + str(theDate) + '.png\') }}" alt="static DSO_' + str(dso_name) + '_' + str(theDate) + '.png" title="' + str(dso_data["object_type_string"]) + '"/></a><figcaption>' + str(dso_name) + ': ' + str(dso_data["object_type_string"]) + '</figcaption></figure></div></div>'
-          elif object_type in str(dso_data["object_type_string"]):
-            htmlline = '<div class="responsive"><div class="gallery"><figure><a href="https://simbad.cds.unistra.fr/simbad/sim-basic?Ident=' + str(dso_name) + '"  target="_blank"><img src="{{ get_url(\'static\', filename=\'DSO_' + str(dso_name) + '_' + str(theDate) + '.png\') }}" alt="static DSO_' + str(dso_name) + '_' + str(theDate) + '.png" title="' + str(dso_data["object_type_string"]) + '"/></a><figcaption>' + str(dso_name) + ': ' + str(dso_data["object_type_string"]) + '</figcaption></figure></div></div>'
-        else:
-          if debug:
-            print(dso_name + " is below the horizon.")
-        html += htmlline
-    else:
-      html += '<p><bold>DSO list for ' + str(theDate) + ' not available.</bold></p>'
+  title = str(theDate) + ': Tonight\'s best DSO\'s in the ' + str(direction) + ' above ' + str(min_altitude_limit) + ' degrees'
+  if site is not None:
+    title += " at " + str(sites.get(site)['location'])
+  records = []
+  message = None
+  DSOs_in_direction_sorted = filter_DSOs(theDate, direction, min_altitude_limit, object_type, site)
+  if DSOs_in_direction_sorted is None:
+    message = 'DSO file for ' + str(theDate) + ' not available.'
   else:
-    html += '<p><bold>DSO file for ' + str(theDate) + ' not available.</bold></p>'
-
-  html += '''</body>
-          </html>'''
-  return html
+    records = (r for r in DSOs_in_direction_sorted if r["max_alt"] > 0)
+  return gallery(title, theDate, records, message, site)
 
-def createHTMLcode_DSO_filtered_list(theDate, direction, min_altitude_limit, object_type): #object_type: all | cluster | galaxy | nebula
+def createHTMLcode_DSO_filtered_list(theDate, direction, min_altitude_limit, object_type, site=None): #object_type: all | cluster | galaxy | nebula
   # build dynamically filtered by direction and altitude
-  # read list if it exists
-  dso_data_file = path + "/sky/dso/dsos_" + str(theDate) + ".json"
-
-  html = '''<!DOCTYPE html><html>
-        <head><meta http-equiv="Content-Type" content="text/html; charset=UTF-8">
-        <title>'''
-  html += str(theDate) + ': Tonight\'s best DSO\'s in the ' + str(direction) + ' above ' + str(min_altitude_limit) + ' degrees'
-  html += '''</title>
-        </head>
-        <body style="background-color:black;">
-        <table>'''
-
-  DSOs = {}
-  # load DSO data from file if available
-  if os.path.isfile(dso_data_file):
-    if debug:
-      print("File exists: " + str(dso_data_file))
-    with open(dso_data_file, 'r', encoding='utf-8') as f:
-      DSOs = json.load(f)
-      #print("Loaded DSOs: " + str(DSOs))
-
-    if len(DSOs) > 0:
-      for dsoname, dsodata in DSOs.items():
-        if debug:
-          print(dsoname)
-      DSOs_filtered = filter_DSOs_direction(DSOs, min_altitude_limit, direction)
-      # sort by max altitude time
-      DSOs_in_direction_sorted = {k: v for k, v in sorted(DSOs_filtered.items(), key=lambda item: item[1]['max_alt_time'])}
-      if debug:
-        print(DSOs_in_direction_sorted)
-
-      if debug:
-        print("")
-        print("DSOs in direction " + str(direction) + " above " + str(min_altitude_limit) + " deg")
-      for dsoname, dsodata in DSOs_in_direction_sorted.items():
-        if debug:
-          print(dsoname + " (" + str(round(dsodata["max_alt"],0)) + " degrees) type = " + str(dsodata["object_type_string"]) )
-        if object_type == "all":
-          html += '<tr><td><a href="https://simbad.cds.unistra.fr/simbad/sim-basic?Ident=' + str(dsoname) + '"  target="_blank">' + str(dsoname) + ": " + str(dsodata["object_type_string"]) + '</a></td></tr>'
-        elif object_type in str(dsodata["object_type_string"]):
-          html += '<tr><td><a href="https://simbad.cds.unistra.fr/simbad/sim-basic?Ident=' + str(dsoname) + '"  target="_blank">' + str(dsoname) + ": " + str(dsodata["object_type_string"]) + '</a></td></tr>'
+  title = str(theDate) + ': Tonight\'s best DSO\'s in the ' + str(direction) + ' above ' + str(min_altitude_limit) + ' degrees'
+  if site is not None:
+    title += " at " + str(sites.get(site)['location'])
+  records = []
+  message = None
+  DSOs_in_direction_sorted = filter_DSOs(theDate, direction, min_altitude_limit, object_type, site)
+  if DSOs_in_direction_sorted is None:
+    message = 'DSO list for ' + str(theDate) + ' not available.'
   else:
-    html += '<p style="color:red;"><bold>DSO list for ' + str(theDate) + ' not available.</bold></p>'
-  html += '''</table>
-          </body>
-          </html>'''
-  return html
+    records = DSOs_in_direction_sorted
+  return views.LIST.render(title=title, records=records, show_type=True, message=message)
 
 app = bottle.default_app()
-BaseTemplate.defaults['get_url'] = app.get_url  # reference to function
 
+app.install(httpcache.gzip_plugin) # gzip encoded HTML pages
+
+MONITORING = ('/health', '/metrics', '/schedule') # polled, not somebody using the server
+
+@app.hook('before_request')
+def activity():
+  # the precalculation of nights pauses while the server is used
+  if request.path not in MONITORING:
+    scheduler.schedule.touch()
+
+@app.hook('after_request')
+def first_response():
+  if startup['first_response'] is None:
+    startup['first_response'] = round(time.monotonic() - started, 3)
+    print("First response " + str(startup['first_response']) + " s after start")
+
+# ETag/Last-Modified validated, dated plots are cached for good
 @route('/static/<filename:path>', name='static')
 def serve_static(filename):
-  response = static_file(filename, root=staticImageRoot)
-  response.set_header("Cache-Control", "public, max-age=3600")
-  return response
+  return httpcache.serve_static(staticImageRoot, filename, request, bottle.response)
+
+# gallery thumbnails and compressed full size plots, created on first request
+# (archived nights have theirs in the archive)
+@route('/img/<variant>/<filename>', name='img')
+def serve_variant(variant, filename):
+  if variant not in thumbnails.VARIANTS:
+    raise bottle.HTTPError(404, "File does not exist.")
+  thumbnails.variant(staticImageRoot, filename, variant)
+  return httpcache.serve_static(staticImageRoot, variant + "/" + filename, request, bottle.response)
+
+# altitude/azimuth tracks of all objects of a night (tracks.py)
+@route('/tracks/<dd>.<mm>.<yyyy>', name='tracks')
+def serve_tracks(dd, mm, yyyy):
+  theDate = str(dd) + "." + str(mm) + "." + str(yyyy)
+  return httpcache.serve_static(staticImageRoot, os.path.basename(tracks.tracks_file(staticImageRoot, theDate)), request, bottle.response)
 
-@route('/')
-@get('/tonight')
-def allDSOsEctTonight():
-  theDate = time.strftime("%d.%m.%Y")
-  theMonthAndYear = time.strftime("%m.%Y")
-  theHour = time.strftime("%h")
+# visibility chart of a single object drawn by the browser
+@get('/chart/<dd>.<mm>.<yyyy>/<name>', name='chart')
+def chart(dd, mm, yyyy, name):
+  theDate = str(dd) + "." + str(mm) + "." + str(yyyy)
+  return views.CHART.render(name=name, theDate=theDate, tracks=dated_url('tracks', theDate), script=chartScriptURL, horizon=horizonProfile)
+
+# resolved once for all pages
+thumbsURL = app.router.build('img', variant='thumbs', filename='')
+fullURL = app.router.build('img', variant='full', filename='')
+chartScriptURL = app.router.build('static', filename='dsochart.js')
+horizonProfile = horizon.attribute()
+# the other sites (config.sites) and their horizon profiles
+siteHorizons = {name : horizon.attribute(sites.get(name)['horizon']) for name in sites.names() if name != sites.HOME}
+
+def write_page(filename, parts):
+  # streams parts into a temporary file of this process and thread and puts
+  # it in place at once: the static handler never sees a half-written page
+  tmp = filename + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+  try:
+    with open(tmp, "w") as text_file:
+      text_file.writelines(parts)
+    os.replace(tmp, filename)
+  except BaseException:
+    if os.path.exists(tmp):
+      os.remove(tmp)
+    raise
+
+framesets = {} # FRAMESET page -> key it was rendered for by this process
+framesets_lock = threading.Lock()
+
+def frameset_pages(theDate):
+  # the gallery pages of the frameset, rendered again when the catalogue (or
+  # without one the plots in the data directory) changed
+  cat = catalogue.load(staticImageRoot, theDate)
+  key = (theDate, cat.version if cat is not None else os.stat(staticImageRoot).st_mtime_ns)
+  pages = [("FRAMESET_tonight.html", lambda: createHTMLcode_DSO(theDate))]
+  for direction in ("S", "W", "N", "E"):
+    pages.append(("FRAMESET_" + direction + "10.html", lambda direction=direction: createHTMLcode_DSO_filtered(theDate, direction, 10.0, "all")))
+  for name, render in pages:
+    filename = os.path.join(staticImageRoot, name)
+    if framesets.get(name) != key or not os.path.isfile(filename):
+      write_page(filename, render())
+      framesets[name] = key
+
+def navigation_page(theDate):
+  nav = {'theDate' : theDate, 'apkp' : ""}
+
+  civil_night_start, civil_night_end, nautical_night_start, nautical_night_end, astronomical_night_start, astronomical_night_end  = astro_night_times(theDate)
+  if astronomical_night_start != None and astronomical_night_end != None:
+    nav['astronight'] = "Astro night: " + str(astronomical_night_start.strftime("%H:%M")) + "-" + str(astronomical_night_end.strftime("%H:%M"))
+  else:
+    nav['astronight'] = "Nautical night: " + str(nautical_night_start.strftime("%H:%M")) + "-" + str(nautical_night_end.strftime("%H:%M")) + " (no astro night)"
 
-  with open(str(path) + "/sky/dso/FRAMESET_navigation.html", "w") as text_file:
-    html = HTML_NAVIGATION.replace('{theDate}', theDate)
+  sunrise, sunset = sun_data(theDate)
+  suntime = "Sun: " + str(sunrise) + " - " + str(sunset)
+  if debug:
+    print(suntime)
+  nav['suntimes'] = suntime
 
-    civil_night_start, civil_night_end, nautical_night_start, nautical_night_end, astronomical_night_start, astronomical_night_end  = astro_night_times(theDate)
-    if astronomical_night_start != None and astronomical_night_end != None:
-      html = html.replace('{astronight}', "Astro night: " + str(astronomical_night_start.strftime("%H:%M")) + "-" + str(astronomical_night_end.strftime("%H:%M")))
-    else:
-      html = html.replace('{astronight}', "Nautical night: " + str(nautical_night_start.strftime("%H:%M")) + "-" + str(nautical_night_end.strftime("%H:%M")) + " (no astro night)")
+  moonrise, moonset, full_moon, moon_phase, percent = moon_data(theDate)
+  moontime = "Moon: " + str(moonrise) + " - " + str(moonset)
+  if debug:
+    print(moontime)
+  nav['moontimes'] = moontime
+  nav['full_moon'] = "Full moon: " + str(full_moon)
 
-    sunrise, sunset = sun_data(theDate)
-    suntime = "Sun: " + str(sunrise) + " - " + str(sunset)
-    if debug:
-      print(suntime)
-    html = html.replace('{suntimes}', suntime)
+  pos = position(datetime.strptime(theDate, "%d.%m.%Y"))
+  phasename = phase(pos)
 
-    moonrise, moonset, full_moon, moon_phase, percent = moon_data(theDate)
-    moontime = "Moon: " + str(moonrise) + " - " + str(moonset)
-    if debug:
-      print(moontime)
-    html = html.replace('{moontimes}', moontime)
-    html = html.replace('{full_moon}', "Full moon: " + str(full_moon))
+  if debug:
+    print("Moon illumination: " + str(percent) + " %")
+    print("Phasename: " + str(phase))
+  nav['moon_phase'] = "Moon phase: " + str(phasename) + " (" + str(int(percent)) + " %)"
 
-    pos = position(datetime.strptime(theDate, "%d.%m.%Y"))
-    phasename = phase(pos)
+  try:
+    ak = apkp()
+    ap = ak.to_dict()['Ap']
+    kp = ak.to_dict()['Kp']
+    apkp_data = "Kp indices:</br>"
+    for t, k in kp.items():
+      ki = round(k,1)
+      if debug:
+        print(ki)
+      #apkp_data.append(t.strftime("%H:%M") + ": " + str(ki))
+      apkp_data += t.strftime("%H:%M") + ": " + str(ki) + "</br>"
+    print(apkp_data)
+    nav['apkp'] = str(apkp_data)
+  except Exception as e:
+    print(str(e))
 
-    if debug:
-      print("Moon illumination: " + str(percent) + " %")
-      print("Phasename: " + str(phase))
-    html = html.replace('{moon_phase}', "Moon phase: " + str(phasename) + " (" + str(int(percent)) + " %)")
-
-    try:
-      ak = apkp()
-      ap = ak.to_dict()['Ap']
-      kp = ak.to_dict()['Kp']
-      apkp_data = "Kp indices:</br>"
-      for t, k in kp.items():
-        ki = round(k,1)
-        if debug:
-          print(ki)
-        #apkp_data.append(t.strftime("%H:%M") + ": " + str(ki))
-        apkp_data += t.strftime("%H:%M") + ": " + str(ki) + "</br>"
-      print(apkp_data)
-      html = html.replace('{apkp}', str(apkp_data))
-    except Exception as e:
-      print(str(e))
-
-    text_file.write("%s" % template(html))
-
-  with open(str(path) + "/sky/dso/FRAMESET_tonight.html", "w") as text_file:
-    text_file.write("%s" % template(createHTMLcode_DSO(theDate)))
-  with open(str(path) + "/sky/dso/FRAMESET_S10.html", "w") as text_file:
-    text_file.write("%s" % template(createHTMLcode_DSO_filtered(theDate, "S", 10.0, "all")))
-  with open(str(path) + "/sky/dso/FRAMESET_W10.html", "w") as text_file:
-    text_file.write("%s" % template(createHTMLcode_DSO_filtered(theDate, "W", 10.0, "all")))
-  with open(str(path) + "/sky/dso/FRAMESET_N10.html", "w") as text_file:
-    text_file.write("%s" % template(createHTMLcode_DSO_filtered(theDate, "N", 10.0, "all")))
-  with open(str(path) + "/sky/dso/FRAMESET_E10.html", "w") as text_file:
-    text_file.write("%s" % template(createHTMLcode_DSO_filtered(theDate, "E", 10.0, "all")))
-
-  html = HTML_FRAMESET.replace('{theDate}', theDate)
-  return template(html)
+  return views.NAVIGATION.render(**nav)
+
+@route('/')
+@get('/tonight')
+def allDSOsEctTonight():
+  theDate = time.strftime("%d.%m.%Y")
+  with framesets_lock:
+    # sun, moon and the Kp indices of the navigation once an hour
+    key = (theDate, time.strftime("%H"))
+    filename = os.path.join(staticImageRoot, "FRAMESET_navigation.html")
+    if framesets.get("FRAMESET_navigation.html") != key or not os.path.isfile(filename):
+      write_page(filename, [navigation_page(theDate)])
+      framesets["FRAMESET_navigation.html"] = key
+    frameset_pages(theDate)
+  return views.FRAMESET.render()
 
 # All DSO's tonight
 @get('/alldsos')
@@ -593,7 +503,7 @@ def tonight():
     print(str('DSOs TONIGHT'))
   theDate = time.strftime("%d.%m.%Y")
   html = createHTMLcode_DSO(theDate)
-  return template(html)
+  return html
 
 @get('/alldsos/list')
 def tonight_list():
@@ -601,7 +511,7 @@ def tonight_list():
     print(str('DSOs TONIGHT'))
   theDate = time.strftime("%d.%m.%Y")
   html = createHTMLcode_DSO_list(theDate)
-  return template(html)
+  return html
 
 
 # The best DSO's tonight in desired direction above x degrees
@@ -611,7 +521,7 @@ def tonights_best(direction, min_altitude_limit):
     print(str('DSOs TONIGHT'))
   theDate = time.strftime("%d.%m.%Y")
   html = createHTMLcode_DSO_filtered(theDate, direction, min_altitude_limit, "all")
-  return template(html)
+  return html
 
 @get('/best/<direction>/<min_altitude_limit>/list')
 def tonights_best_list(direction, min_altitude_limit):
@@ -619,7 +529,7 @@ def tonights_best_list(direction, min_altitude_limit):
     print(str('DSOs TONIGHT'))
   theDate = time.strftime("%d.%m.%Y")
   html = createHTMLcode_DSO_filtered_list(theDate, direction, min_altitude_limit, "all")
-  return template(html)
+  return html
 
 # The best DSO's tonight in desired direction above x degrees
 @get('/<dd>.<mm>.<yyyy>/best/<direction>/<min_altitude_limit>')
@@ -628,7 +538,7 @@ def that_nights_best(dd, mm, yyyy, direction, min_altitude_limit):
   if debug:
     print("DSOs tonight " + str(theDate) + "...")
   html = createHTMLcode_DSO_filtered(theDate, direction, min_altitude_limit, "all")
-  return template(html)
+  return html
 
 @get('/<dd>.<mm>.<yyyy>')
 def night(dd, mm, yyyy):
@@ -636,7 +546,7 @@ def night(dd, mm, yyyy):
     print("DSOs at " + str(dd) + "." + str(mm) + "." + str(yyyy))
   theDate = str(dd) + "." + str(mm) + "." + str(yyyy)
   html = createHTMLcode_DSO(theDate)
-  return template(html)
+  return html
 
 @get('/<dd>.<mm>.<yyyy>/list')
 def night(dd, mm, yyyy):
@@ -644,92 +554,239 @@ def night(dd, mm, yyyy):
   if debug:
     print("DSOs at " + str(theDate) + "...")
   html = createHTMLcode_DSO_list(theDate)
-  return template(html)
+  return html
+
+
+# JSON API over the nightly catalogue
+@get('/api/tonight/dsos')
+def apiDSOsTonight():
+  theDate = time.strftime("%d.%m.%Y")
+  return dsoapi.dsos(staticImageRoot, theDate, request, bottle.response)
+
+@get('/api/<dd>.<mm>.<yyyy>/dsos')
+def apiDSOs(dd, mm, yyyy):
+  theDate = str(dd) + "." + str(mm) + "." + str(yyyy)
+  return dsoapi.dsos(staticImageRoot, theDate, request, bottle.response)
+
+# current altitude/azimuth of the catalogue objects, filtered and sorted
+@get('/now')
+def apiNow():
+  return dsoapi.now(staticImageRoot, request, bottle.response)
+
+# the same positions pushed to all clients every few seconds (server-sent events)
+@get('/now/stream')
+def apiNowStream():
+  return live_stream(livestream.positions)
+
+def live_stream(broadcast):
+  detach = request.environ.get('dsohttpd.detach')
+  if detach is None:
+    # bottle's single-threaded server would be blocked by the stream
+    raise bottle.HTTPError(503, "Live streams need the threaded or prefork server mode.")
+  if not broadcast.subscribe(detach):
+    raise bottle.HTTPError(503, "Too many live streams.", Retry_After=str(config.live['interval']))
+  return ""
+
+# good nights of the objects in the year ahead (yearcalendar.py)
+@get('/api/calendar')
+def apiCalendar():
+  return dsoapi.calendar(staticImageRoot, request, bottle.response)
+
+@get('/api/<dd>.<mm>.<yyyy>/dsos/<name>')
+def apiDSO(dd, mm, yyyy, name):
+  theDate = str(dd) + "." + str(mm) + "." + str(yyyy)
+  return dsoapi.dso(staticImageRoot, theDate, name, request, bottle.response)
+
+# the results of the other sites (config.sites, DSO_observation_planning.py --sites)
+# under /site/<site>/: galleries, JSON API, tracks, charts, positions and calendar
+@get('/sites')
+def siteList():
+  return {'sites' : [dict(sites.get(name), name=name, prefix="" if name == sites.HOME else "/site/" + name) for name in sites.names()]}
+
+@get('/site/<site>')
+@get('/site/<site>/tonight')
+def siteTonight(site):
+  return createHTMLcode_DSO(site_today(site), site)
+
+@get('/site/<site>/tonight/list')
+def siteTonightList(site):
+  return createHTMLcode_DSO_list(site_today(site), site)
+
+@get('/site/<site>/<dd>.<mm>.<yyyy>')
+def siteNight(site, dd, mm, yyyy):
+  return createHTMLcode_DSO(str(dd) + "." + str(mm) + "." + str(yyyy), site)
+
+@get('/site/<site>/<dd>.<mm>.<yyyy>/list')
+def siteNightList(site, dd, mm, yyyy):
+  return createHTMLcode_DSO_list(str(dd) + "." + str(mm) + "." + str(yyyy), site)
+
+@get('/site/<site>/best/<direction>/<min_altitude_limit>')
+def siteTonightsBest(site, direction, min_altitude_limit):
+  return createHTMLcode_DSO_filtered(site_today(site), direction, min_altitude_limit, "all", site)
+
+@get('/site/<site>/best/<direction>/<min_altitude_limit>/list')
+def siteTonightsBestList(site, direction, min_altitude_limit):
+  return createHTMLcode_DSO_filtered_list(site_today(site), direction, min_altitude_limit, "all", site)
+
+@get('/site/<site>/<dd>.<mm>.<yyyy>/best/<direction>/<min_altitude_limit>')
+def siteNightsBest(site, dd, mm, yyyy, direction, min_altitude_limit):
+  return createHTMLcode_DSO_filtered(str(dd) + "." + str(mm) + "." + str(yyyy), direction, min_altitude_limit, "all", site)
+
+@route('/site/<site>/tracks/<dd>.<mm>.<yyyy>', name='site_tracks')
+def siteTracks(site, dd, mm, yyyy):
+  root = site_root(site)
+  theDate = str(dd) + "." + str(mm) + "." + str(yyyy)
+  return httpcache.serve_static(root, os.path.basename(tracks.tracks_file(root, theDate)), request, bottle.response)
+
+@get('/site/<site>/chart/<dd>.<mm>.<yyyy>/<name>', name='site_chart')
+def siteChart(site, dd, mm, yyyy, name):
+  site_root(site)
+  theDate = str(dd) + "." + str(mm) + "." + str(yyyy)
+  return views.CHART.render(name=name, theDate=theDate, tracks=dated_url('tracks', theDate, site), script=chartScriptURL, horizon=siteHorizons[site])
+
+@get('/site/<site>/api/tonight/dsos')
+def siteApiDSOsTonight(site):
+  return dsoapi.dsos(site_root(site), site_today(site), request, bottle.response)
+
+@get('/site/<site>/api/<dd>.<mm>.<yyyy>/dsos')
+def siteApiDSOs(site, dd, mm, yyyy):
+  return dsoapi.dsos(site_root(site), str(dd) + "." + str(mm) + "." + str(yyyy), request, bottle.response)
 
+@get('/site/<site>/api/<dd>.<mm>.<yyyy>/dsos/<name>')
+def siteApiDSO(site, dd, mm, yyyy, name):
+  return dsoapi.dso(site_root(site), str(dd) + "." + str(mm) + "." + str(yyyy), name, request, bottle.response)
+
+@get('/site/<site>/now')
+def siteApiNow(site):
+  return dsoapi.now(site_root(site), request, bottle.response, sites.get(site))
+
+@get('/site/<site>/now/stream')
+def siteApiNowStream(site):
+  return live_stream(livestream.site_broadcast(site, site_root(site), sites.get(site)))
+
+@get('/site/<site>/api/calendar')
+def siteApiCalendar(site):
+  return dsoapi.calendar(site_root(site), request, bottle.response, sites.get(site))
 
 # create catalogue for today
 @get('/c')
 def createCatalogue():
-  if debug:
-    print("Create catalogue...")
-  os.system("python3 " + path + "/sky/dso/DSO_observation_planning.py --catalogue")
-  html = HTML_CALCULATING.replace('{theDate}', theDate)
-  return template(html)
+  theDate = time.strftime("%d.%m.%Y")
+  return createCatalogueJob(theDate, False)
 
 # create plots and catalogue for today
 @get('/p')
 def createCatalogueAndPlots():
-  if debug:
-    print("Create catalogue...")
-  os.system("python3 " + path + "/sky/dso/DSO_observation_planning.py --catalogue --plot")
-  html = HTML_CALCULATING.replace('{theDate}', theDate)
-  return template(html)
+  theDate = time.strftime("%d.%m.%Y")
+  return createCatalogueJob(theDate, True)
 
-# create catalogue for today
+# create catalogue for the desired date
 @get('/c/<dd>.<mm>.<yyyy>')
 def createCatalogueDate(dd, mm, yyyy):
   theDate = str(dd) + "." + str(mm) + "." + str(yyyy)
-  if debug:
-    print("Create catalogue for " + str(theDate) + "...")
-  os.system("python3 " + path + "/sky/dso/DSO_observation_planning.py --catalogue --date " + str(theDate))
-  html = HTML_CALCULATING.replace('{theDate}', theDate)
-  return template(html)
+  return createCatalogueJob(theDate, False)
 
-# create plots and catalogue for today
+# create plots and catalogue for the desired date
 @get('/p/<dd>.<mm>.<yyyy>')
 def createCatalogueAndPlotsDate(dd, mm, yyyy):
   theDate = str(dd) + "." + str(mm) + "." + str(yyyy)
+  return createCatalogueJob(theDate, True)
+
+def createCatalogueJob(theDate, plot):
+  # the date goes to the planner's command line, only real dates are queued
+  try:
+    theDate = datetime.strptime(theDate, "%d.%m.%Y").strftime("%d.%m.%Y")
+  except ValueError:
+    raise bottle.HTTPError(400, "Invalid date " + str(theDate) + ", expected dd.mm.yyyy.")
   if debug:
     print("Create catalogue for " + str(theDate) + "...")
-  os.system("python3 " + path + "/sky/dso/DSO_observation_planning.py --catalogue --plot --date " + str(theDate))
-  html = HTML_CALCULATING.replace('{theDate}', theDate)
-  return template(html)
-
-HTML_CALCULATING = '''<!DOCTYPE html><html>
-        <head><meta http-equiv="Content-Type" content="text/html; charset=UTF-8">
-        <title>DSO calculation ongoing for {theDate}...</title>
-        </head>
-        <body>
-            <p><bold>DSO calculation ongoing for {theDate}...</bold></p>
-        </body>
-        </html>
-'''
-
-HTML_FRAMESET = '''
-<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01 Frameset//EN" "http://www.w3.org/TR/html4/frameset.dtd">
-<html>
-  <head><title>Tonight</title></head>
-  <frameset cols="150, *">
-    <frame src="static/FRAMESET_navigation.html" name="navigation">
-    <frame src="static/FRAMESET_tonight.html" name="in">
-  </frameset>
-</html>
-'''
-
-HTML_NAVIGATION = '''<!DOCTYPE html><html><head>
-<link href='https://fonts.googleapis.com/css?family=Open Sans' rel='stylesheet'>
-<style>
-body {
-    font-family: 'Open Sans';
-}
-</style> <!--font-size: 18px;-->
-</head>
-<body style="background-color:black;" text="#ffffff">
-<h2>{theDate}</h2>
-<p>{astronight}</p>
-<p>{suntimes}</p>
-<p>{moontimes}</p>
-<p>{moon_phase}</p>
-<p>{full_moon}</p>
-<p><a href="FRAMESET_tonight.html" target="in">The Sky Tonight</a></p>
-<p><a href="FRAMESET_S10.html" target="in">DSOs S/10 deg</a></p>
-<p><a href="FRAMESET_W10.html" target="in">DSOs W/10 deg</a></p>
-<p><a href="FRAMESET_N10.html" target="in">DSOs N/10 deg</a></p>
-<p><a href="FRAMESET_E10.html" target="in">DSOs E/10 deg</a></p>
-<p>{apkp}</p>
-</body>
-</html>
-'''
+  # queued in the background, a running job for the same date is reused
+  dsojobs.jobs.submit(theDate, plot)
+  return views.CALCULATING.render(theDate=theDate)
+
+# status of the catalogue jobs: objects processed, ETA and result
+@get('/jobs')
+def jobStatus():
+  return {'jobs' : dsojobs.jobs.status()}
+
+@get('/jobs/<dd>.<mm>.<yyyy>')
+def jobStatusDate(dd, mm, yyyy):
+  theDate = str(dd) + "." + str(mm) + "." + str(yyyy)
+  return {'jobs' : dsojobs.jobs.status(theDate)}
+
+# liveness and startup timing, answered before the ephemeris is loaded
+@get('/health')
+def health():
+  return {
+    'status' : 'ok',
+    'uptime' : round(time.monotonic() - started, 3),
+    'pid' : os.getpid(), # the worker in prefork mode
+    'startup' : startup,
+    'ephemeris' : ephemeris.status()
+    }
+
+# cache statistics of the modules, read when scraped
+@metrics.register
+def module_stats():
+  yield from metrics.stats_lines("dso_catalogue_cache_total", "Catalogue lookups served from memory (hits) or read from the JSON file (misses).", catalogue.stats, 'result')
+  yield from metrics.stats_lines("dso_api_cache_total", "Encoded API responses reused (hits) or built (misses).", dsoapi.stats, 'result')
+  yield from metrics.stats_lines("dso_static_cache_total", "Static file responses: gzip cache hits/misses and 304 Not Modified.", httpcache.stats, 'result')
+  yield from metrics.stats_lines("dso_thumbnails_total", "Plot variants found up to date (hits) or created.", thumbnails.stats, 'result')
+  yield from metrics.stats_lines("dso_live_total", "Live position updates computed, dropped for slow clients and rejected streams.", livestream.stats, 'event')
+  yield from metrics.stats_lines("dso_live_clients", "Connected live position streams.", {'connected' : sum(len(b.subscribers) for b in [livestream.positions] + list(livestream.site_positions.values()))}, 'state', "gauge")
+  yield from metrics.stats_lines("dso_calendar_calculations_total", "Year calendars calculated.", yearcalendar.stats, 'kind')
+  yield from metrics.stats_lines("dso_archive_reads_total", "Month catalogues and files read from the archive.", archive.stats, 'kind')
+  yield from metrics.stats_lines("dso_startup_seconds", "Seconds after start until the server was ready and sent the first response.", startup, 'phase', "gauge")
+  status = ephemeris.status()
+  yield from metrics.stats_lines("dso_ephemeris_load_seconds", "Time to open the JPL ephemeris.", {'load' : status['load_seconds']}, 'phase', "gauge")
+  jobs = {}
+  for job in dsojobs.jobs.status():
+    jobs[job['state']] = jobs.get(job['state'], 0) + 1
+  yield from metrics.stats_lines("dso_jobs", "Catalogue jobs known to the queue per state.", jobs, 'state', "gauge")
+  nights = {}
+  for night in scheduler.schedule.status()['nights']:
+    nights[night['state']] = nights.get(night['state'], 0) + 1
+  yield from metrics.stats_lines("dso_scheduled_nights", "Nights of the precalculated window per state.", nights, 'state', "gauge")
+
+# nights of the precalculated window: ready | queued | running | paused | failed | missing
+@get('/schedule')
+def schedule():
+  return scheduler.schedule.status()
+
+@get('/metrics')
+def serve_metrics():
+  bottle.response.content_type = metrics.CONTENT_TYPE
+  return metrics.render()
+
+###prefork server###
+
+def preload_shared():
+  # loaded once by the parent instead of by each prefork worker: the
+  # memory-mapped ephemeris and today's compressed tracks stay shared, the
+  # catalogue dicts of the precalculated window (and last night's, for /now
+  # after midnight) are copied into a worker when it reads them
+  ephemeris.get()
+  for i in range(-1, max(1, config.scheduler['nights'])):
+    theDate = (date.today() + timedelta(days=i)).strftime("%d.%m.%Y")
+    catalogue.load(staticImageRoot, theDate)
+    tracks_file = tracks.tracks_file(staticImageRoot, theDate)
+    if i == 0 and os.path.isfile(tracks_file):
+      httpcache.gzipped_file(tracks_file, os.stat(tracks_file))
+  try:
+    import spaceweather # modules only, the indices are downloaded on request (apkp())
+  except Exception as e:
+    print(str(e))
+  scheduler.schedule.share()
+
+def worker_started(number):
+  metrics.share(os.path.join(staticImageRoot, "metrics"), number)
+  # one worker precalculates the nights
+  if number == 0:
+    scheduler.schedule.start()
+
+def worker_stopped(number):
+  if number == 0:
+    dsojobs.jobs.resume_all()
 
 # run REST server
 try:
@@ -742,11 +799,32 @@ try:
   print("http://" + str(HOST) + ":" + str(PORT) + "/best/S/10.0/list")
   print("http://" + str(HOST) + ":" + str(PORT) + "/<dd.mm.yyyy>")
   print("http://" + str(HOST) + ":" + str(PORT) + "/<dd.mm.yyyy>/list")
+  print("http://" + str(HOST) + ":" + str(PORT) + "/api/<dd.mm.yyyy>/dsos")
+  print("http://" + str(HOST) + ":" + str(PORT) + "/api/calendar")
+  print("http://" + str(HOST) + ":" + str(PORT) + "/sites")
+  print("http://" + str(HOST) + ":" + str(PORT) + "/site/<site>/tonight")
   print("http://" + str(HOST) + ":" + str(PORT) + "/c")
   print("http://" + str(HOST) + ":" + str(PORT) + "/p")
   print("http://" + str(HOST) + ":" + str(PORT) + "/c/<dd.mm.yyyy>")
   print("http://" + str(HOST) + ":" + str(PORT) + "/p/<dd.mm.yyyy>")
-  run(host=HOST, port=PORT)
+  print("http://" + str(HOST) + ":" + str(PORT) + "/jobs")
+  print("http://" + str(HOST) + ":" + str(PORT) + "/health")
+  print("http://" + str(HOST) + ":" + str(PORT) + "/metrics")
+  print("http://" + str(HOST) + ":" + str(PORT) + "/schedule")
+  startup['ready'] = round(time.monotonic() - started, 3)
+  if config.server['mode'] == 'prefork':
+    # no threads before the fork: the ephemeris is loaded by preload_shared()
+    run(app=metrics.middleware(app), host=HOST, port=PORT, server=dsohttpd.PreforkServer, workers=config.server['workers'],
+        preload=preload_shared, started=worker_started, stopped=worker_stopped,
+        threads=config.server['threads'], backlog=config.server['backlog'], queue=config.server['queue'], keepalive=config.server['keepalive'])
+  else:
+    ephemeris.preload()
+    scheduler.schedule.start()
+    atexit.register(dsojobs.jobs.resume_all)
+    if config.server['mode'] == 'threaded':
+      run(app=metrics.middleware(app), host=HOST, port=PORT, server=dsohttpd.PooledServer, threads=config.server['threads'], backlog=config.server['backlog'], queue=config.server['queue'], keepalive=config.server['keepalive'])
+    else:
+      run(app=metrics.middleware(app), host=HOST, port=PORT)
 
 except KeyboardInterrupt:
   exit()
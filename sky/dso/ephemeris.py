@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi JPL ephemeris, loaded on demand
+#
+# de421.bsp is opened from the local file config.paths['ephemeris'] on first
+# use or by the background thread started with preload(). jplephem memory-maps
+# the file, so opening it is cheap and only the pages needed are read.
+# Nothing is downloaded: without the file get() returns None and the callers
+# fall back to pyephem.
+#
+
+import os
+import threading
+import time
+
+import config
+
+debug = False # True
+
+lock = threading.Lock()
+eph = None
+state = "not loaded" # not loaded | loading | loaded | missing | failed
+load_seconds = None
+
+def get():
+  # the skyfield ephemeris, None if not available
+  global eph, state, load_seconds
+  if eph is not None:
+    return eph
+  with lock:
+    if eph is None and state in ("not loaded", "loading"):
+      state = "loading"
+      filename = config.paths['ephemeris']
+      t0 = time.monotonic()
+      if not os.path.isfile(filename):
+        state = "missing"
+        print("Ephemeris " + str(filename) + " not found, using pyephem")
+        return None
+      try:
+        from skyfield.api import load_file # skyfield is slow to import, only when needed
+        eph = load_file(filename)
+        load_seconds = time.monotonic() - t0
+        state = "loaded"
+        if debug:
+          print("Ephemeris " + str(filename) + " loaded in " + str(round(load_seconds, 3)) + " s")
+      except Exception as e:
+        state = "failed"
+        print("Ephemeris " + str(filename) + " error: " + str(e))
+  return eph
+
+def loaded():
+  # the ephemeris if it is ready, never waits for it
+  return eph
+
+def preload():
+  # opens the ephemeris in the background while the server already answers
+  threading.Thread(target=get, name="ephemeris", daemon=True).start()
+
+def status():
+  return {'state' : state, 'file' : config.paths['ephemeris'], 'load_seconds' : load_seconds}
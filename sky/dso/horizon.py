@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi local horizon
+#
+# Trees, roofs and houses hide parts of the sky. The horizon file
+# (config.horizon['file'], relative names next to config.py) lists the lowest
+# observable altitude per azimuth, linear in between and wrapping around at 360:
+#
+#   # azimuth altitude [deg]
+#   0     25   roof
+#   40    25
+#   60    10
+#   80    30   trees
+#   130   30
+#   150   5
+#
+# Without the file the horizon is flat (0 deg). altitude() is an interpolated
+# lookup over arrays of any shape, e.g. the [objects][samples] azimuth tracks of
+# a whole night at once. Other sites (sites.py) have their own file: use()
+# switches the profile of the planner to it, the server asks for a site's
+# profile by file name.
+#
+
+import os
+
+import numpy as np
+
+import config
+
+debug = False # True
+
+profile = None # (azimuths, altitudes) of the file, None while not loaded
+loaded = False
+profiles = {} # file -> profile of the sites' files, None if flat
+
+def horizon_file(filename=None):
+  filename = config.horizon['file'] if filename is None else filename
+  if not os.path.isabs(filename):
+    filename = os.path.join(os.path.dirname(os.path.abspath(config.__file__)), filename)
+  return filename
+
+def load(filename):
+  # (azimuths, altitudes) sorted by azimuth
+  points = []
+  with open(filename, 'r', encoding='utf-8') as f:
+    for line in f:
+      values = line.split("#")[0].split()
+      if len(values) >= 2:
+        points.append((float(values[0]) % 360.0, float(values[1])))
+  if len(points) == 0:
+    raise ValueError("No azimuth/altitude points in " + str(filename))
+  points.sort()
+  return np.array([p[0] for p in points]), np.array([p[1] for p in points])
+
+def get():
+  # the profile of the horizon file, None for a flat horizon
+  global profile, loaded
+  if not loaded:
+    filename = horizon_file()
+    if os.path.isfile(filename):
+      profile = load(filename)
+      if debug:
+        print("Horizon " + str(filename) + ": " + str(len(profile[0])) + " points")
+    loaded = True
+  return profile
+
+def profile_of(filename):
+  # the profile of a horizon file (cached), None for a flat horizon ("" or no file)
+  if not filename:
+    return None
+  filename = horizon_file(filename)
+  if filename not in profiles:
+    profiles[filename] = load(filename) if os.path.isfile(filename) else None
+  return profiles[filename]
+
+def use(filename):
+  # makes the horizon file of a site the profile of altitude() and limit(), "" is flat
+  global profile, loaded
+  profile, loaded = profile_of(filename), True
+
+def altitude(az, filename=None):
+  # lowest observable altitude at each azimuth (degrees), of the horizon file
+  # filename instead of the current profile if given ("" is flat)
+  p = get() if filename is None else profile_of(filename)
+  if p is None:
+    return np.zeros(np.shape(az))
+  return np.interp(np.mod(az, 360.0), p[0], p[1], period=360.0)
+
+def limit(az, min_alt, filename=None):
+  # altitude an object at az has to exceed to be observable
+  return np.maximum(altitude(az, filename), min_alt)
+
+def attribute(filename=None):
+  # the profile (of filename, default the current one) as "az:alt az:alt ..."
+  # for the browser charts (dsochart.js), "" if flat
+  p = get() if filename is None else profile_of(filename)
+  if p is None:
+    return ""
+  return " ".join(format(az, 'g') + ":" + format(alt, 'g') for az, alt in zip(p[0].tolist(), p[1].tolist()))
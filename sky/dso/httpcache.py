@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi HTTP caching helpers: ETag validation and gzip encoding
+#
+
+import os
+import re
+import gzip
+import zlib
+import types
+import mimetypes
+import threading
+import email.utils
+from collections import OrderedDict
+
+from bottle import HTTPResponse, HTTPError, static_file
+
+import archive
+
+GZIP_MIN_SIZE = 512 # smaller bodies are sent uncompressed
+GZIP_LEVEL = 6
+GZIP_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml', 'application/octet-stream') # octet-stream: tracks_<date>.bin
+GZIP_CACHE_SIZE = 32 # compressed static files kept in memory
+
+# DSO_<name>_<dd.mm.yyyy>.png plots never change once written
+DATED_PLOT = re.compile(r"^DSO_.+_\d\d\.\d\d\.\d{4}\.png$")
+CACHE_IMMUTABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDATE = "no-cache" # may be cached, but has to be validated
+
+gzipped = OrderedDict() # (file, mtime, size) -> compressed content
+gzipped_lock = threading.Lock()
+stats = {'gzip_hits' : 0, 'gzip_misses' : 0, 'not_modified' : 0}
+
+def accepts_gzip(request):
+  # Accept-Encoding with q-values: "gzip;q=0" refuses gzip, "*" stands for
+  # the codings not listed
+  qualities = {}
+  for coding in request.headers.get('Accept-Encoding', '').split(","):
+    name, _, params = coding.partition(";")
+    q = 1.0
+    for param in params.split(";"):
+      key, _, value = param.partition("=")
+      if key.strip().lower() == "q":
+        try:
+          q = float(value)
+        except ValueError:
+          q = 0.0
+    qualities[name.strip().lower()] = q
+  q = qualities.get("gzip", qualities.get("x-gzip", qualities.get("*", 0.0)))
+  return q > 0
+
+def etag_matches(request, etag):
+  inm = request.headers.get('If-None-Match')
+  if inm is None:
+    return False
+  if inm.strip() == "*":
+    return True
+  # compare weakly, a gzip encoded representation keeps the ETag of the plain one
+  tags = [t.strip().replace('W/', '') for t in inm.split(",")]
+  return etag.replace('W/', '') in tags
+
+def not_modified(headers):
+  # 304 response carrying the validators and caching headers of the full response
+  stats['not_modified'] += 1
+  return HTTPResponse(status=304, **headers)
+
+def compress(body):
+  return gzip.compress(body, GZIP_LEVEL)
+
+def compress_stream(chunks, charset):
+  # gzip stream of str/bytes chunks, each flushed so the browser can render it
+  # while the rest is produced
+  z = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS) # gzip container
+  for chunk in chunks:
+    if isinstance(chunk, str):
+      chunk = chunk.encode(charset)
+    if len(chunk) > 0:
+      yield z.compress(chunk) + z.flush(zlib.Z_SYNC_FLUSH)
+  yield z.flush()
+
+def encode(request, response, body, compressed=None):
+  # sends body gzip encoded if the client supports it, compressed is an optional
+  # pre-compressed copy of body
+  response.set_header('Vary', 'Accept-Encoding')
+  if len(body) >= GZIP_MIN_SIZE and accepts_gzip(request):
+    if compressed is None:
+      compressed = compress(body)
+    response.set_header('Content-Encoding', 'gzip')
+    body = compressed
+  response.set_header('Content-Length', str(len(body)))
+  return body
+
+def compressible(content_type):
+  # not event streams: each client would get its own compressor for the same events
+  return content_type is not None and content_type.startswith(GZIP_TYPES) and not content_type.startswith("text/event-stream")
+
+def modified_since(request, mtime):
+  ims = request.headers.get('If-Modified-Since')
+  if ims is None:
+    return True
+  try:
+    return int(mtime) > email.utils.parsedate_to_datetime(ims.split(";")[0].strip()).timestamp()
+  except (TypeError, ValueError):
+    return True
+
+def gzipped_file(filename, st):
+  key = (filename, st.st_mtime_ns, st.st_size)
+  with gzipped_lock:
+    body = gzipped.get(key)
+    if body is not None:
+      gzipped.move_to_end(key)
+      stats['gzip_hits'] += 1
+      return body
+  stats['gzip_misses'] += 1
+  with open(filename, 'rb') as f:
+    body = compress(f.read())
+  with gzipped_lock:
+    gzipped[key] = body
+    while len(gzipped) > GZIP_CACHE_SIZE:
+      gzipped.popitem(last=False)
+  return body
+
+def serve_static(root, filename, request, response):
+  # static_file() with validators (ETag/Last-Modified, 304 responses), long
+  # lived caching of dated plots and gzip encoding of text files
+  root = os.path.abspath(root) + os.sep
+  path = os.path.abspath(os.path.join(root, filename.strip('/\\')))
+  if not path.startswith(root):
+    raise HTTPError(403, "Access denied.")
+  try:
+    st = os.stat(path)
+  except OSError:
+    # past nights are served from the archive bundles
+    entry = archive.lookup(root, os.path.relpath(path, root))
+    if entry is None:
+      raise HTTPError(404, "File does not exist.")
+    return serve_archived(entry, path, request, response)
+
+  headers = {
+    'ETag' : '"' + format(st.st_mtime_ns, 'x') + "-" + format(st.st_size, 'x') + '"',
+    'Last-Modified' : email.utils.formatdate(st.st_mtime, usegmt=True),
+    'Cache-Control' : CACHE_IMMUTABLE if DATED_PLOT.match(os.path.basename(path)) else CACHE_REVALIDATE
+    }
+  content_type = mimetypes.guess_type(path)[0]
+  if compressible(content_type):
+    headers['Vary'] = "Accept-Encoding"
+
+  if request.headers.get('If-None-Match') is not None:
+    if etag_matches(request, headers['ETag']):
+      return not_modified(headers)
+  elif not modified_since(request, st.st_mtime):
+    return not_modified(headers)
+
+  if compressible(content_type) and st.st_size >= GZIP_MIN_SIZE and accepts_gzip(request):
+    for k, v in headers.items():
+      response.set_header(k, v)
+    response.content_type = content_type + ("; charset=UTF-8" if content_type.startswith("text/") else "")
+    body = gzipped_file(path, st)
+    response.set_header('Content-Encoding', 'gzip')
+    response.set_header('Content-Length', str(len(body)))
+    return body
+
+  result = static_file(filename, root=root)
+  if result.status_code == 200:
+    for k, v in headers.items():
+      result.set_header(k, v)
+  return result
+
+def serve_archived(entry, path, request, response):
+  # serve_static() of a file packed by archive.py, validators are those of the original file
+  pack, offset, size, mtime_ns = entry
+  headers = {
+    'ETag' : '"' + format(mtime_ns, 'x') + "-" + format(size, 'x') + '"',
+    'Last-Modified' : email.utils.formatdate(mtime_ns / 1e9, usegmt=True),
+    'Cache-Control' : CACHE_IMMUTABLE if DATED_PLOT.match(os.path.basename(path)) else CACHE_REVALIDATE
+    }
+  content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+  if compressible(content_type):
+    headers['Vary'] = "Accept-Encoding"
+
+  if request.headers.get('If-None-Match') is not None:
+    if etag_matches(request, headers['ETag']):
+      return not_modified(headers)
+  elif not modified_since(request, mtime_ns / 1e9):
+    return not_modified(headers)
+
+  body = archive.read(entry)
+  for k, v in headers.items():
+    response.set_header(k, v)
+  response.content_type = content_type + ("; charset=UTF-8" if content_type.startswith("text/") else "")
+  if compressible(content_type) and size >= GZIP_MIN_SIZE and accepts_gzip(request):
+    body = compress(body)
+    response.set_header('Content-Encoding', 'gzip')
+  response.set_header('Content-Length', str(len(body)))
+  return body
+
+# bottle plugin: gzip encodes str/bytes results and streamed (generator)
+# results of the routes it is applied to
+def gzip_plugin(callback):
+  from bottle import request, response
+
+  def wrapper(*args, **kwargs):
+    body = callback(*args, **kwargs)
+    if isinstance(body, str):
+      body = body.encode(response.charset)
+      if 'Content-Type' not in response.headers:
+        response.content_type = "text/html; charset=UTF-8" # bottle's default for strings
+    if isinstance(body, bytes) and response.status_code == 200 and 'Content-Encoding' not in response.headers and compressible(response.content_type):
+      return encode(request, response, body)
+    if isinstance(body, types.GeneratorType) and response.status_code == 200 and 'Content-Encoding' not in response.headers:
+      if 'Content-Type' not in response.headers:
+        response.content_type = "text/html; charset=UTF-8"
+      if compressible(response.content_type):
+        response.set_header('Vary', 'Accept-Encoding')
+        if accepts_gzip(request):
+          response.set_header('Content-Encoding', 'gzip')
+          return compress_stream(body, response.charset)
+    return body
+  return wrapper
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi live positions for all connected browsers (server-sent events)
+#
+# /now/stream pushes the current altitude/azimuth of the objects above
+# config.live['min_alt'] and the hours they stay above it every
+# config.live['interval'] seconds. The request handler hands the client's
+# socket over (dsohttpd.py, environ['dsohttpd.detach']) and is free again: one
+# thread computes and encodes each update once and writes it to all sockets
+# without blocking (selectors). A client that does not keep up keeps
+# config.live['buffer'] updates and loses the oldest ones, nobody else is
+# delayed; a closed connection is noticed when it becomes readable or a write
+# fails. The number of streams is limited (config.live['clients']). Each site
+# (sites.py) has its own broadcast, see streams().
+#
+
+import datetime
+import json
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pytz
+
+import config
+import dsoapi
+import skymath
+
+debug = False # True
+
+stats = {'updates' : 0, 'dropped' : 0, 'rejected' : 0}
+
+HEADER = (b"HTTP/1.1 200 OK\r\n"
+          b"Content-Type: text/event-stream; charset=UTF-8\r\n"
+          b"Cache-Control: no-store\r\n"
+          b"Connection: close\r\n\r\n") # the body ends with the connection
+KEEP_ALIVE = b": keep-alive\n\n" # a comment line keeps proxies and the browser from timing out
+
+class Subscriber:
+  # a client connection, written by the broadcast thread
+
+  def __init__(self, sock, buffer):
+    self.sock = sock
+    self.events = deque(maxlen=buffer)
+    self.pending = b"" # rest of the data being sent
+
+  def put(self, event):
+    if len(self.events) == self.events.maxlen:
+      stats['dropped'] += 1 # the oldest one
+    self.events.append(event)
+
+  def waiting(self):
+    return len(self.pending) > 0 or len(self.events) > 0
+
+  def send(self):
+    # writes as much as the socket takes, False if the client is gone
+    while self.waiting():
+      if len(self.pending) == 0:
+        self.pending = self.events.popleft()
+      try:
+        sent = self.sock.send(self.pending)
+      except (BlockingIOError, InterruptedError):
+        return True
+      except OSError:
+        return False
+      self.pending = self.pending[sent:]
+    return True
+
+  def closed(self):
+    # the client sent something or hung up; only the end of the connection counts
+    try:
+      return len(self.sock.recv(1024)) == 0
+    except (BlockingIOError, InterruptedError):
+      return False
+    except OSError:
+      return True
+
+class Broadcast:
+
+  def __init__(self, root, interval=10, min_alt=0, clients=4, buffer=2, site=None):
+    self.root = root
+    self.site = config.coordinates if site is None else site # profile of the site (sites.py)
+    self.interval = interval
+    self.min_alt = min_alt
+    self.clients = clients
+    self.buffer = buffer
+    self.subscribers = set()
+    self.added = [] # subscribers not yet registered by the thread
+    self.lock = threading.Lock()
+    self.thread = None # runs while there are subscribers
+    self.wakeup = None # socket pair to interrupt the thread's select()
+    self.last = None   # latest event, new subscribers start with it
+
+  def subscribe(self, detach):
+    # takes over the connection returned by detach(), False if there are too many
+    with self.lock:
+      if len(self.subscribers) >= self.clients:
+        stats['rejected'] += 1
+        return False
+      sock = detach()
+      sock.setblocking(False)
+      subscriber = Subscriber(sock, self.buffer)
+      subscriber.pending = HEADER + ("retry: " + str(int(self.interval * 1000)) + "\n\n").encode('utf-8')
+      if self.last is not None:
+        subscriber.put(self.last)
+      self.subscribers.add(subscriber)
+      self.added.append(subscriber)
+      if self.thread is None:
+        self.wakeup = socket.socketpair()
+        self.thread = threading.Thread(target=self.loop, args=(self.wakeup,), name="livestream", daemon=True)
+        self.thread.start()
+      else:
+        self.wakeup[1].send(b"\0")
+    return True
+
+  def unsubscribe(self, subscriber, selector):
+    with self.lock:
+      self.subscribers.discard(subscriber)
+    selector.unregister(subscriber.sock)
+    subscriber.sock.close()
+
+  def loop(self, wakeup):
+    selector = selectors.DefaultSelector()
+    selector.register(wakeup[0], selectors.EVENT_READ)
+    next_update = time.monotonic()
+    while True:
+      with self.lock:
+        if len(self.subscribers) == 0:
+          self.thread = None
+          self.last = None
+          self.added = []
+          break
+        added, self.added = self.added, []
+      for subscriber in added:
+        selector.register(subscriber.sock, selectors.EVENT_READ, subscriber)
+      t0 = time.monotonic()
+      if t0 >= next_update:
+        next_update = t0 + self.interval
+        try:
+          event = self.update()
+        except Exception as e:
+          print("Live positions error: " + str(e))
+          event = KEEP_ALIVE
+        else:
+          stats['updates'] += 1
+          self.last = event
+        subscribers = [key.data for key in selector.get_map().values() if key.data is not None]
+        for subscriber in subscribers:
+          subscriber.put(event)
+        if debug:
+          print("Live positions for " + str(len(subscribers)) + " clients in " + str(round((time.monotonic() - t0) * 1000, 1)) + " ms")
+      # send what the sockets take, the rest when they are writable again
+      for key in list(selector.get_map().values()):
+        subscriber = key.data
+        if subscriber is None:
+          continue
+        if not subscriber.send():
+          self.unsubscribe(subscriber, selector)
+          continue
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if subscriber.waiting() else 0)
+        if key.events != events:
+          selector.modify(subscriber.sock, events, subscriber)
+      for key, events in selector.select(max(0.0, next_update - time.monotonic())):
+        if key.data is None:
+          wakeup[0].recv(1024)
+        elif events & selectors.EVENT_READ and key.data.closed():
+          self.unsubscribe(key.data, selector)
+    selector.close()
+    for sock in wakeup:
+      sock.close()
+
+  def update(self):
+    # the encoded event of the current positions
+    when = datetime.datetime.now(pytz.timezone(self.site['timezone']))
+    cat = dsoapi.current(self.root, when)
+    dsos = []
+    if cat is not None:
+      positions = cat.positions
+      latitude, longitude = self.site['latitude'], self.site['longitude']
+      alt, az = positions.altaz(latitude, longitude, when)
+      hours = positions.hours_above(latitude, longitude, self.min_alt, when)
+      indices = [i for i in np.argsort(-alt).tolist() if alt[i] >= self.min_alt]
+      for i, direction in zip(indices, skymath.compass(az[indices])):
+        dsos.append({
+          'name' : positions.records[i]['name'],
+          'alt' : round(float(alt[i]), 2),
+          'az' : round(float(az[i]), 2),
+          'direction' : direction,
+          'hours_above' : round(float(hours[i]), 2) if np.isfinite(hours[i]) else None # None: never sets
+          })
+    data = json.dumps({
+      'time' : when.isoformat(timespec='seconds'),
+      'date' : cat.theDate if cat is not None else None,
+      'min_alt' : self.min_alt,
+      'dsos' : dsos
+      }, ensure_ascii=False, separators=(',', ':'))
+    return ("id: " + str(int(when.timestamp())) + "\nevent: positions\ndata: " + data + "\n\n").encode('utf-8')
+
+positions = Broadcast(config.paths['data'], config.live['interval'], config.live['min_alt'], config.live['clients'], config.live['buffer'])
+site_positions = {} # site -> Broadcast of the other sites
+site_lock = threading.Lock()
+
+def site_broadcast(name, root, site):
+  # the Broadcast of a site of config.sites, created on first use
+  with site_lock:
+    if name not in site_positions:
+      site_positions[name] = Broadcast(root, config.live['interval'], config.live['min_alt'], config.live['clients'], config.live['buffer'], site)
+    return site_positions[name]
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi DSO server load test
+#
+# Starts dsoserver.py on localhost against a synthetic night for today (a
+# generated dsos_<date>.json and placeholder plots of realistic size in a
+# temporary data directory), replays a request mix at each concurrency level
+# and reports p50/p95/p99 latency, throughput and the server's memory (RSS, and
+# PSS, which splits shared pages between the prefork worker processes).
+# Runs are reproducible (--seed), so serving changes can be compared before
+# they are deployed to the Pi:
+#
+#   python3 loadtest.py --scenario browse --clients 1,4,10 --duration 20
+#   python3 loadtest.py --modes threaded,wsgiref --json before.json
+#   python3 loadtest.py --modes threaded,prefork --workers 4 --scenario pages
+#
+# Scenarios (weights of the request kinds):
+#   browse   phones looking at tonight's plots: pages and the images they show
+#   pages    HTML pages only (/tonight, /best/<dir>/<alt>, /alldsos(/list))
+#   images   plots and thumbnails only
+#   api      JSON API queries
+#
+
+import optparse
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import threading
+import subprocess
+import http.client
+
+from PIL import Image
+
+import bench_render
+from bench_server import percentile
+
+DSO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+parser = optparse.OptionParser()
+parser.add_option('-s', '--scenario',
+    action="store", dest="scenario",
+    help="browse | pages | images | api", default="browse")
+parser.add_option('-c', '--clients',
+    action="store", dest="clients",
+    help="Concurrency levels, comma separated", default="1,4,10")
+parser.add_option('-d', '--duration',
+    action="store", dest="duration", type="float",
+    help="Seconds per concurrency level", default=20.0)
+parser.add_option('-w', '--warmup',
+    action="store", dest="warmup", type="float",
+    help="Seconds of unmeasured requests before each level", default=3.0)
+parser.add_option('-n', '--objects',
+    action="store", dest="objects", type="int",
+    help="Objects in the synthetic catalogue", default=280)
+parser.add_option('-k', '--png-kb',
+    action="store", dest="png_kb", type="int",
+    help="Size of the placeholder plots in KB", default=48)
+parser.add_option('-m', '--modes',
+    action="store", dest="modes",
+    help="Server modes to compare, comma separated (config.server['mode'])", default="threaded")
+parser.add_option('-t', '--threads',
+    action="store", dest="threads", type="int",
+    help="Worker threads of the threaded server (per process)", default=8)
+parser.add_option('-W', '--workers',
+    action="store", dest="workers", type="int",
+    help="Processes of the prefork server", default=4)
+parser.add_option('-p', '--port',
+    action="store", dest="port", type="int",
+    help="Port of the test server", default=44445)
+parser.add_option('-r', '--seed',
+    action="store", dest="seed", type="int",
+    help="Random seed of the request mix", default=1)
+parser.add_option('-j', '--json',
+    action="store", dest="json",
+    help="Write the results to this file", default=None)
+parser.add_option('-K', '--keep',
+    action="store_true", dest="keep",
+    help="Keep the synthetic data directory", default=False)
+
+SCENARIOS = {
+  'browse' : [(1, 'tonight'), (2, 'best'), (1, 'list'), (1, 'gallery'), (10, 'thumb'), (3, 'image')],
+  'pages' : [(1, 'tonight'), (2, 'best'), (1, 'list'), (1, 'gallery')],
+  'images' : [(3, 'thumb'), (1, 'image')],
+  'api' : [(3, 'api'), (1, 'api_object')]
+  }
+
+DIRECTIONS = ["N", "E", "S", "W"]
+ALTITUDES = ["0.0", "10.0", "20.0", "30.0"]
+
+def request_path(kind, rnd, names, theDate):
+  if kind == 'tonight':
+    return "/tonight"
+  if kind == 'best':
+    return "/best/" + rnd.choice(DIRECTIONS) + "/" + rnd.choice(ALTITUDES)
+  if kind == 'list':
+    return "/alldsos/list"
+  if kind == 'gallery':
+    return "/alldsos"
+  if kind == 'thumb':
+    return "/img/thumbs/DSO_" + rnd.choice(names) + "_" + theDate + ".png"
+  if kind == 'image':
+    return "/static/DSO_" + rnd.choice(names) + "_" + theDate + ".png"
+  if kind == 'api':
+    return "/api/" + theDate + "/dsos?direction=" + rnd.choice(DIRECTIONS) + "&min_alt=" + rnd.choice(ALTITUDES) + "&sort=-score&limit=20"
+  if kind == 'api_object':
+    return "/api/" + theDate + "/dsos/" + rnd.choice(names)
+  raise ValueError("Unknown request kind " + str(kind))
+
+def placeholder_png(kb):
+  # 640x480 like the plots, a noise band makes it compress to about kb KB
+  image = Image.new("RGB", (640, 480), "white")
+  rows = max(1, min(480, int(kb * 1024 / (3 * 640))))
+  image.paste(Image.frombytes("RGB", (640, rows), os.urandom(640 * rows * 3)), (0, 0))
+  buffer = io.BytesIO()
+  image.save(buffer, format="PNG")
+  return buffer.getvalue()
+
+def make_night(data, theDate, objects, png_kb):
+  DSOs = bench_render.make_DSOs(objects, theDate)
+  with open(os.path.join(data, "dsos_" + theDate + ".json"), 'w', encoding='utf-8') as f:
+    json.dump(DSOs, f)
+  png = placeholder_png(png_kb)
+  for name in DSOs:
+    with open(os.path.join(data, "DSO_" + name + "_" + theDate + ".png"), 'wb') as f:
+      f.write(png)
+  shutil.copy(os.path.join(DSO_DIR, "dsochart.js"), data)
+  return [name for name, dso in DSOs.items() if dso['max_alt'] > 0]
+
+def reset_night(data):
+  # every server mode starts with the same cold night: no thumbnails or pages yet
+  for variant in ("thumbs", "full"):
+    shutil.rmtree(os.path.join(data, variant), ignore_errors=True)
+  for name in os.listdir(data):
+    if name.startswith("FRAMESET_"):
+      os.remove(os.path.join(data, name))
+
+def start_server(data, port, mode, threads, workers=4):
+  # dsoserver.py with the configuration pointed at the synthetic night
+  reset_night(data)
+  code = ("import sys; sys.path.insert(0, " + repr(DSO_DIR) + "); import config; "
+          "config.paths['data'] = " + repr(data) + "; config.paths['ephemeris'] = " + repr(os.path.join(data, "de421.bsp")) + "; "
+          "config.server.update(host='127.0.0.1', port=" + str(port) + ", mode=" + repr(mode) + ", threads=" + str(threads) + ", workers=" + str(workers) + "); "
+          "config.scheduler['nights'] = 0; "
+          "import runpy; runpy.run_path(" + repr(os.path.join(DSO_DIR, "dsoserver.py")) + ", run_name='__main__')")
+  log = open(os.path.join(data, "dsoserver_" + mode + ".log"), 'w')
+  proc = subprocess.Popen([sys.executable, "-c", code], cwd=data, stdout=log, stderr=subprocess.STDOUT)
+  t0 = time.perf_counter()
+  while time.perf_counter() - t0 < 60:
+    if proc.poll() is not None:
+      raise Exception("dsoserver exited, see " + log.name)
+    try:
+      conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+      conn.request("GET", "/health")
+      conn.getresponse().read()
+      conn.close()
+      return proc, time.perf_counter() - t0
+    except OSError:
+      time.sleep(0.05)
+  proc.kill()
+  raise Exception("dsoserver did not answer within 60 s")
+
+def processes(pid):
+  # the server and its prefork workers
+  pids = [pid]
+  for p in pids:
+    try:
+      for task in os.listdir("/proc/" + str(p) + "/task"):
+        with open("/proc/" + str(p) + "/task/" + task + "/children") as f:
+          pids.extend(int(c) for c in f.read().split())
+    except OSError:
+      pass
+  return pids
+
+def memory(pid):
+  # VmRSS, VmHWM (peak RSS) and Pss of the server and its workers in KB; RSS
+  # counts shared pages in every process, PSS splits them between them
+  values = {'VmRSS' : 0, 'VmHWM' : 0, 'Pss' : 0}
+  for p in processes(pid):
+    try:
+      with open("/proc/" + str(p) + "/status") as f:
+        for line in f:
+          if line.startswith(("VmRSS:", "VmHWM:")):
+            values[line.split(":")[0]] += int(line.split()[1])
+      with open("/proc/" + str(p) + "/smaps_rollup") as f:
+        for line in f:
+          if line.startswith("Pss:"):
+            values['Pss'] += int(line.split()[1])
+    except OSError: # exited meanwhile
+      pass
+  return values
+
+def client(port, scenario, names, theDate, seed, deadline, results, lock):
+  rnd = random.Random(seed)
+  kinds = [kind for weight, kind in SCENARIOS[scenario] for i in range(weight)]
+  conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+  while time.perf_counter() < deadline:
+    kind = rnd.choice(kinds)
+    path = request_path(kind, rnd, names, theDate)
+    t0 = time.perf_counter()
+    size = 0
+    for attempt in range(2):
+      error = None
+      try:
+        conn.request("GET", path, headers={'Accept-Encoding' : "gzip"})
+        resp = conn.getresponse()
+        size = len(resp.read())
+        if resp.status != 200:
+          error = str(resp.status) + " " + path
+        break
+      except (http.client.RemoteDisconnected, ConnectionError) as e:
+        # idle keep-alive connection closed by the server, a browser retries once
+        conn.close()
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        error = str(e)
+      except Exception as e:
+        conn.close()
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        error = str(e)
+        break
+    seconds = time.perf_counter() - t0
+    with lock:
+      r = results.setdefault(kind, {'latencies' : [], 'errors' : 0, 'bytes' : 0})
+      if error is None:
+        r['latencies'].append(seconds)
+        r['bytes'] += size
+      else:
+        r['errors'] += 1
+        results.setdefault('_errors', []).append(error)
+  conn.close()
+
+def run_level(pid, port, scenario, names, theDate, clients, duration, seed):
+  results = {}
+  lock = threading.Lock()
+  deadline = time.perf_counter() + duration
+  threads = [threading.Thread(target=client, args=(port, scenario, names, theDate, seed * 1000 + i, deadline, results, lock)) for i in range(clients)]
+  samples = [memory(pid)]
+  t0 = time.perf_counter()
+  for t in threads:
+    t.start()
+  while any(t.is_alive() for t in threads):
+    time.sleep(0.5)
+    samples.append(memory(pid))
+  for t in threads:
+    t.join()
+  elapsed = time.perf_counter() - t0
+  errors = results.pop('_errors', [])
+  return results, errors, elapsed, max(m['VmRSS'] for m in samples), max(m['Pss'] for m in samples)
+
+def report(mode, clients, results, errors, elapsed, rss, hwm, pss):
+  total = sum(len(r['latencies']) for r in results.values())
+  size = sum(r['bytes'] for r in results.values())
+  summary = {'mode' : mode, 'clients' : clients, 'seconds' : round(elapsed, 2), 'requests' : total,
+             'requests_per_second' : round(total / elapsed, 1), 'mb_per_second' : round(size / elapsed / 1e6, 2),
+             'rss_max_kb' : rss, 'rss_peak_kb' : hwm, 'pss_max_kb' : pss, 'errors' : len(errors), 'kinds' : {}}
+  print("")
+  print(mode + ", " + str(clients) + " clients, " + str(round(elapsed, 1)) + " s: " + str(summary['requests_per_second']) + " req/s, " +
+        str(summary['mb_per_second']) + " MB/s, RSS max " + str(rss // 1024) + " MB (peak " + str(hwm // 1024) + " MB), PSS max " + str(pss // 1024) + " MB")
+  print("%-10s %7s %6s %9s %9s %9s %9s" % ("kind", "n", "errors", "p50 ms", "p95 ms", "p99 ms", "req/s"))
+  for kind in sorted(results):
+    values = results[kind]['latencies']
+    k = {'n' : len(values), 'errors' : results[kind]['errors'],
+         'p50_ms' : round(1000 * percentile(values, 50), 1), 'p95_ms' : round(1000 * percentile(values, 95), 1),
+         'p99_ms' : round(1000 * percentile(values, 99), 1), 'requests_per_second' : round(len(values) / elapsed, 1)}
+    summary['kinds'][kind] = k
+    print("%-10s %7d %6d %9.1f %9.1f %9.1f %9.1f" % (kind, k['n'], k['errors'], k['p50_ms'], k['p95_ms'], k['p99_ms'], k['requests_per_second']))
+  if len(errors) > 0:
+    print(str(len(errors)) + " errors, e.g. " + errors[0])
+  return summary
+
+if __name__ == '__main__':
+  options, args = parser.parse_args()
+  if options.scenario not in SCENARIOS:
+    parser.error("unknown scenario " + str(options.scenario))
+
+  theDate = time.strftime("%d.%m.%Y") # /tonight and /best are today's pages
+  data = tempfile.mkdtemp(prefix="dsoload_")
+  names = make_night(data, theDate, options.objects, options.png_kb)
+  print("Synthetic night " + theDate + ": " + str(options.objects) + " objects, " + str(options.png_kb) + " KB plots in " + data)
+
+  summaries = []
+  try:
+    for mode in options.modes.split(","):
+      proc, startup = start_server(data, options.port, mode, options.threads, options.workers)
+      print("")
+      m = memory(proc.pid)
+      print("dsoserver (" + mode + ") answered after " + str(round(startup, 2)) + " s, " + str(len(processes(proc.pid))) + " processes, RSS " + str(m['VmRSS'] // 1024) + " MB, PSS " + str(m['Pss'] // 1024) + " MB")
+      try:
+        for clients in [int(c) for c in options.clients.split(",")]:
+          if options.warmup > 0:
+            run_level(proc.pid, options.port, options.scenario, names, theDate, clients, options.warmup, options.seed + 1)
+          results, errors, elapsed, rss, pss = run_level(proc.pid, options.port, options.scenario, names, theDate, clients, options.duration, options.seed)
+          summary = report(mode, clients, results, errors, elapsed, rss, memory(proc.pid)['VmHWM'], pss)
+          summary['startup_seconds'] = round(startup, 2)
+          summaries.append(summary)
+      finally:
+        proc.terminate()
+        proc.wait()
+  finally:
+    if options.keep:
+      print("Data kept in " + data)
+    else:
+      shutil.rmtree(data, ignore_errors=True)
+
+  if options.json:
+    with open(options.json, 'w') as f:
+      json.dump({'scenario' : options.scenario, 'objects' : options.objects, 'png_kb' : options.png_kb, 'seed' : options.seed, 'results' : summaries}, f, indent=1)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi DSO server metrics in the Prometheus text exposition format (/metrics)
+#
+# Requests are measured by a WSGI middleware around the bottle app: latency
+# until the response body is sent, status and bytes per route rule. That is a
+# few additions under one lock per request. Cache statistics are the counters
+# the modules keep themselves (catalogue.stats, httpcache.stats, ...), read by
+# collectors only when /metrics is scraped.
+#
+# The prefork workers (dsohttpd.py) count for themselves. Each worker labels
+# its series worker="<number>" and publishes them every PUBLISH seconds in
+# <data>/metrics/worker<number>.prom (share()); the worker answering the scrape
+# returns its own series and those of the others, so every series always comes
+# from the same worker.
+#
+
+import bisect
+import glob
+import os
+import threading
+import time
+
+lock = threading.Lock()
+registry = []   # Counter/Histogram objects
+collectors = [] # functions returning exposition lines
+
+# seconds, from a cached API hit to a plot rendered on first request
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+JOB_BUCKETS = (10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1200.0, 1800.0, 3600.0, 7200.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PUBLISH = 5 # seconds between the published series of a prefork worker
+STALE = 60  # seconds after which the series of a worker that is gone are dropped
+
+worker = None # number of the prefork worker, see share()
+shared_dir = None
+
+def escape(value):
+  return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def labelstr(labels):
+  # labels: tuple of (name, value) pairs
+  if not labels:
+    return ""
+  return "{" + ",".join(k + '="' + escape(v) + '"' for k, v in labels) + "}"
+
+def number(value):
+  if isinstance(value, float):
+    return repr(value) if value != float('inf') else "+Inf"
+  return str(value)
+
+class Counter:
+
+  def __init__(self, name, help):
+    self.name = name
+    self.help = help
+    self.series = {} # labels -> value
+    registry.append(self)
+
+  def inc(self, labels=(), value=1):
+    with lock:
+      self.series[labels] = self.series.get(labels, 0) + value
+
+  def lines(self):
+    with lock:
+      series = sorted(self.series.items())
+    yield "# HELP " + self.name + " " + self.help
+    yield "# TYPE " + self.name + " counter"
+    for labels, value in series:
+      yield self.name + labelstr(labels) + " " + number(value)
+
+class Histogram:
+
+  def __init__(self, name, help, buckets=BUCKETS):
+    self.name = name
+    self.help = help
+    self.buckets = buckets
+    self.series = {} # labels -> [count per bucket ..., count above, sum]
+    registry.append(self)
+
+  def observe(self, labels, value):
+    i = bisect.bisect_left(self.buckets, value)
+    with lock:
+      s = self.series.get(labels)
+      if s is None:
+        s = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+      s[i] += 1
+      s[-1] += value
+
+  def lines(self):
+    with lock:
+      series = sorted((labels, list(s)) for labels, s in self.series.items())
+    yield "# HELP " + self.name + " " + self.help
+    yield "# TYPE " + self.name + " histogram"
+    for labels, s in series:
+      cumulative = 0
+      for le, n in zip(self.buckets + (float('inf'),), s[:-1]):
+        cumulative += n
+        yield self.name + "_bucket" + labelstr(labels + (('le', number(float(le))),)) + " " + str(cumulative)
+      yield self.name + "_sum" + labelstr(labels) + " " + repr(s[-1])
+      yield self.name + "_count" + labelstr(labels) + " " + str(cumulative)
+
+REQUEST_SECONDS = Histogram("dso_http_request_duration_seconds", "Time until the response is sent, per route.")
+REQUESTS = Counter("dso_http_requests_total", "Responses per route and status.")
+RESPONSE_BYTES = Counter("dso_http_response_bytes_total", "Response body bytes sent per route.")
+EPHEMERIS_SECONDS = Histogram("dso_ephemeris_computation_seconds", "Sun, Moon and night time calculations.")
+JOB_SECONDS = Histogram("dso_job_duration_seconds", "Catalogue job run time.", JOB_BUCKETS)
+
+def stats_lines(name, help, stats, label, kind="counter"):
+  # a module's stats dict, e.g. catalogue.stats, as one metric with a label per key
+  yield "# HELP " + name + " " + help
+  yield "# TYPE " + name + " " + kind
+  for key, value in sorted(stats.items()):
+    if value is not None:
+      yield name + labelstr(((label, key),)) + " " + number(value)
+
+def register(collector):
+  collectors.append(collector)
+  return collector
+
+def own_lines():
+  lines = []
+  for metric in registry:
+    lines.extend(metric.lines())
+  for collector in collectors:
+    try:
+      lines.extend(collector())
+    except Exception as e:
+      print("Metrics collector error: " + str(e))
+  if worker is None:
+    return lines
+  # the series of a prefork worker
+  label = 'worker="' + str(worker) + '"'
+  for n, line in enumerate(lines):
+    if line.startswith("#"):
+      continue
+    series, value = line.rsplit(" ", 1)
+    series = series[:-1] + "," + label + "}" if series.endswith("}") else series + "{" + label + "}"
+    lines[n] = series + " " + value
+  return lines
+
+def merge(texts):
+  # exposition texts of several workers, the samples of a metric under one HELP/TYPE
+  families = {} # name -> [HELP/TYPE lines, samples]
+  for text in texts:
+    name = None
+    for line in text.split("\n"):
+      if line.startswith("# HELP ") or line.startswith("# TYPE "):
+        name = line.split(" ")[2]
+        family = families.setdefault(name, [[], []])
+        if line not in family[0]:
+          family[0].append(line)
+      elif len(line) > 0 and name is not None:
+        families[name][1].append(line)
+  lines = []
+  for header, samples in families.values():
+    lines.extend(header)
+    lines.extend(samples)
+  return lines
+
+def worker_file(number):
+  return os.path.join(shared_dir, "worker" + str(number) + ".prom")
+
+def publish(text=None):
+  text = "\n".join(own_lines()) + "\n" if text is None else text
+  tmp = worker_file(worker) + "." + str(os.getpid()) + ".tmp"
+  with open(tmp, 'w', encoding='utf-8') as f:
+    f.write(text)
+  os.replace(tmp, worker_file(worker))
+
+def share(directory, number):
+  # called in prefork worker number: label and publish its series
+  global worker, shared_dir
+  worker = number
+  shared_dir = directory
+  os.makedirs(directory, exist_ok=True)
+  def loop():
+    while True:
+      try:
+        publish()
+      except Exception as e:
+        print("Metrics publish error: " + str(e))
+      time.sleep(PUBLISH)
+  threading.Thread(target=loop, name="metrics", daemon=True).start()
+
+def render():
+  own = "\n".join(own_lines()) + "\n"
+  if worker is None:
+    return own
+  publish(own)
+  texts = [own]
+  for filename in sorted(glob.glob(os.path.join(shared_dir, "worker*.prom"))):
+    if filename == worker_file(worker):
+      continue
+    try:
+      if time.time() - os.stat(filename).st_mtime > STALE:
+        continue
+      with open(filename, 'r', encoding='utf-8') as f:
+        texts.append(f.read())
+    except OSError:
+      pass
+  return "\n".join(merge(texts)) + "\n"
+
+def timed(histogram, name):
+  # decorator: run time of the function as histogram{function=name}
+  labels = (('function', name),)
+  def decorator(fn):
+    def wrapper(*args, **kwargs):
+      t0 = time.perf_counter()
+      try:
+        return fn(*args, **kwargs)
+      finally:
+        histogram.observe(labels, time.perf_counter() - t0)
+    wrapper.__name__ = fn.__name__
+    wrapper.__doc__ = fn.__doc__
+    return wrapper
+  return decorator
+
+class MeasuredBody:
+  # response body of the middleware, the request is done when the server closes it
+
+  def __init__(self, body, environ, status, t0):
+    self.body = body
+    self.environ = environ
+    self.status = status
+    self.t0 = t0
+    self.size = 0
+
+  def __iter__(self):
+    for chunk in self.body:
+      self.size += len(chunk)
+      yield chunk
+
+  def close(self):
+    try:
+      if hasattr(self.body, 'close'):
+        self.body.close()
+    finally:
+      seconds = time.perf_counter() - self.t0
+      route = self.environ.get('bottle.route')
+      rule = route.rule if route is not None else "unmatched"
+      REQUEST_SECONDS.observe((('route', rule), ('method', self.environ.get('REQUEST_METHOD', "GET"))), seconds)
+      REQUESTS.inc((('route', rule), ('status', self.status[0])))
+      RESPONSE_BYTES.inc((('route', rule),), self.size)
+
+def middleware(app):
+  # WSGI app measuring every request of app
+  def measured(environ, start_response):
+    t0 = time.perf_counter()
+    status = [None]
+    def measured_start_response(s, headers, exc_info=None):
+      status[0] = s[:3]
+      return start_response(s, headers, exc_info)
+    return MeasuredBody(app(environ, measured_start_response), environ, status, t0)
+  return measured
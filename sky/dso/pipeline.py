@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi catalogue of a night with bounded memory
+#
+# The object names flow through
+#
+#   resolve  coordinates and type of each object (Simbad, by the planner; the
+#            sidereal reference for known objects)
+#   track    alt/az of a chunk of objects on the time grid of the night, looked
+#            up in the sidereal reference (sidereal.py) for known objects
+#   stats    max. altitudes in the night and overall, directions
+#   score    scoring.features()/sectors() of the chunk
+#   write    one JSON member per object appended to the catalogue file
+#
+# config.pipeline['chunk'] objects at a time. The grid, Sun and Moon of the
+# night (Night) are computed once for all objects; the objects' tracks are a
+# matrix product (skymath.py) instead of astropy frames per object. An object
+# is kept as a compact Record (__slots__) until it is written, the tracks for
+# tracks_<date>.bin as int16 centidegrees (~1 kB per object). The RSS is
+# checked after each chunk: above config.pipeline['max_rss_mb'] the next chunks
+# are halved. This is a soft limit, not a ceiling: a chunk can overshoot it
+# before it is measured, and the run continues with single objects when even
+# they stay above it (reported once). The peak RSS of the run is in
+# stats['peak_rss_mb'].
+#
+
+import gc
+import os
+import json
+
+import numpy as np
+
+import config
+import scoring
+import sidereal
+import skymath
+import tracks
+
+debug = False # True
+
+# azimuth bins of DSO.get_compass_direction()
+COMPASS_EDGES = (0, 15, 30, 60, 75, 105, 135, 150, 165, 195, 225, 240, 255, 285, 300, 330, 345)
+COMPASS_NAMES = ("N", "NNE", "NE", "ENE", "E", "ESE", "SE", "SSE", "S", "SSW", "SW", "WSW", "W", "WNW", "NW", "NWN", "N")
+DIRECTION_FIELDS = ('direction_20', 'direction_22', 'direction_0', 'direction_2', 'direction_4', 'direction_6')
+
+stats = {'objects' : 0, 'failed' : 0, 'chunks' : 0, 'peak_rss_mb' : 0}
+
+def directions(az):
+  # compass names of the azimuths (degrees) as DSO.get_compass_direction()
+  i = np.searchsorted(COMPASS_EDGES, np.mod(np.asarray(az, dtype=np.float64), 360.0), side='right') - 1
+  return [COMPASS_NAMES[k] for k in np.ravel(i)]
+
+def memory_mb():
+  # (current, peak) resident set size of the process in MB
+  values = {'VmRSS:' : 0, 'VmHWM:' : 0}
+  try:
+    with open("/proc/self/status", 'r') as f:
+      for line in f:
+        if line.startswith(tuple(values)):
+          values[line.split()[0]] = int(line.split()[1]) // 1024
+  except OSError:
+    import resource
+    values['VmHWM:'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+  return values['VmRSS:'], values['VmHWM:']
+
+class Night:
+  # time grid of the night shared by all objects
+
+  def __init__(self, theDate, hours, jd, times, night, sun_alt, moon_alt, moon_az, direction_jds, latitude, longitude):
+    self.theDate = theDate
+    self.hours = np.asarray(hours, dtype=np.float64)    # [samples] from midnight
+    self.jd = np.asarray(jd, dtype=np.float64)          # [samples] UT
+    self.times = times                                  # [samples] datetimes stored as max_alt_time
+    self.night = np.asarray(night, dtype=bool)          # [samples] in the nautical night
+    self.sun_alt = np.asarray(sun_alt, dtype=np.float64)
+    self.moon_alt = np.asarray(moon_alt, dtype=np.float64)
+    self.moon_az = np.asarray(moon_az, dtype=np.float64)
+    self.direction_jds = np.asarray(direction_jds, dtype=np.float64) # 20, 22, 0, 2, 4, 6 h
+    self.latitude = float(latitude)
+    self.longitude = float(longitude)
+    self.lst = skymath.sidereal_time(self.jd, self.longitude)
+    self.direction_lst = skymath.sidereal_time(self.direction_jds, self.longitude)
+    # precession changes within a night by far less than the accuracy
+    self.precession = skymath.precession(float(self.jd[len(self.jd) // 2]))
+
+class Record:
+  # catalogue entry of an object, the fields in the order of the JSON file
+  FIELDS = ('date', 'max_alt', 'max_alt_direction', 'max_alt_time', 'max_alt_during_night', 'max_alt_during_night_direction',
+            'max_alt_during_night_obstime') + DIRECTION_FIELDS + ('object_type', 'object_type_string', 'visible', 'ra', 'dec',
+            'score', 'hours_above', 'transit_dark', 'moon_sep', 'airmass', 'sectors', 'main_directions')
+  __slots__ = ('name',) + FIELDS
+
+  def __init__(self, name, **fields):
+    self.name = name
+    for field in self.FIELDS:
+      setattr(self, field, fields.get(field))
+
+  def as_dict(self):
+    return {field : getattr(self, field) for field in self.FIELDS}
+
+class Writer:
+  # the catalogue file {name: record, ...} written member by member, in place
+  # only when complete
+
+  def __init__(self, filename, default=None):
+    self.filename = filename
+    self.default = default
+    self.tmp = filename + "." + str(os.getpid()) + ".tmp" # per process, see dsojobs.py
+    self.f = open(self.tmp, 'w', encoding='utf-8')
+    self.f.write("{")
+    self.count = 0
+
+  def write(self, record):
+    if self.count > 0:
+      self.f.write(", ")
+    self.f.write(json.dumps(record.name, ensure_ascii=False) + ": " + json.dumps(record.as_dict(), ensure_ascii=False, default=self.default))
+    self.count += 1
+
+  def close(self):
+    self.f.write("}")
+    self.f.close()
+    os.replace(self.tmp, self.filename)
+
+  def abort(self):
+    self.f.close()
+    os.remove(self.tmp)
+
+def track(night, ra, dec, jd_lst):
+  # alt, az [objects][samples] in degrees at the sidereal times jd_lst
+  vectors = skymath.unit_vectors(ra, dec) @ night.precession.T
+  up, north, east = skymath.horizontal(vectors[:, None, :], jd_lst[None, :], night.latitude)
+  return np.degrees(np.arcsin(np.clip(up, -1.0, 1.0))), np.degrees(np.arctan2(east, north)) % 360.0
+
+def tracks_of(night, rows, reference=None):
+  # alt, az [objects][samples] on the grid and az [objects][6] at the direction
+  # times; from the sidereal reference for the objects it knows
+  ra = np.array([r[1] for r in rows], dtype=np.float64)
+  dec = np.array([r[2] for r in rows], dtype=np.float64)
+  alts, azs = np.empty((len(rows), len(night.lst))), np.empty((len(rows), len(night.lst)))
+  dir_az = np.empty((len(rows), len(night.direction_lst)))
+  known = np.array([reference is not None and r[0] in reference.index for r in rows], dtype=bool)
+  if known.any():
+    indices = [reference.index[r[0]] for r, k in zip(rows, known) if k]
+    alts[known], azs[known] = reference.track(indices, night.lst)
+    dir_az[known] = reference.track(indices, night.direction_lst)[1]
+  if not known.all():
+    alts[~known], azs[~known] = track(night, ra[~known], dec[~known], night.lst)
+    dir_az[~known] = track(night, ra[~known], dec[~known], night.direction_lst)[1]
+  return alts, azs, dir_az
+
+def chunk_records(night, rows, reference=None):
+  # Records of rows [(name, ra, dec, object_type, object_type_string)] and their
+  # int16 tracks [objects][samples / tracks.STEP] (alt, az)
+  alts, azs, dir_az = tracks_of(night, rows, reference)
+  records = records_of(night, rows, alts, azs, dir_az)
+  step = slice(None, None, tracks.STEP)
+  return records, (tracks.centideg(alts[:, step], '<i2'), tracks.centideg(azs[:, step], '<u2'))
+
+def records_of(night, rows, alts, azs, dir_az):
+  # stats and score of rows from their tracks alts, azs [objects][samples] and the
+  # azimuths dir_az [objects][6] at the direction times (also used by accuracy.py
+  # with the astropy tracks)
+
+  # stats: highest point in the nautical night and overall
+  if night.night.any():
+    dark_alts = np.where(night.night, alts, -np.inf)
+    best_night = np.argmax(dark_alts, axis=1)
+  else:
+    best_night = None
+  best_total = np.argmax(alts, axis=1)
+
+  # score on the samples of the tracks file
+  step = slice(None, None, tracks.STEP)
+  f = scoring.features(night.hours[step], night.sun_alt[step], alts[:, step], azs[:, step], night.moon_alt[step], night.moon_az[step])
+  scores = scoring.scores(f)
+  sectors = scoring.sectors(night.hours[step], night.sun_alt[step], alts[:, step], azs[:, step])
+  step_times = night.times[step]
+
+  records = []
+  for i, (name, ra, dec, object_type, object_type_string) in enumerate(rows):
+    fields = dict(date=night.theDate, object_type=object_type, object_type_string=object_type_string,
+                  ra=round(float(ra), 5), dec=round(float(dec), 5))
+    if best_night is not None:
+      b = best_night[i]
+      fields.update(max_alt=float(alts[i, b]), max_alt_direction=directions(azs[i, b])[0], max_alt_time=night.times[b],
+                    max_alt_during_night=float(alts[i, best_total[i]]), max_alt_during_night_direction=directions(azs[i, best_total[i]])[0],
+                    max_alt_during_night_obstime=night.times[best_total[i]])
+    else:
+      fields.update(max_alt=-1, max_alt_direction=-1, max_alt_time=-1, max_alt_during_night=-1, max_alt_during_night_direction=-1,
+                    max_alt_during_night_obstime=-1)
+    fields.update(zip(DIRECTION_FIELDS, directions(dir_az[i])))
+    fields.update(scoring.fields(f, i))
+    fields.update(score=float(scores[i]), visible=bool(f['visible'][i]), sectors=sectors[i].tolist(),
+                  main_directions=scoring.main_directions(sectors[i]))
+    if f['hours_above'][i] > 0:
+      # the best time above the local horizon
+      b = f['best'][i]
+      fields.update(max_alt=float(f['max_dark_alt'][i]), max_alt_time=step_times[b], max_alt_direction=directions(azs[i, step][b])[0])
+    records.append(Record(name, **fields))
+  return records
+
+def run(night, names, resolve, catalogue_file, tracks_file, default=None, chunk=None, max_rss_mb=None, progress=False, reference_file=None):
+  # streams the catalogue of names into catalogue_file (and tracks_file);
+  # resolve(name) -> (ra, dec, object_type, object_type_string) in degrees.
+  # With reference_file known objects are neither resolved nor tracked anew
+  # and the reference is rebuilt when outdated or objects were added.
+  chunk = config.pipeline['chunk'] if chunk is None else chunk
+  max_rss_mb = config.pipeline['max_rss_mb'] if max_rss_mb is None else max_rss_mb
+  reference = sidereal.load(reference_file) if reference_file else None
+  epoch = float(night.jd[len(night.jd) // 2])
+  fresh = reference is not None and reference.fresh(night.latitude, epoch)
+  writer = Writer(catalogue_file, default)
+  track_names, track_alts, track_azs = [], [], []
+  rows = []
+  resolved = [] # rows of all objects for the next reference
+  done = 0
+  warned = False
+  try:
+    for n, name in enumerate(names):
+      if progress:
+        print("Progress: " + str(n) + "/" + str(len(names)) + " " + str(name), flush=True)
+      if reference is not None and name in reference.index:
+        rows.append(reference.rows[reference.index[name]])
+        sidereal.stats['hits'] += 1
+      else:
+        try:
+          rows.append((name,) + tuple(resolve(name)))
+          if reference_file:
+            sidereal.stats['misses'] += 1
+        except Exception as e:
+          stats['failed'] += 1
+          print("DSO resolve error " + str(name) + ": " + str(e))
+      if len(rows) >= chunk or (n == len(names) - 1 and len(rows) > 0):
+        records, (alts, azs) = chunk_records(night, rows, reference if fresh else None)
+        for record in records:
+          writer.write(record)
+        track_names.extend(r.name for r in records)
+        track_alts.append(alts)
+        track_azs.append(azs)
+        done += len(records)
+        stats['objects'] += len(records)
+        stats['chunks'] += 1
+        if reference_file:
+          resolved.extend(rows)
+        rows = []
+        del records
+        gc.collect()
+        rss, peak = memory_mb()
+        stats['peak_rss_mb'] = max(stats['peak_rss_mb'], peak)
+        if max_rss_mb and rss > max_rss_mb and chunk > 1:
+          chunk //= 2
+          print("RSS " + str(rss) + " MB above " + str(max_rss_mb) + " MB, chunks of " + str(chunk) + " objects")
+        elif max_rss_mb and rss > max_rss_mb and not warned:
+          warned = True
+          print("RSS " + str(rss) + " MB still above the soft limit of " + str(max_rss_mb) + " MB with single objects, continuing")
+        if debug:
+          print("Chunk done: " + str(done) + " objects, RSS " + str(rss) + " MB")
+    writer.close()
+  except BaseException:
+    writer.abort()
+    raise
+  if progress:
+    print("Progress: " + str(len(names)) + "/" + str(len(names)), flush=True)
+  if len(track_names) > 0:
+    step = slice(None, None, tracks.STEP)
+    tracks.write(tracks_file, night.hours[step], night.sun_alt[step], night.moon_alt[step], track_names,
+                 np.concatenate(track_alts) / 100.0, np.concatenate(track_azs) / 100.0)
+  del track_alts, track_azs
+  if len(resolved) > 0 and (not fresh or any(r[0] not in reference.index for r in resolved)):
+    # in chunks as the catalogue, the old reference stays mapped until it is replaced
+    sidereal.build(reference_file, resolved, night.latitude, epoch, chunk)
+    print("Sidereal reference " + str(len(resolved)) + " objects, epoch " + str(round(epoch, 1)))
+  rss, peak = memory_mb()
+  stats['peak_rss_mb'] = max(stats['peak_rss_mb'], peak)
+  print("Catalogue " + str(done) + " objects, peak RSS " + str(stats['peak_rss_mb']) + " MB (soft limit " + str(max_rss_mb) + " MB)")
+  return done
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi precalculation of the upcoming nights
+#
+# Keeps the catalogues of a rolling window of nights (today and the next
+# config.scheduler['nights'] - 1) ready, so date links are served at once.
+# Missing nights are calculated one at a time as background jobs (dsojobs.py,
+# low CPU priority) once the server has not seen a request for
+# config.scheduler['idle'] seconds. As soon as requests come in again the job
+# is paused (SIGSTOP) and resumed when the server is idle again or when a
+# requested job is waiting behind it.
+#
+# In the pre-fork server mode the scheduler runs in the first worker; the time
+# of the last request is kept in memory shared by all workers (share()).
+#
+
+import datetime
+import mmap
+import os
+import struct
+import threading
+import time
+
+import config
+import catalogue
+import dsojobs
+
+debug = False # True
+
+CHECK = 10          # seconds between checks of the window while nothing runs
+RETRY_FAILED = 3600 # seconds before a failed night is tried again
+SHARED = struct.Struct("d")
+
+class Scheduler:
+
+  def __init__(self, root, queue, nights=7, idle=60, plot=False):
+    self.root = root
+    self.queue = queue
+    self.nights = nights
+    self.idle_seconds = idle
+    self.plot = plot
+    self.last_request = time.monotonic() # the server just started, let it settle
+    self.shared = None # last_request of all processes, see share()
+    self.job = None
+    self.failed = {} # date -> time of the failed job
+    self.thread = None
+
+  def share(self):
+    # called before forking: requests of all processes count (monotonic time is system wide)
+    self.shared = mmap.mmap(-1, SHARED.size)
+    self.touch()
+
+  def touch(self):
+    # a request came in
+    self.last_request = time.monotonic()
+    if self.shared is not None:
+      SHARED.pack_into(self.shared, 0, self.last_request)
+
+  def last(self):
+    if self.shared is not None:
+      return SHARED.unpack_from(self.shared, 0)[0]
+    return self.last_request
+
+  def idle(self):
+    return time.monotonic() - self.last() >= self.idle_seconds
+
+  def window(self):
+    today = datetime.date.today()
+    return [(today + datetime.timedelta(days=i)).strftime("%d.%m.%Y") for i in range(self.nights)]
+
+  def ready(self, theDate):
+    return os.path.isfile(catalogue.catalogue_file(self.root, theDate))
+
+  def start(self):
+    if self.nights > 0 and self.thread is None:
+      self.thread = threading.Thread(target=self.loop, name="scheduler", daemon=True)
+      self.thread.start()
+
+  def loop(self):
+    while True:
+      try:
+        self.step()
+      except Exception as e:
+        print("DSO scheduler error: " + str(e))
+      time.sleep(1 if self.job is not None else CHECK)
+
+  def step(self):
+    job = self.job
+    if job is not None:
+      if not job.active():
+        if job.state != "done":
+          self.failed[job.theDate] = time.monotonic()
+        if debug:
+          print("Scheduled night " + str(job.theDate) + ": " + str(job.state))
+        self.job = None
+      elif not job.background or self.queue.claimed(job):
+        self.job = None # requested by somebody meanwhile, the queue runs it
+      elif self.idle() or self.queue.waiting():
+        job.resume()
+      else:
+        job.pause()
+      return
+
+    if not self.idle() or any(j['state'] in ("queued", "running", "paused") for j in self.queue.status()):
+      return
+    for theDate in self.window():
+      if self.ready(theDate) or time.monotonic() - self.failed.get(theDate, -RETRY_FAILED) < RETRY_FAILED:
+        continue
+      if debug:
+        print("Precalculate night " + str(theDate))
+      self.job = self.queue.submit(theDate, self.plot, background=True)
+      return
+
+  def status(self):
+    jobs = {j['date'] : j for j in self.queue.status() if j['state'] in ("queued", "running", "paused")}
+    nights = []
+    for theDate in self.window():
+      if self.ready(theDate):
+        state = "ready"
+      elif theDate in jobs:
+        state = jobs[theDate]['state']
+      elif theDate in self.failed:
+        state = "failed"
+      else:
+        state = "missing"
+      nights.append({'date' : theDate, 'state' : state})
+    return {
+      'nights' : nights,
+      'idle' : self.idle(),
+      'seconds_since_request' : round(time.monotonic() - self.last(), 1)
+      }
+
+schedule = Scheduler(config.paths['data'], dsojobs.jobs, config.scheduler['nights'], config.scheduler['idle'], config.scheduler['plot'])
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi ranking of the objects of a night
+#
+# All objects are scored at once from their altitude/azimuth tracks on the
+# common time grid of the night (hours from midnight) and the Sun and Moon
+# tracks on the same grid:
+#
+#   max_dark_alt  max. observable altitude while the Sun is below config.scoring['dark_sun_alt']
+#   hours_above   hours above config.scoring['min_alt'] and the local horizon in the dark
+#   transit_dark  the object is observable when it culminates
+#   moon_sep      distance to the Moon at the best time, 180 while the Moon is down
+#   airmass       at the best time
+#
+# Each feature is mapped to 0..1 and weighted with config.scoring['weights'];
+# the score is 0..10, 0 for objects that are never observable in the dark.
+# Observable means above min_alt and above the local horizon (horizon.py) at
+# the object's azimuth, looked up for all samples of all tracks at once.
+# The text assessment of an object is only written when it is shown (describe()).
+#
+# Where an object is observed: minutes observable in the dark per azimuth
+# sector of 22.5 deg, sector k covering [22.5 k, 22.5 (k + 1)) from north, so the
+# quadrants (N = 315..45 deg, ...) and the 45 deg directions are sums of sectors.
+#
+
+import numpy as np
+
+import config
+import horizon
+
+debug = False # True
+
+MAX_AIRMASS = 40.0 # at the horizon
+SECTORS = 16
+QUADRANTS = "NESW" # centered on 0, 90, 180, 270 deg
+VISIBLE_HOURS = 0.5 # observable at least that long in the dark
+
+def observable(sun_alt, alts, azs, dark_sun_alt, min_alt):
+  # mask [objects][samples]: in the dark, above min_alt and the local horizon
+  return (alts > horizon.limit(azs, min_alt)) & (np.asarray(sun_alt) < dark_sun_alt)
+
+def features(hours, sun_alt, alts, azs, moon_alt=None, moon_az=None, dark_sun_alt=None, min_alt=None):
+  # hours, sun_alt, moon_alt, moon_az: [samples]; alts, azs: [objects][samples]; degrees
+  dark_sun_alt = config.scoring['dark_sun_alt'] if dark_sun_alt is None else dark_sun_alt
+  min_alt = config.scoring['min_alt'] if min_alt is None else min_alt
+  alts = np.atleast_2d(np.asarray(alts, dtype=np.float64))
+  azs = np.atleast_2d(np.asarray(azs, dtype=np.float64))
+  hours = np.asarray(hours, dtype=np.float64)
+  step = float(hours[1] - hours[0]) if len(hours) > 1 else 0.0
+  dark = np.asarray(sun_alt) < dark_sun_alt
+  observed = observable(sun_alt, alts, azs, dark_sun_alt, min_alt)
+  rows = np.arange(len(alts))
+
+  # best time: the highest observable sample, the highest dark one if there is none
+  observed_alts = np.where(observed, alts, -90.0)
+  dark_alts = np.where(dark, alts, -90.0)
+  best = np.where(observed.any(axis=1), np.argmax(observed_alts, axis=1), np.argmax(dark_alts, axis=1))
+  max_dark_alt = np.where(observed.any(axis=1), observed_alts[rows, best], dark_alts[rows, best])
+  hours_above = observed.sum(axis=1) * step
+  transit = np.argmax(alts, axis=1)
+  transit_dark = observed[rows, transit]
+
+  moon_sep = np.full(len(alts), 180.0)
+  if moon_alt is not None and moon_az is not None:
+    a1, a2 = np.radians(alts[rows, best]), np.radians(np.asarray(moon_alt)[best])
+    daz = np.radians(azs[rows, best] - np.asarray(moon_az)[best])
+    sep = np.degrees(np.arccos(np.clip(np.sin(a1) * np.sin(a2) + np.cos(a1) * np.cos(a2) * np.cos(daz), -1.0, 1.0)))
+    moon_sep = np.where(np.asarray(moon_alt)[best] > 0, sep, 180.0)
+
+  with np.errstate(divide='ignore'):
+    airmass = np.minimum(1.0 / np.sin(np.radians(np.maximum(max_dark_alt, 0.0))), MAX_AIRMASS)
+  return {
+    'best' : best,
+    'max_dark_alt' : max_dark_alt,
+    'hours_above' : hours_above,
+    'visible' : hours_above >= VISIBLE_HOURS,
+    'transit_dark' : transit_dark,
+    'moon_sep' : moon_sep,
+    'airmass' : airmass
+    }
+
+def scores(f, weights=None, full_hours=None):
+  # score 0..10 of each object from features()
+  weights = config.scoring['weights'] if weights is None else weights
+  full_hours = config.scoring['full_hours'] if full_hours is None else full_hours
+  parts = {
+    'altitude' : np.clip(f['max_dark_alt'] / 90.0, 0.0, 1.0),
+    'hours' : np.clip(f['hours_above'] / full_hours, 0.0, 1.0),
+    'transit' : np.asarray(f['transit_dark'], dtype=np.float64),
+    'moon' : np.clip(f['moon_sep'] / 90.0, 0.0, 1.0),
+    'airmass' : np.clip((3.0 - f['airmass']) / 2.0, 0.0, 1.0) # 1 at the zenith, 0 from airmass 3 (~20 deg)
+    }
+  total = sum(weights[k] * parts[k] for k in parts) / max(sum(weights[k] for k in parts), 1e-9)
+  return np.where(f['hours_above'] > 0, np.round(10.0 * total, 1), 0.0)
+
+def sectors(hours, sun_alt, alts, azs, dark_sun_alt=None, min_alt=None):
+  # minutes observable in the dark per azimuth sector, int [objects][SECTORS]
+  dark_sun_alt = config.scoring['dark_sun_alt'] if dark_sun_alt is None else dark_sun_alt
+  min_alt = config.scoring['min_alt'] if min_alt is None else min_alt
+  alts = np.atleast_2d(np.asarray(alts, dtype=np.float64))
+  azs = np.atleast_2d(np.asarray(azs, dtype=np.float64))
+  step = float(hours[1] - hours[0]) if len(hours) > 1 else 0.0
+  observed = observable(sun_alt, alts, azs, dark_sun_alt, min_alt)
+  sector = (np.mod(azs, 360.0) // (360.0 / SECTORS)).astype(np.int64) % SECTORS
+  cells = (np.arange(len(alts))[:, None] * SECTORS + sector)[observed]
+  samples = np.bincount(cells, minlength=len(alts) * SECTORS).reshape(len(alts), SECTORS)
+  return np.round(samples * step * 60.0).astype(np.int64)
+
+def quadrants(sectors):
+  # minutes per quadrant N, E, S, W of sectors [..., SECTORS]
+  s = np.asarray(sectors)
+  return np.stack([np.roll(s, 2 - 4 * q, axis=-1)[..., :4].sum(axis=-1) for q in range(4)], axis=-1)
+
+def main_directions(sectors):
+  # the quadrant with most minutes and the second one, e.g. "SW"; "" if never observable
+  minutes = quadrants(sectors)
+  order = np.argsort(-minutes, kind='stable')
+  return "".join(QUADRANTS[q] for q in order[:2] if minutes[q] > 0)
+
+def fields(f, i):
+  # the features of object i as stored with the catalogue
+  return {
+    'hours_above' : round(float(f['hours_above'][i]), 2),
+    'transit_dark' : bool(f['transit_dark'][i]),
+    'moon_sep' : round(float(f['moon_sep'][i]), 1),
+    'airmass' : round(float(f['airmass'][i]), 2)
+    }
+
+def describe(name, record):
+  # text assessment of a catalogue record
+  name = str(name)
+  if not record.get('score'):
+    return name + " is invisible."
+  lines = []
+  if record.get('transit_dark', record.get('max_alt') == record.get('max_alt_during_night')):
+    lines.append(name + " max. altitude " + str(round(record['max_alt'])) + " deg reached during night time at " + str(record['max_alt_time']) + " in " + str(record['max_alt_direction']))
+    lines.append(name + " is best observed at " + str(record['max_alt_time']) + " in " + str(record['max_alt_direction']))
+  else:
+    lines.append(name + " max. altitude " + str(round(record['max_alt_during_night'])) + " deg reached at " + str(record['max_alt_during_night_obstime']) + " in " + str(record['max_alt_during_night_direction']))
+    lines.append(name + " max. altitude " + str(round(record['max_alt'])) + " deg reached during night time at " + str(record['max_alt_time']) + " in " + str(record['max_alt_direction']))
+    lines.append(name + " is best observed before " + str(record['max_alt_time']) + " in " + str(record['max_alt_direction']))
+  if 'hours_above' in record:
+    details = str(record['hours_above']) + " h above " + str(config.scoring['min_alt']) + " deg in the dark, airmass " + str(record['airmass'])
+    if record['moon_sep'] < 180:
+      details += ", " + str(round(record['moon_sep'])) + " deg from the Moon"
+    lines.append(details)
+  lines.append("Score " + str(record['score']) + "/10")
+  return "\n".join(lines)
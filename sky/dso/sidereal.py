@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi sidereal-day reference tracks of the catalogue
+#
+# The objects are fixed on the sky: from one night to the next their tracks
+# only shift by 3m56s of clock time, precession changes them by about 0.001 deg
+# a month. The reference holds, per object, its coordinates and type
+# (no Simbad lookup for known objects) and its horizontal unit vector (up,
+# north, east) on config.sidereal['samples'] local sidereal times over one
+# sidereal day. A night's track is a lookup at the sidereal times of its grid,
+# linear between the samples (< 0.001 deg at 1440 samples); only the Sun, Moon
+# and the dark windows of the night are computed anew (pipeline.Night).
+#
+# The tracks are rebuilt after config.sidereal['max_age_days'] (precession), for
+# another latitude and when objects are added to the list, from the stored
+# coordinates of the known objects.
+#
+# sidereal.bin in the data directory, little endian:
+#
+#   header   4s magic "DSOR", uint16 version, uint32 objects, uint16 samples,
+#            uint32 length of the name block, float64 latitude, float64 epoch (JD)
+#   names    UTF-8 "name\tobject type\tdescription" lines, padded to an even length
+#   float64  ra, dec [objects][2] (J2000, deg)
+#   float32  up, north, east [objects][samples][3]
+#
+
+import os
+import struct
+
+import numpy as np
+
+import config
+import skymath
+
+debug = False # True
+
+MAGIC = b"DSOR"
+VERSION = 2
+HEADER = struct.Struct("<4sHIHIdd")
+HEADER_V1 = struct.Struct("<4sHHHHdd") # uint16 objects and name block, still read
+
+stats = {'builds' : 0, 'hits' : 0, 'misses' : 0}
+
+def reference_file(root):
+  return os.path.join(root, "sidereal.bin")
+
+class Reference:
+
+  def __init__(self, rows, latitude, epoch, vectors):
+    self.rows = rows # [(name, ra, dec, object_type, object_type_string)]
+    self.latitude = latitude
+    self.epoch = epoch # JD of the precession
+    self.vectors = vectors # float32 [objects][samples][3]
+    self.index = {row[0] : i for i, row in enumerate(rows)}
+
+  def samples(self):
+    return self.vectors.shape[1]
+
+  def fresh(self, latitude, jd, max_age_days=None):
+    # usable for a night at jd (UT) at latitude
+    max_age_days = config.sidereal['max_age_days'] if max_age_days is None else max_age_days
+    return abs(self.latitude - float(latitude)) < 1e-6 and abs(float(jd) - self.epoch) <= max_age_days
+
+  def track(self, indices, lst):
+    # alt, az [objects][samples] in degrees of the objects indices at the sidereal times lst
+    samples = self.samples()
+    x = np.mod(np.asarray(lst, dtype=np.float64), 360.0) * samples / 360.0
+    k = np.floor(x).astype(np.int64)
+    w = (x - k)[None, :, None]
+    v = self.vectors[np.asarray(indices)]
+    v = (1.0 - w) * v[:, k % samples] + w * v[:, (k + 1) % samples]
+    up, north, east = v[..., 0], v[..., 1], v[..., 2]
+    # atan2 keeps the altitude precise near the zenith
+    return np.degrees(np.arctan2(up, np.hypot(north, east))), np.degrees(np.arctan2(east, north)) % 360.0
+
+def vectors_of(rows, latitude, epoch, samples):
+  # float32 horizontal unit vectors [objects][samples][3] of rows
+  ra = np.array([r[1] for r in rows], dtype=np.float64)
+  dec = np.array([r[2] for r in rows], dtype=np.float64)
+  vectors = skymath.unit_vectors(ra, dec) @ skymath.precession(float(epoch)).T
+  lst = np.arange(samples) * 360.0 / samples
+  up, north, east = skymath.horizontal(vectors[:, None, :], lst[None, :], float(latitude))
+  return np.stack([up, north, east], axis=-1).astype(np.float32)
+
+def compute(rows, latitude, epoch, samples=None):
+  # Reference of rows [(name, ra, dec, object_type, object_type_string)]
+  samples = config.sidereal['samples'] if samples is None else samples
+  stats['builds'] += 1
+  return Reference([tuple(r) for r in rows], float(latitude), float(epoch), vectors_of(rows, latitude, epoch, samples))
+
+def write_file(filename, rows, latitude, epoch, samples, chunks):
+  # chunks: float32 vectors [objects][samples][3] of the rows one after the other
+  block = "\n".join("\t".join(str(value) for value in (r[0], r[3], r[4])) for r in rows).encode('utf-8')
+  if len(block) % 2 == 1:
+    block += b"\n"
+  tmp = filename + "." + str(os.getpid()) + ".tmp"
+  try:
+    with open(tmp, 'wb') as f:
+      f.write(HEADER.pack(MAGIC, VERSION, len(rows), samples, len(block), float(latitude), float(epoch)))
+      f.write(block)
+      f.write(np.array([r[1:3] for r in rows], dtype='<f8').reshape(len(rows), 2).tobytes())
+      for vectors in chunks:
+        f.write(np.ascontiguousarray(vectors, dtype='<f4').tobytes())
+  except BaseException:
+    os.remove(tmp)
+    raise
+  os.replace(tmp, filename)
+
+def write(filename, ref):
+  write_file(filename, ref.rows, ref.latitude, ref.epoch, ref.samples(), [ref.vectors])
+
+def build(filename, rows, latitude, epoch, chunk=None, samples=None):
+  # computes and writes the reference of rows chunk objects at a time, the
+  # vectors of all objects (~50 MB at 3000 objects) are never in memory at once
+  samples = config.sidereal['samples'] if samples is None else samples
+  chunk = config.pipeline['chunk'] if chunk is None else max(int(chunk), 1)
+  stats['builds'] += 1
+  write_file(filename, rows, latitude, epoch, samples,
+             (vectors_of(rows[i:i + chunk], latitude, epoch, samples) for i in range(0, len(rows), chunk)))
+
+def read(filename):
+  # the vectors are mapped from the file (np.memmap): only the pages of the
+  # objects looked up are read, the rest stays on disk
+  with open(filename, 'rb') as f:
+    data = f.read(HEADER.size)
+    magic, version = struct.unpack_from("<4sH", data)
+    if magic != MAGIC or version not in (1, VERSION):
+      raise ValueError("Not a DSO sidereal reference file: " + str(filename))
+    header = HEADER if version == VERSION else HEADER_V1
+    _, _, objects, samples, length, latitude, epoch = header.unpack_from(data)
+    f.seek(header.size)
+    block = f.read(length)
+    coordinates = np.frombuffer(f.read(objects * 2 * 8), dtype='<f8', count=objects * 2).reshape(objects, 2)
+  lines = block.decode('utf-8').rstrip("\n").split("\n") if objects > 0 else []
+  offset = header.size + length + objects * 2 * 8
+  if objects > 0:
+    vectors = np.memmap(filename, dtype='<f4', mode='r', offset=offset, shape=(objects, samples, 3))
+  else:
+    vectors = np.zeros((0, samples, 3), dtype=np.float32)
+  rows = []
+  for line, (ra, dec) in zip(lines, coordinates.tolist()):
+    name, object_type, object_type_string = (line.split("\t") + ["", ""])[:3]
+    rows.append((name, ra, dec, object_type, object_type_string))
+  return Reference(rows, latitude, epoch, vectors)
+
+def load(filename):
+  # Reference of the file, None if there is none; its coordinates stay valid
+  # when the tracks are outdated (Reference.fresh())
+  if not os.path.isfile(filename):
+    return None
+  try:
+    return read(filename)
+  except (OSError, ValueError, struct.error) as e:
+    print("Sidereal reference " + str(filename) + " not readable: " + str(e))
+    return None
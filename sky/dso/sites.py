@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi observing sites
+#
+# config.coordinates is the home site, config.sites adds named profiles with
+# the same keys and the horizon file of the site. The home site keeps the data
+# directory; the catalogues, tracks and sidereal reference of another site are
+# stored in <data>/sites/<name> and served under /site/<name>/.
+#
+
+import os
+
+import config
+
+HOME = 'home'
+
+def names():
+  return [HOME] + [name for name in config.sites if name != HOME]
+
+def get(name):
+  # profile of a site: latitude, longitude, elevation, location, timezone and
+  # horizon, its horizon file ("" for a flat horizon)
+  if name == HOME:
+    return dict(config.coordinates, horizon=config.horizon['file'])
+  if name not in config.sites:
+    raise KeyError("Unknown site: " + str(name))
+  profile = dict(config.sites[name])
+  profile['horizon'] = profile.get('horizon') or ""
+  return profile
+
+def data_root(name, root=None):
+  # data directory of a site
+  root = config.paths['data'] if root is None else root
+  return root if name == HOME else os.path.join(root, "sites", name)
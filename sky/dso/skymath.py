@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi altitude/azimuth of the whole catalogue at once
+#
+# The J2000 (ICRS) positions of the catalogue objects are kept as unit vectors.
+# Precession to the date, Earth rotation (sidereal time) and the observer's
+# latitude combine into one 3x3 matrix per instant, so the horizontal
+# coordinates of all objects are a single matrix product - well below a
+# millisecond for the ~300 objects, also on a Pi. Nutation, aberration and
+# polar motion are left out (< 0.01 deg), refraction is added near the
+# horizon. Good for pointing at the eyepiece, not for astrometry.
+#
+# For planning over many nights the Sun and the Moon come from short series
+# (Astronomical Almanac, ~0.01 deg and ~0.3 deg) and horizontal() turns
+# vectors of the date into altitudes for whole arrays of sidereal times.
+#
+
+import math
+import datetime
+
+import numpy as np
+
+J2000 = 2451545.0 # Julian date of 2000-01-01 12:00 TT
+UNIX_EPOCH = 2440587.5
+SIDEREAL_RATE = 15.04106864 # degrees of hour angle per hour
+COMPASS = ("N", "NNE", "NE", "ENE", "E", "ESE", "SE", "SSE", "S", "SSW", "SW", "WSW", "W", "WNW", "NW", "NNW")
+
+def julian_date(when=None):
+  # when: aware datetime, naive datetimes are UTC; None is now
+  if when is None:
+    when = datetime.datetime.now(datetime.timezone.utc)
+  elif when.tzinfo is None:
+    when = when.replace(tzinfo=datetime.timezone.utc)
+  return UNIX_EPOCH + when.timestamp() / 86400.0
+
+def sidereal_time(jd, longitude):
+  # local mean sidereal time in degrees (IAU 1982), longitude east in degrees
+  t = (jd - J2000) / 36525.0
+  gmst = 280.46061837 + 360.98564736629 * (jd - J2000) + 0.000387933 * t * t - t * t * t / 38710000.0
+  return (gmst + longitude) % 360.0
+
+def rotation(axis, angle):
+  # coordinate frame rotation by angle (rad) about axis 0 (x), 1 (y) or 2 (z)
+  c, s = math.cos(angle), math.sin(angle)
+  i, j = [(1, 2), (2, 0), (0, 1)][axis]
+  r = np.eye(3)
+  r[i, i] = c
+  r[i, j] = s
+  r[j, i] = -s
+  r[j, j] = c
+  return r
+
+def precession(jd):
+  # J2000 -> mean equator and equinox of the date (IAU 1976)
+  t = (jd - J2000) / 36525.0
+  arcsec = math.pi / (180.0 * 3600.0)
+  zeta = (2306.2181 * t + 0.30188 * t * t + 0.017998 * t * t * t) * arcsec
+  z = (2306.2181 * t + 1.09468 * t * t + 0.018203 * t * t * t) * arcsec
+  theta = (2004.3109 * t - 0.42665 * t * t - 0.041833 * t * t * t) * arcsec
+  return rotation(2, -z) @ rotation(1, theta) @ rotation(2, -zeta)
+
+def meridian(jd, longitude):
+  # matrix from J2000 unit vectors to the hour angle frame of the date:
+  # x to the meridian, y to the east, z to the celestial pole
+  return rotation(2, math.radians(sidereal_time(jd, longitude))) @ precession(jd)
+
+def horizon(jd, latitude, longitude):
+  # matrix from J2000 unit vectors to (north, east, up) of the observer
+  lat = math.radians(latitude)
+  to_horizon = np.array([
+    [-math.sin(lat), 0.0, math.cos(lat)],
+    [0.0, 1.0, 0.0],
+    [math.cos(lat), 0.0, math.sin(lat)]])
+  return to_horizon @ meridian(jd, longitude)
+
+def unit_vectors(ra, dec):
+  # ra, dec in degrees -> (n, 3) array
+  ra = np.radians(np.asarray(ra, dtype=np.float64))
+  dec = np.radians(np.asarray(dec, dtype=np.float64))
+  return np.column_stack((np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)))
+
+def refraction(alt):
+  # apparent minus true altitude in degrees (Saemundsson, 10 degC, 1010 hPa)
+  alt = np.maximum(alt, -1.0)
+  return 1.02 / np.tan(np.radians(alt + 10.3 / (alt + 5.11))) / 60.0
+
+def altaz(vectors, jd, latitude, longitude, refract=True):
+  # apparent altitude and azimuth (from north through east) in degrees
+  north, east, up = (vectors @ horizon(jd, latitude, longitude).T).T
+  alt = np.degrees(np.arcsin(np.clip(up, -1.0, 1.0)))
+  if refract:
+    alt = alt + np.where(alt > -1.0, refraction(alt), 0.0)
+  az = np.degrees(np.arctan2(east, north)) % 360.0
+  return alt, az
+
+def hours_above(vectors, jd, latitude, longitude, threshold=0.0):
+  # hours until each object sinks below the threshold altitude (degrees, no
+  # refraction): 0 if it is below now, inf if it never sets
+  x, y, z = (vectors @ meridian(jd, longitude).T).T
+  hour_angle = np.degrees(np.arctan2(-y, x)) # west of the meridian
+  lat = math.radians(latitude)
+  cos_dec = np.sqrt(np.maximum(x * x + y * y, 1e-12))
+  with np.errstate(divide='ignore', invalid='ignore'):
+    # hour angle at which the object crosses the threshold while setting
+    cos_h0 = (math.sin(math.radians(threshold)) - math.sin(lat) * z) / (math.cos(lat) * cos_dec)
+  setting = np.degrees(np.arccos(np.clip(cos_h0, -1.0, 1.0)))
+  hours = ((setting - hour_angle) % 360.0) / SIDEREAL_RATE
+  up = math.sin(lat) * z + math.cos(lat) * x >= math.sin(math.radians(threshold))
+  hours = np.where(up, np.where(cos_h0 <= -1.0, np.inf, hours), 0.0)
+  return hours
+
+def horizontal(vectors, lst, latitude):
+  # (up, north, east) components of unit vectors of the equator of the date
+  # [..., 3] at local sidereal times lst (degrees, broadcast against them)
+  v = np.asarray(vectors, dtype=np.float64)
+  x, y, z = v[..., 0], v[..., 1], v[..., 2]
+  theta = np.radians(lst)
+  c, s = np.cos(theta), np.sin(theta)
+  meridian, east = x * c + y * s, y * c - x * s
+  lat = math.radians(latitude)
+  return math.sin(lat) * z + math.cos(lat) * meridian, math.cos(lat) * z - math.sin(lat) * meridian, east
+
+def ecliptic_vectors(lon, lat, jd):
+  # ecliptic longitude/latitude of the date (degrees) -> unit vectors of the equator of the date
+  eps = np.radians(23.439 - 0.0000004 * (np.asarray(jd) - J2000))
+  lon, lat = np.radians(lon), np.radians(lat)
+  x, y, z = np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)
+  return np.stack((x, np.cos(eps) * y - np.sin(eps) * z, np.sin(eps) * y + np.cos(eps) * z), axis=-1)
+
+def sun(jd):
+  # unit vectors [..., 3] of the Sun for Julian dates jd (array)
+  n = np.asarray(jd, dtype=np.float64) - J2000
+  mean_lon = 280.460 + 0.9856474 * n
+  g = np.radians(357.528 + 0.9856003 * n)
+  return ecliptic_vectors(mean_lon + 1.915 * np.sin(g) + 0.020 * np.sin(2 * g), np.zeros_like(n), jd)
+
+def moon(jd):
+  # (unit vectors [..., 3], horizontal parallax in degrees) of the Moon for Julian dates jd
+  t = (np.asarray(jd, dtype=np.float64) - J2000) / 36525.0
+  def series(terms):
+    return sum(a * np.sin(np.radians(b + c * t)) for a, b, c in terms)
+  lon = 218.32 + 481267.881 * t + series(((6.29, 135.0, 477198.87), (-1.27, 259.3, -413335.36), (0.66, 235.7, 890534.22),
+                                          (0.21, 269.9, 954397.74), (-0.19, 357.5, 35999.05), (-0.11, 186.5, 966404.03)))
+  lat = series(((5.13, 93.3, 483202.02), (0.28, 228.2, 960400.89), (-0.28, 318.3, 6003.15), (-0.17, 217.6, -407332.21)))
+  parallax = 0.9508 + series(((0.0518, 224.9, 477198.85), (0.0095, 349.2, -413335.38), (0.0078, 325.7, 890534.23), (0.0028, 359.9, 954397.70)))
+  return ecliptic_vectors(lon, lat, jd), parallax
+
+def compass(az):
+  # 16 point compass name of each azimuth
+  return [COMPASS[i] for i in (np.floor((np.asarray(az) + 11.25) / 22.5).astype(int) % 16)]
+
+def in_direction(az, direction):
+  # mask of the azimuths in a compass direction: N/E/S/W are quadrants of
+  # 90 degrees, NE/SW... 45 degrees and NNE/WSW... 22.5 degrees wide
+  direction = str(direction).upper()
+  if direction not in COMPASS:
+    raise ValueError("unknown direction: " + str(direction))
+  center = COMPASS.index(direction) * 22.5
+  half = 45.0 / 2 ** (len(direction) - 1)
+  return np.abs((np.asarray(az) - center + 180.0) % 360.0 - 180.0) < half
+
+class Positions:
+  # unit vectors of the catalogue records with coordinates ('ra'/'dec' in degrees)
+
+  def __init__(self, records):
+    self.records = [r for r in records if r.get('ra') is not None and r.get('dec') is not None]
+    self.vectors = unit_vectors([r['ra'] for r in self.records], [r['dec'] for r in self.records]) if self.records else np.zeros((0, 3))
+
+  def __len__(self):
+    return len(self.records)
+
+  def altaz(self, latitude, longitude, when=None):
+    return altaz(self.vectors, julian_date(when), latitude, longitude)
+
+  def hours_above(self, latitude, longitude, threshold=0.0, when=None):
+    return hours_above(self.vectors, julian_date(when), latitude, longitude, threshold)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi plot image variants for the gallery
+#
+# For every DSO_<name>_<date>.png two smaller variants are kept next to the
+# plots, with the same file name so dated variants are cached like the plots:
+#   thumbs/  small thumbnail shown in the gallery
+#   full/    full size plot with a reduced color palette
+# They are created right after plotting (DSO_observation_planning.py) or on
+# first request by the server. One thread of one process (prefork workers)
+# creates a variant at a time: a thread lock per variant and an flock on one of
+# LOCK_FILES lock files of the variant directory, chosen by the file name.
+#
+
+import fcntl
+import os
+import threading
+import zlib
+
+from PIL import Image
+
+import config
+
+debug = False # True
+
+VARIANTS = ('thumbs', 'full')
+LOCK_FILES = 16 # per variant directory
+
+locks = {} # variant file -> lock, one thread creates a variant at a time
+locks_lock = threading.Lock()
+stats = {'hits' : 0, 'created' : 0}
+
+def variant_file(root, filename, variant):
+  return os.path.join(root, variant, os.path.basename(filename))
+
+def quantize(image):
+  # matplotlib plots use few colors, an adaptive palette keeps them intact
+  return image.convert("RGB").quantize(colors=config.thumbnails['colors'], method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+
+def create(source, target, variant):
+  # the source file is closed when done, also on errors
+  with Image.open(source) as image:
+    if variant == 'thumbs':
+      width = config.thumbnails['width']
+      height = max(1, round(image.height * width / image.width))
+      image = image.convert("RGB").resize((width, height), Image.Resampling.LANCZOS)
+    image = quantize(image)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # written under a temporary name, readers never see a partial file
+    tmp = target + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+    image.save(tmp, format="PNG", optimize=True)
+  os.replace(tmp, target)
+  stats['created'] += 1
+  if debug:
+    print("Created " + str(target) + " (" + str(os.path.getsize(target)) + " bytes)")
+
+def variant(root, filename, variant):
+  # path of the variant of root/filename, created if missing or outdated;
+  # None if there is no such plot
+  source = os.path.join(root, os.path.basename(filename))
+  target = variant_file(root, filename, variant)
+  try:
+    source_mtime = os.stat(source).st_mtime
+  except OSError:
+    return None
+  try:
+    if os.stat(target).st_mtime >= source_mtime:
+      stats['hits'] += 1
+      return target
+  except OSError:
+    pass
+
+  with locks_lock:
+    lock = locks.setdefault(target, threading.Lock())
+  with lock:
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    lock_file = os.path.join(os.path.dirname(target), ".lock" + str(zlib.crc32(os.path.basename(target).encode('utf-8')) % LOCK_FILES))
+    with open(lock_file, 'a') as f:
+      fcntl.flock(f, fcntl.LOCK_EX) # released when closed
+      # another thread or worker may have created it meanwhile
+      if not os.path.isfile(target) or os.stat(target).st_mtime < source_mtime:
+        create(source, target, variant)
+  with locks_lock:
+    locks.pop(target, None)
+  return target
+
+def make_variants(plot_file):
+  # post-processing of a freshly saved plot
+  root = os.path.dirname(plot_file)
+  for v in VARIANTS:
+    try:
+      variant(root, plot_file, v)
+    except Exception as e:
+      print("DSO plot variant error " + str(plot_file) + ": " + str(e))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi compact binary altitude/azimuth tracks of a night
+#
+# tracks_<dd.mm.yyyy>.bin holds the Sun and Moon altitudes and the alt/az
+# tracks of all catalogue objects, sampled on the plot's time grid (hours from
+# midnight), so browsers can draw the visibility plots themselves
+# (dsochart.js). Little endian layout:
+#
+#   header   4s magic "DSOT", uint16 version, uint16 samples, uint32 objects,
+#            uint32 length of the name block, float32 first hour, float32 step
+#            (version 1: uint16 objects and length, still read)
+#   names    UTF-8 object names separated by "\n", padded to an even length
+#   int16    Sun altitude [samples], Moon altitude [samples]    (0.01 deg)
+#   int16    object altitudes [objects][samples]               (0.01 deg)
+#   uint16   object azimuths [objects][samples]                (0.01 deg)
+#
+
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b"DSOT"
+VERSION = 2
+HEADER = struct.Struct("<4sHHIIff")
+HEADER_V1 = struct.Struct("<4sHHHHff")
+STEP = 4 # every 4th sample of the 1000 sample plot grid, ~6 minutes
+
+def tracks_file(root, theDate):
+  return os.path.join(root, "tracks_" + str(theDate) + ".bin")
+
+def centideg(values, dtype):
+  return np.round(np.asarray(values, dtype=np.float64) * 100.0).astype(dtype)
+
+def write(filename, hours, sun_alt, moon_alt, names, alts, azs):
+  # hours: evenly spaced hours from midnight; alts/azs: [objects][samples] in deg
+  hours = np.asarray(hours, dtype=np.float64)
+  block = "\n".join(names).encode('utf-8')
+  if len(block) % 2 == 1:
+    block += b"\n"
+  step = float(hours[1] - hours[0]) if len(hours) > 1 else 0.0
+  tmp = filename + "." + str(os.getpid()) + ".tmp"
+  with open(tmp, 'wb') as f:
+    f.write(HEADER.pack(MAGIC, VERSION, len(hours), len(names), len(block), float(hours[0]), step))
+    f.write(block)
+    f.write(centideg(sun_alt, '<i2').tobytes())
+    f.write(centideg(moon_alt, '<i2').tobytes())
+    f.write(centideg(np.reshape(alts, (len(names), len(hours))), '<i2').tobytes())
+    f.write(centideg(np.mod(np.reshape(azs, (len(names), len(hours))), 360.0), '<u2').tobytes())
+  os.replace(tmp, filename)
+
+def read(filename):
+  # returns dict(hours, sun_alt, moon_alt, names, alt, az) with arrays in deg
+  with open(filename, 'rb') as f:
+    data = f.read()
+  magic, version = struct.unpack_from("<4sH", data)
+  if magic != MAGIC or version not in (1, VERSION):
+    raise ValueError("Not a DSO tracks file: " + str(filename))
+  header = HEADER if version == VERSION else HEADER_V1
+  _, _, samples, objects, length, start, step = header.unpack_from(data)
+  offset = header.size
+  names = data[offset:offset + length].decode('utf-8').rstrip("\n").split("\n") if objects > 0 else []
+  offset += length
+
+  def array(dtype, shape):
+    nonlocal offset
+    a = np.frombuffer(data, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+    offset += a.nbytes
+    return a / 100.0
+
+  return {
+    'hours' : start + step * np.arange(samples),
+    'sun_alt' : array('<i2', (samples,)),
+    'moon_alt' : array('<i2', (samples,)),
+    'names' : names,
+    'alt' : array('<i2', (objects, samples)),
+    'az' : array('<u2', (objects, samples))
+    }
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi DSO server HTML templates
+#
+# The templates are compiled once at import and rendered with the catalogue
+# records as data. URL prefixes of routes (e.g. "/img/thumbs/") are resolved
+# once by the server and passed in.
+#
+
+from bottle import SimpleTemplate
+
+GALLERY_STYLE = '''<style>
+          figcaption {
+          background-color: black;
+          color: white;
+          font-style: italic;
+          padding: 2px;
+          text-align: left;
+        }
+        div.gallery {
+          border: 1px solid #ccc;
+        }
+        div.gallery:hover {
+          border: 1px solid #777;
+        }
+        div.gallery img, div.gallery canvas {
+          width: 100%;
+          height: auto;
+        }
+        div.desc {
+          padding: 15px;
+          text-align: center;
+        }
+        * {
+          box-sizing: border-box;
+        }
+        .responsive {
+          padding: 0 6px;
+          float: left;
+          width: 49.99999%;
+        }
+        @media only screen and (max-width: 700px) {
+          .responsive {
+            width: 49.99999%;
+            margin: 6px 0;
+          }
+        }
+        @media only screen and (max-width: 500px) {
+          .responsive {
+            width: 100%;
+          }
+        }
+        .clearfix:after {
+          content: "";
+          display: table;
+          clear: both;
+        }
+        </style>'''
+
+# The gallery is streamed: GALLERY_HEAD, GALLERY_ENTRIES for every chunk of
+# records and GALLERY_TAIL.
+GALLERY_HEAD = SimpleTemplate('''<!DOCTYPE html><html>
+        <head>
+        <meta http-equiv="Content-Type" content="text/html; charset=UTF-8">
+        <title>{{title}}</title>
+        ''' + GALLERY_STYLE + '''
+        </head>
+        <body style="background-color:black;">
+''')
+
+# records: catalogue records (name, object_type_string) to show as plots,
+# thumbs/full: URL prefixes of the plot thumbnails and the compressed full plots,
+# charts: names of records without a plot, drawn by dsochart.js from the
+# tracks file of the night (URL tracks) and linked to chart + name,
+# horizon: local horizon profile of the charts (horizon.attribute())
+GALLERY_ENTRIES = SimpleTemplate('''% for r in records:
+% if r['name'] in charts:
+<div class="responsive"><div class="gallery"><figure><a href="{{chart}}{{r['name']}}" target="_blank"><canvas class="dsochart" data-tracks="{{tracks}}" data-name="{{r['name']}}" data-date="{{theDate}}" data-horizon="{{horizon}}" width="640" height="480" title="{{r['object_type_string'] or r['name']}}"></canvas></a><figcaption><a href="https://simbad.cds.unistra.fr/simbad/sim-basic?Ident={{r['name']}}" target="_blank" style="color:white;">{{r['name']}}</a>{{(': ' + r['object_type_string']) if r['object_type_string'] else ''}}</figcaption></figure></div></div>
+% else:
+<div class="responsive"><div class="gallery"><figure><a href="{{full}}DSO_{{r['name']}}_{{theDate}}.png"  target="_blank"><img src="{{thumbs}}DSO_{{r['name']}}_{{theDate}}.png" loading="lazy" width="640" height="480" alt="DSO_{{r['name']}}_{{theDate}}.png" title="{{r['object_type_string'] or r['name']}}"/></a><figcaption><a href="https://simbad.cds.unistra.fr/simbad/sim-basic?Ident={{r['name']}}" target="_blank" style="color:white;">{{r['name']}}</a>{{(': ' + r['object_type_string']) if r['object_type_string'] else ''}}</figcaption></figure></div></div>
+% end
+% end
+''')
+
+# script: URL of dsochart.js if the page has charts
+GALLERY_TAIL = SimpleTemplate('''% if message:
+<p style="color:red;"><bold>{{message}}</bold></p>
+% end
+% if script:
+<script src="{{script}}" defer></script>
+% end
+</body>
+        </html>''')
+
+# single visibility chart of name drawn by dsochart.js (script) from tracks
+# with the local horizon profile horizon
+CHART = SimpleTemplate('''<!DOCTYPE html><html>
+        <head>
+        <meta http-equiv="Content-Type" content="text/html; charset=UTF-8">
+        <title>{{name}} {{theDate}}</title>
+        </head>
+        <body style="background-color:black;">
+<canvas class="dsochart" data-tracks="{{tracks}}" data-name="{{name}}" data-date="{{theDate}}" data-horizon="{{horizon}}" width="1280" height="960" style="width:100%;height:auto;"></canvas>
+<script src="{{script}}" defer></script>
+        </body>
+        </html>''')
+
+# records: catalogue records to list, show_type adds the object type
+LIST = SimpleTemplate('''<!DOCTYPE html><html>
+        <head>
+        <meta http-equiv="Content-Type" content="text/html; charset=UTF-8">
+        <title>{{title}}</title>
+        </head>
+        <body style="background-color:black;">
+        <table>
+% for r in records:
+<tr><td><a href="https://simbad.cds.unistra.fr/simbad/sim-basic?Ident={{r['name']}}" target="_blank">{{r['name']}}{{(': ' + r['object_type_string']) if show_type else ''}}</a></td></tr>
+% end
+        </table>
+% if message:
+<p style="color:red;"><bold>{{message}}</bold></p>
+% end
+        </body>
+        </html>''')
+
+CALCULATING = SimpleTemplate('''<!DOCTYPE html><html>
+        <head><meta http-equiv="Content-Type" content="text/html; charset=UTF-8">
+        <title>DSO calculation ongoing for {{theDate}}...</title>
+        </head>
+        <body>
+            <p><bold>DSO calculation ongoing for {{theDate}}...</bold></p>
+            <p><a href="/jobs/{{theDate}}">Progress</a></p>
+        </body>
+        </html>
+''')
+
+FRAMESET = SimpleTemplate('''
+<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01 Frameset//EN" "http://www.w3.org/TR/html4/frameset.dtd">
+<html>
+  <head><title>Tonight</title></head>
+  <frameset cols="150, *">
+    <frame src="static/FRAMESET_navigation.html" name="navigation">
+    <frame src="static/FRAMESET_tonight.html" name="in">
+  </frameset>
+</html>
+''')
+
+# apkp is HTML (Kp indices separated by </br>)
+NAVIGATION = SimpleTemplate('''<!DOCTYPE html><html><head>
+<link href='https://fonts.googleapis.com/css?family=Open Sans' rel='stylesheet'>
+<style>
+body {
+    font-family: 'Open Sans';
+}
+</style> <!--font-size: 18px;-->
+</head>
+<body style="background-color:black;" text="#ffffff">
+<h2>{{theDate}}</h2>
+<p>{{astronight}}</p>
+<p>{{suntimes}}</p>
+<p>{{moontimes}}</p>
+<p>{{moon_phase}}</p>
+<p>{{full_moon}}</p>
+<p><a href="FRAMESET_tonight.html" target="in">The Sky Tonight</a></p>
+<p><a href="FRAMESET_S10.html" target="in">DSOs S/10 deg</a></p>
+<p><a href="FRAMESET_W10.html" target="in">DSOs W/10 deg</a></p>
+<p><a href="FRAMESET_N10.html" target="in">DSOs N/10 deg</a></p>
+<p><a href="FRAMESET_E10.html" target="in">DSOs E/10 deg</a></p>
+<p>{{!apkp}}</p>
+</body>
+</html>
+''')
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ObsPi visibility calendar of the catalogue for the year ahead
+#
+# For every object and each of the next config.calendar['nights'] nights: the
+# hours it is above config.calendar['min_alt'] (and the local horizon) while the
+# Sun is below config.scoring['dark_sun_alt'] and the Moon is down. The nights
+# are sampled every config.calendar['step'] minutes from noon to noon; Sun, Moon
+# and sidereal time of all samples of the year are arrays, the objects'
+# altitudes are computed for the usable (dark, moonless) samples only, a block
+# of nights at a time for all objects at once (skymath.py). The year takes
+# about a second on a Pi.
+#
+# calendar_<dd.mm.yyyy>.bin in the data directory, named after the first night,
+# little endian:
+#
+#   header   4s magic "DSOC", uint16 version, uint16 nights, uint32 objects,
+#            uint32 length of the name block, uint32 first night (date ordinal),
+#            float32 min_alt, float32 dark_sun_alt, uint32 objects key
+#   names    UTF-8 object names separated by "\n", padded to an even length
+#   uint8    quarter hours [objects][nights]
+#
+# The objects key is a CRC-32 of the names and coordinates of the catalogue
+# the calendar was computed from (objects_key()): a calendar of the day is
+# computed again when the catalogue was rebuilt with other objects or the
+# calendar settings changed.
+#
+#   python3 yearcalendar.py [--date dd.mm.yyyy] [--name M31]
+#
+
+import optparse
+import os
+import glob
+import struct
+import datetime
+import threading
+import time
+import zlib
+
+import numpy as np
+import pytz
+
+import config
+import horizon
+import skymath
+
+debug = False # True
+
+MAGIC = b"DSOC"
+VERSION = 3
+HEADER = struct.Struct("<4sHHIIIffI")
+BLOCK = 16 # nights computed at a time
+
+loaded = {} # file -> (mtime_ns, Calendar)
+lock = threading.Lock() # one calculation at a time
+stats = {'calculations' : 0}
+
+def calendar_file(root, theDate):
+  return os.path.join(root, "calendar_" + str(theDate) + ".bin")
+
+def objects_key(records):
+  # CRC-32 of the names and coordinates of the records
+  text = "\n".join(str(r['name']) + "\t" + str(r.get('ra')) + "\t" + str(r.get('dec')) for r in records)
+  return zlib.crc32(text.encode('utf-8'))
+
+class Calendar:
+
+  def __init__(self, first, names, quarters, min_alt, dark_sun_alt, key=0):
+    self.first = first # datetime.date of the first night
+    self.key = key # objects_key() of the records it was computed from
+    self.names = names
+    self.quarters = quarters # uint8 [objects][nights]
+    self.min_alt = min_alt
+    self.dark_sun_alt = dark_sun_alt
+    self.index = {name : i for i, name in enumerate(names)}
+    self.version = None # of the file, set by load()
+
+  def nights(self):
+    return self.quarters.shape[1]
+
+  def dates(self):
+    return [self.first + datetime.timedelta(days=d) for d in range(self.nights())]
+
+  def hours(self):
+    return self.quarters / 4.0
+
+  def current(self, key):
+    # computed from these objects with the current settings
+    return self.key == key and self.nights() == config.calendar['nights'] \
+      and self.min_alt == float(np.float32(config.calendar['min_alt'])) and self.dark_sun_alt == float(np.float32(config.scoring['dark_sun_alt']))
+
+  def good(self, min_hours):
+    # bitmap [objects][nights] of the nights with at least min_hours
+    return self.quarters >= int(np.ceil(min_hours * 4))
+
+def night_grid(first, nights, step, tz):
+  # Julian dates [nights][samples] from noon to noon (local time) of each night
+  noons = np.array([skymath.julian_date(tz.localize(datetime.datetime.combine(first + datetime.timedelta(days=d), datetime.time(12))))
+                    for d in range(nights)])
+  return noons[:, None] + np.arange(0, 24 * 60, step)[None, :] / 1440.0
+
+def compute(records, first, nights=None, latitude=None, longitude=None, min_alt=None, dark_sun_alt=None, step=None, timezone=None, horizon_file=None):
+  # Calendar of the records with 'ra'/'dec' for nights starting at first (date);
+  # horizon_file: the horizon of another site ("" flat), default the current one
+  nights = config.calendar['nights'] if nights is None else nights
+  latitude = config.coordinates['latitude'] if latitude is None else latitude
+  longitude = config.coordinates['longitude'] if longitude is None else longitude
+  min_alt = config.calendar['min_alt'] if min_alt is None else min_alt
+  dark_sun_alt = config.scoring['dark_sun_alt'] if dark_sun_alt is None else dark_sun_alt
+  step = config.calendar['step'] if step is None else step
+  timezone = config.coordinates['timezone'] if timezone is None else timezone
+  positions = skymath.Positions(records)
+  jd = night_grid(first, nights, step, pytz.timezone(timezone))
+  lst = skymath.sidereal_time(jd, longitude)
+
+  # usable samples: Sun below dark_sun_alt, Moon (topocentric) below the horizon
+  sun_up = skymath.horizontal(skymath.sun(jd), lst, latitude)[0]
+  moon_vectors, parallax = skymath.moon(jd)
+  moon_up = skymath.horizontal(moon_vectors, lst, latitude)[0]
+  moon_alt = np.degrees(np.arcsin(moon_up)) - parallax * np.sqrt(1.0 - moon_up * moon_up)
+  usable = (np.degrees(np.arcsin(sun_up)) < dark_sun_alt) & (moon_alt < 0.0)
+
+  # precession changes the positions by < 0.01 deg within a year
+  vectors = positions.vectors @ skymath.precession(float(jd.mean())).T
+  objects = len(positions)
+  counts = np.zeros(objects * nights, dtype=np.int64)
+  blocked = (horizon.get() if horizon_file is None else horizon.profile_of(horizon_file)) is not None
+  for start in range(0, nights, BLOCK):
+    block = usable[start:start + BLOCK]
+    night = (np.arange(start, start + len(block))[:, None] + np.zeros(block.shape, dtype=np.int64))[block]
+    up, north, east = skymath.horizontal(vectors[:, None, :], lst[start:start + BLOCK][block][None, :], latitude)
+    alts = np.degrees(np.arcsin(np.clip(up, -1.0, 1.0)))
+    limit = horizon.limit(np.degrees(np.arctan2(east, north)), min_alt, horizon_file) if blocked else min_alt
+    cells = (np.arange(objects)[:, None] * nights + night[None, :])[alts > limit]
+    counts += np.bincount(cells, minlength=objects * nights)
+  quarters = np.minimum(np.round(counts.reshape(objects, nights) * step / 15.0), 255).astype(np.uint8)
+  return Calendar(first, [r['name'] for r in positions.records], quarters, float(min_alt), float(dark_sun_alt))
+
+def write(filename, cal):
+  block = "\n".join(cal.names).encode('utf-8')
+  if len(block) % 2 == 1:
+    block += b"\n"
+  tmp = filename + "." + str(os.getpid()) + ".tmp"
+  with open(tmp, 'wb') as f:
+    f.write(HEADER.pack(MAGIC, VERSION, cal.nights(), len(cal.names), len(block), cal.first.toordinal(), cal.min_alt, cal.dark_sun_alt, cal.key))
+    f.write(block)
+    f.write(np.ascontiguousarray(cal.quarters, dtype=np.uint8).tobytes())
+  os.replace(tmp, filename)
+
+def read(filename):
+  with open(filename, 'rb') as f:
+    data = f.read()
+  magic, version = struct.unpack_from("<4sH", data)
+  if magic != MAGIC or version != VERSION:
+    raise ValueError("Not a DSO calendar file: " + str(filename))
+  _, _, nights, objects, length, first, min_alt, dark_sun_alt, key = HEADER.unpack_from(data)
+  offset = HEADER.size
+  names = data[offset:offset + length].decode('utf-8').rstrip("\n").split("\n") if objects > 0 else []
+  quarters = np.frombuffer(data, dtype=np.uint8, count=objects * nights, offset=offset + length).reshape(objects, nights)
+  return Calendar(datetime.date.fromordinal(first), names, quarters, min_alt, dark_sun_alt, key)
+
+def load(filename):
+  # cached Calendar of a file, None if there is none or it is not readable
+  # (an earlier version)
+  try:
+    st = os.stat(filename)
+  except OSError:
+    return None
+  cached = loaded.get(filename)
+  if cached is not None and cached[0] == st.st_mtime_ns:
+    return cached[1]
+  try:
+    cal = read(filename)
+  except (OSError, ValueError, struct.error) as e:
+    print("Calendar " + str(filename) + " not readable: " + str(e))
+    return None
+  cal.version = "calendar-" + format(st.st_mtime_ns, 'x')
+  # only the current one of a data directory (site) is kept
+  for old in [f for f in loaded if os.path.dirname(f) == os.path.dirname(filename)]:
+    del loaded[old]
+  loaded[filename] = (st.st_mtime_ns, cal)
+  return cal
+
+def get(root, first, records, site=None):
+  # Calendar starting at first (date), calculated from records if it does not
+  # exist yet or was computed from other objects or settings; for the site
+  # profile (sites.py) if given, else the home site
+  filename = calendar_file(root, first.strftime("%d.%m.%Y"))
+  key = objects_key(records)
+  cal = load(filename)
+  if cal is not None and cal.current(key):
+    return cal
+  with lock:
+    cal = load(filename) # calculated while waiting
+    if cal is not None and cal.current(key):
+      return cal
+    t0 = time.time()
+    if site is None:
+      cal = compute(records, first)
+    else:
+      cal = compute(records, first, latitude=site['latitude'], longitude=site['longitude'], timezone=site['timezone'], horizon_file=site['horizon'])
+    cal.key = key
+    stats['calculations'] += 1
+    write(filename, cal)
+    # the new calendar replaces the ones of earlier days
+    for old in glob.glob(os.path.join(root, "calendar_*.bin")):
+      if old != filename:
+        os.remove(old)
+    if debug:
+      print("Calendar of " + str(len(cal.names)) + " objects x " + str(cal.nights()) + " nights in " + str(round(time.time() - t0, 2)) + " s")
+  return load(filename)
+
+parser = optparse.OptionParser()
+parser.add_option('-d', '--date',
+    action="store", dest="date",
+    help="First night dd.mm.yyyy, default today", default=None)
+parser.add_option('-n', '--name',
+    action="store", dest="name",
+    help="Show the nights of this object", default=None)
+
+if __name__ == '__main__':
+  import catalogue
+  options, args = parser.parse_args()
+  first = datetime.datetime.strptime(options.date, "%d.%m.%Y").date() if options.date else datetime.date.today()
+  cat = None
+  for day in (first, first - datetime.timedelta(days=1), datetime.date.today()):
+    cat = catalogue.load(config.paths['data'], day.strftime("%d.%m.%Y"))
+    if cat is not None and len(cat.positions) > 0:
+      break
+  if cat is None or len(cat.positions) == 0:
+    print("No DSO catalogue with coordinates")
+  else:
+    t0 = time.time()
+    cal = get(config.paths['data'], first, cat.records)
+    print("Calendar " + str(len(cal.names)) + " objects x " + str(cal.nights()) + " nights from " + str(cal.first) + " (" + str(round(time.time() - t0, 2)) + " s)")
+    if options.name is not None and options.name in cal.index:
+      hours = cal.hours()[cal.index[options.name]]
+      for day, h in zip(cal.dates(), hours):
+        if h > 0:
+          print(day.strftime("%d.%m.%Y") + " " + str(h) + " h")